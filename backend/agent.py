@@ -1,8 +1,9 @@
 # backend/agent.py
-from typing import List, Dict, Any
-from . import config, llm
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+from . import config, llm, llm_cache, reply_sources, classifier, prompt_budget, outbox
 from .models import SpecItem
 from . import event_log as log
+from .concurrency import map_bounded, llm_limiter
 import json as _json
 
 def _clip(obj, max_chars: int = 1800):
@@ -15,21 +16,22 @@ def _clip(obj, max_chars: int = 1800):
         return {"_truncated": True, "preview": s[:max_chars]}
     return obj
 
-def create_quote_schemas(specs: List[SpecItem]) -> List[Dict[str, Any]]:
+def create_quote_schemas(specs: Iterable[SpecItem]) -> List[Dict[str, Any]]:
+    """Accepts a list or a lazy iterator (e.g. F.iter_specs_zip) so LLM calls start as items arrive."""
     sys = config.get_prompt("INITIAL_QUOTE_SYS")
-    results: List[Dict[str, Any]] = []
-    with log.span("create_quote_schemas", items=len(specs)) as sp:
-        for item in specs:
+    with log.span("create_quote_schemas", items=len(specs) if hasattr(specs, "__len__") else None) as sp:
+        def build(item: SpecItem) -> Dict[str, Any]:
+            excerpt, budget = prompt_budget.fit_text(item.raw_text, config.QUOTE_SPEC_TOKEN_BUDGET, hints=[item.title])
             user = {
                 "instruction": "Generate initial quote schema for this SKU/service.",
                 "sku_id": item.sku_id,
                 "title": item.title,
-                "raw_text_excerpt": item.raw_text[:2000],
+                "raw_text_excerpt": excerpt,
                 "expected_components": ["specification", "OTIF", "payment_timeline", "price"],
                 "notes": "If any component is missing in spec, infer reasonable defaults; leave supplier_bids empty."
             }
             images = item.images if item.images else None
-            sp.update("llm_request", sku_id=item.sku_id, input=_clip(user), images=len(images or []))
+            sp.update("llm_request", sku_id=item.sku_id, input=_clip(user), images=len(images or []), spec_budget=budget)
             data = llm.generate_json(system_prompt=sys, user_prompt=_json.dumps(user, ensure_ascii=False), images=images)
             # Normalize required structure
             data.setdefault("sku_id", item.sku_id)
@@ -38,52 +40,274 @@ def create_quote_schemas(specs: List[SpecItem]) -> List[Dict[str, Any]]:
             for comp in ["specification", "OTIF", "payment_timeline", "price"]:
                 data["components"].setdefault(comp, {"ideal_value": None, "floor_value": None, "supplier_bids": []})
             sp.update("llm_response", sku_id=item.sku_id, output=_clip(data), components=list(data["components"].keys()))
-            results.append(data)
+            return data
+        results = map_bounded(build, specs, limiter=llm_limiter())
     return results
 
 def categorize_items(quotes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Local classifier first (keyword rules, then nearest confirmed examples); only items it is
+    not confident about go to the LLM. Each categorize_result records the path taken.
+    """
     sys = config.get_prompt("CATEGORIZE_SKU_SERVICE_SYS")
-    out = []
-    with log.span("categorize_items", count=len(quotes)) as sp:
+    batch_size = max(1, config.CATEGORIZE_BATCH_SIZE)
+    with log.span("categorize_items", count=len(quotes), batch_size=batch_size) as sp:
+        paths = {"rule": 0, "knn": 0, "llm_batch": 0, "llm": 0}
+
+        def result(q: Dict[str, Any], path: str) -> None:
+            paths[path] += 1
+            sp.update("categorize_result", sku_id=q["sku_id"], category=q["category"], confidence=q["confidence"],
+                      rationale=q["rationale"], path=path)
+
+        pending = []
         for q in quotes:
+            local = classifier.classify(q)
+            if local is None:
+                pending.append(q)
+                continue
+            _apply_category(q, local)
+            result(q, local["path"])
+
+        def categorize(q: Dict[str, Any]) -> Dict[str, Any]:
             user = {"sku_id": q.get("sku_id"), "title": q.get("title"), "components": q.get("components", {})}
             sp.update("categorize_request", sku_id=q.get("sku_id"), input=_clip(user))
             resp = llm.generate_json(system_prompt=sys, user_prompt=_json.dumps(user, ensure_ascii=False))
-            q["category"] = resp.get("category", "Uncategorized")
-            q["confidence"] = resp.get("confidence", 0.5)
-            q["rationale"] = resp.get("rationale", "")
-            sp.update("categorize_result", sku_id=q["sku_id"], category=q["category"], confidence=q["confidence"], rationale=q["rationale"])
-            out.append(q)
-    return out
+            _apply_category(q, resp)
+            result(q, "llm")
+            return q
+
+        batch_sys = config.get_prompt("CATEGORIZE_SKU_BATCH_SYS")
+        def categorize_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            """Categorize a batch in one request; returns the quotes that still need a per-item call."""
+            user = {"items": [{"sku_id": q.get("sku_id"), "title": q.get("title"), "components": q.get("components", {})} for q in batch]}
+            sp.update("categorize_batch_request", sku_ids=[q.get("sku_id") for q in batch], input=_clip(user))
+            resp = llm.generate_json(system_prompt=batch_sys, user_prompt=_json.dumps(user, ensure_ascii=False))
+            by_sku = {}
+            for entry in resp.get("items") or []:
+                if isinstance(entry, dict) and entry.get("sku_id") is not None and _valid_category(entry):
+                    by_sku.setdefault(str(entry["sku_id"]), entry)
+            missing = []
+            for q in batch:
+                entry = by_sku.get(str(q.get("sku_id")))
+                if entry is None:
+                    missing.append(q)
+                    continue
+                _apply_category(q, entry)
+                result(q, "llm_batch")
+            return missing
+
+        requests = fallbacks = 0
+        if batch_size == 1:
+            map_bounded(categorize, pending, limiter=llm_limiter())
+            requests = len(pending)
+        elif pending:
+            batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            missing = [q for m in map_bounded(categorize_batch, batches, limiter=llm_limiter()) for q in m]
+            if missing:
+                sp.update("categorize_batch_fallback", sku_ids=[q.get("sku_id") for q in missing])
+                map_bounded(categorize, missing, limiter=llm_limiter())
+            requests, fallbacks = len(batches) + len(missing), len(missing)
+        learned = classifier.learn(pending)
+        sp.update("categorize_summary", requests=requests, fallbacks=fallbacks, paths=paths, learned=learned)
+    return list(quotes)
+
+def _valid_category(resp: Dict[str, Any]) -> bool:
+    cat = resp.get("category")
+    return isinstance(cat, str) and bool(cat.strip())
+
+def _apply_category(q: Dict[str, Any], resp: Dict[str, Any]) -> None:
+    q["category"] = resp.get("category", "Uncategorized")
+    q["confidence"] = resp.get("confidence", 0.5)
+    q["rationale"] = resp.get("rationale", "")
 
 def prepare_initial_emails(grouped: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    EMAIL_COMPOSE_MODE="per_supplier": one LLM call per supplier.
+    EMAIL_COMPOSE_MODE="template": one LLM call per category, rendered locally per supplier;
+    suppliers flagged for personalization still get their own call.
+    """
     sys = config.get_prompt("INITIAL_EMAIL_SYS")
-    emails = []
-    with log.span("prepare_initial_emails", categories=len(grouped)) as sp:
+    mode = config.EMAIL_COMPOSE_MODE
+    jobs = []
+    with log.span("prepare_initial_emails", categories=len(grouped), mode=mode) as sp:
         for category, bundle in grouped.items():
             skus = [{"sku_id": q["sku_id"], "title": q.get("title", q["sku_id"])} for q in bundle.get("quotes", [])]
             suppliers = bundle.get("suppliers", [])
             sp.update("compose_batch", category=category, skus=[s["sku_id"] for s in skus], suppliers=len(suppliers))
-            for supplier in suppliers:
-                user = {
-                    "supplier_name": supplier["name"],
-                    "to_email": supplier["email"],
-                    "category": category,
-                    "skus": skus
-                }
-                resp = llm.generate_json(system_prompt=sys, user_prompt=_json.dumps(user, ensure_ascii=False))
-                email = {
-                    "to_email": supplier["email"],
-                    "to_name": supplier["name"],
-                    "subject": resp.get("subject") or f"RFQ for {category} items",
-                    "body": resp.get("body") or f"Hello {supplier['name']},\nPlease quote for attached items.\nThanks.",
-                    "meta": {"category": category, "supplier_id": supplier.get("id")}
-                }
-                sp.update("email_composed", to=supplier["email"], subject=email["subject"][:100])
-                emails.append(email)
+            jobs.extend((category, skus, supplier) for supplier in suppliers)
+
+        def email_for(category, skus, supplier, resp, composed_by) -> Dict[str, Any]:
+            email = {
+                "to_email": supplier["email"],
+                "to_name": supplier["name"],
+                "subject": resp.get("subject") or f"RFQ for {category} items",
+                "body": resp.get("body") or f"Hello {supplier['name']},\nPlease quote for attached items.\nThanks.",
+                "meta": {"category": category, "supplier_id": supplier.get("id"), "sku_ids": [s["sku_id"] for s in skus],
+                         "items_digest": outbox.items_digest(skus)}
+            }
+            sp.update("email_composed", to=supplier["email"], subject=email["subject"][:100], composed_by=composed_by)
+            return email
+
+        def compose(job) -> Dict[str, Any]:
+            category, skus, supplier = job
+            user = {
+                "supplier_name": supplier["name"],
+                "to_email": supplier["email"],
+                "category": category,
+                "skus": skus
+            }
+            resp = llm.generate_json(system_prompt=sys, user_prompt=_json.dumps(user, ensure_ascii=False))
+            return email_for(category, skus, supplier, resp, "llm")
+
+        if mode != "template":
+            return map_bounded(compose, jobs, limiter=llm_limiter())
+
+        tmpl_sys = config.get_prompt("INITIAL_EMAIL_TEMPLATE_SYS")
+        personal = [job for job in jobs if _wants_personalization(job[2])]
+        personal_ids = {id(job) for job in personal}
+        categories = list(dict.fromkeys(job[0] for job in jobs if id(job) not in personal_ids))
+        skus_by_cat = {job[0]: job[1] for job in jobs}
+
+        def make_template(category: str) -> Dict[str, Any]:
+            user = {"category": category, "skus": skus_by_cat[category], "placeholders": ["{supplier_name}"]}
+            resp = llm.generate_json(system_prompt=tmpl_sys, user_prompt=_json.dumps(user, ensure_ascii=False))
+            sp.update("template_composed", category=category, subject=(resp.get("subject") or "")[:100])
+            return resp
+
+        templates = dict(zip(categories, map_bounded(make_template, categories, limiter=llm_limiter())))
+        personalized = iter(map_bounded(compose, personal, limiter=llm_limiter()))
+        emails = []
+        for job in jobs:
+            if id(job) in personal_ids:
+                emails.append(next(personalized))
+                continue
+            category, skus, supplier = job
+            emails.append(email_for(category, skus, supplier, _render_template(templates[category], supplier), "template"))
+        sp.update("compose_summary", llm_calls=len(categories) + len(personal), emails=len(emails))
     return emails
 
+def _wants_personalization(supplier: Dict[str, Any]) -> bool:
+    flag = supplier.get("personalize")
+    if isinstance(flag, str):
+        flag = flag.strip().lower() in ("1", "true", "yes")
+    return bool(flag) or str(supplier.get("id")) in config.EMAIL_PERSONALIZE_SUPPLIERS \
+        or str(supplier.get("name")) in config.EMAIL_PERSONALIZE_SUPPLIERS
+
+def _render_template(tmpl: Dict[str, Any], supplier: Dict[str, Any]) -> Dict[str, Any]:
+    """Plain placeholder substitution (not str.format: LLM bodies may contain stray braces)."""
+    out = {}
+    for field in ("subject", "body"):
+        text = tmpl.get(field)
+        if isinstance(text, str) and text:
+            out[field] = text.replace("{supplier_name}", supplier["name"])
+    return out
+
+def extract_reply_components(replies: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Fill "components" of free-text replies (reply_sources shape, or the nested reply dict) via the LLM.
+    Replies that already carry components pass through untouched. Results are cached by reply
+    body, short replies share a request (REPLY_EXTRACT_BATCH_SIZE) and requests run with
+    bounded concurrency. Input is consumed in windows, so memory stays bounded; order is kept.
+    """
+    sys = config.get_prompt("REPLY_EXTRACT_SYS")
+    batch_sys = config.get_prompt("REPLY_EXTRACT_BATCH_SYS")
+    batch_size = max(1, config.REPLY_EXTRACT_BATCH_SIZE)
+    window = batch_size * max(1, config.LLM_MAX_CONCURRENCY) * 4
+    stats = {"replies": 0, "passthrough": 0, "cached": 0, "requests": 0, "fallbacks": 0, "empty": 0}
+    with log.span("extract_reply_components", batch_size=batch_size) as sp:
+        def cache_key(r: Dict[str, Any]) -> str:
+            # Per (SKU, body): one email can quote several SKUs
+            return llm_cache.make_key(sys, f"{r['sku_id']}\n{r['raw_reply']}")
+
+        def extract(r: Dict[str, Any]) -> Dict[str, Any]:
+            user = {"sku_id": r["sku_id"], "supplier": r["supplier"], "reply": r["raw_reply"]}
+            resp = llm.generate_json(system_prompt=sys, user_prompt=_json.dumps(user, ensure_ascii=False))
+            return _clean_components(resp.get("components"))
+
+        def extract_batch(batch: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+            user = {"items": [{"id": str(i), "sku_id": r["sku_id"], "supplier": r["supplier"], "reply": r["raw_reply"]}
+                              for i, r in enumerate(batch)]}
+            resp = llm.generate_json(system_prompt=batch_sys, user_prompt=_json.dumps(user, ensure_ascii=False))
+            by_id = {}
+            for entry in resp.get("items") or []:
+                if isinstance(entry, dict) and isinstance(entry.get("components"), dict):
+                    by_id.setdefault(str(entry.get("id")), _clean_components(entry["components"]))
+            return [by_id.get(str(i)) for i in range(len(batch))]
+
+        def run_window(items: List[Dict[str, Any]]) -> None:
+            todo: Dict[str, List[Dict[str, Any]]] = {}  # cache key -> replies with that body
+            for r in items:
+                stats["replies"] += 1
+                if r.get("components") or not (r.get("raw_reply") or "").strip():
+                    stats["passthrough"] += 1
+                    continue
+                key = cache_key(r)
+                if key in todo:
+                    todo[key].append(r)
+                    continue
+                hit = llm_cache.get(key)
+                if hit is not None:
+                    stats["cached"] += 1
+                    r["components"] = dict(hit.get("components") or {})
+                    continue
+                todo[key] = [r]
+            if not todo:
+                return
+            firsts = [rs[0] for rs in todo.values()]
+            short = [r for r in firsts if len(r["raw_reply"]) <= config.REPLY_EXTRACT_BATCH_CHARS]
+            singles = [r for r in firsts if len(r["raw_reply"]) > config.REPLY_EXTRACT_BATCH_CHARS]
+            found: Dict[int, Dict[str, Any]] = {}
+            if batch_size > 1 and len(short) > 1:
+                batches = [short[i:i + batch_size] for i in range(0, len(short), batch_size)]
+                stats["requests"] += len(batches)
+                for batch, comps in zip(batches, map_bounded(extract_batch, batches, limiter=llm_limiter())):
+                    for r, c in zip(batch, comps):
+                        if c is None:
+                            singles.append(r)
+                            stats["fallbacks"] += 1
+                        else:
+                            found[id(r)] = c
+            else:
+                singles.extend(short)
+            stats["requests"] += len(singles)
+            for r, c in zip(singles, map_bounded(extract, singles, limiter=llm_limiter())):
+                found[id(r)] = c
+            for key, rs in todo.items():
+                comps = found.get(id(rs[0])) or {}
+                if comps:
+                    llm_cache.put(key, {"components": comps})
+                else:
+                    stats["empty"] += 1
+                    sp.update("reply_without_terms", level="WARNING", sku_id=rs[0]["sku_id"], supplier=rs[0]["supplier"])
+                for r in rs:
+                    r["components"] = dict(comps)
+
+        buf: List[Dict[str, Any]] = []
+        for r in reply_sources.iter_replies(replies):
+            buf.append(r)
+            if len(buf) >= window:
+                run_window(buf)
+                yield from buf
+                buf = []
+        if buf:
+            run_window(buf)
+            yield from buf
+        sp.update("extract_summary", **stats)
+
+def _clean_components(comps: Any) -> Dict[str, Any]:
+    """Keep numbers and [low, high] ranges; drop anything the scorer can't use."""
+    out: Dict[str, Any] = {}
+    for k, v in (comps or {}).items() if isinstance(comps, dict) else ():
+        if isinstance(v, bool):
+            continue
+        if isinstance(v, (int, float)):
+            out[k] = v
+        elif isinstance(v, (list, tuple)) and v and all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in v):
+            out[k] = list(v)
+    return out
+
 def enrich_with_supplier_bids(quotes: List[Dict[str, Any]], bids: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Nest bids into the quotes (one dict per bid and component). The pipeline uses bid_store.BidStore instead."""
     by_sku = {q["sku_id"]: q for q in quotes}
     with log.span("enrich_with_supplier_bids", skus=len(by_sku), bids=len(bids)) as sp:
         for bid in bids:
@@ -104,7 +328,7 @@ def enrich_with_supplier_bids(quotes: List[Dict[str, Any]], bids: List[Dict[str,
                     "source": "range_avg" if isinstance(val, (list, tuple)) else "quoted",
                     "raw": bid.get("raw_reply", "")
                 })
-                sp.update("bid_added", sku_id=sku, supplier=supplier_name, component=comp, value=normalized_val)
+                sp.update("bid_added", level="DEBUG", sku_id=sku, supplier=supplier_name, component=comp, value=normalized_val)
     return list(by_sku.values())
 
 def _avg(x):
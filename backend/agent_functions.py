@@ -1,67 +1,161 @@
 # backend/agent_functions.py
-import os, zipfile, json
-from typing import List, Dict, Any
-from pathlib import Path
+import os, zipfile, json, shutil, signal, threading, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from io import BytesIO
+from typing import List, Dict, Any, Iterator, Optional
+from pathlib import Path, PurePosixPath
 from .models import SpecItem, Bid
-from . import config
+from . import config, reply_sources
 from . import event_log as log
 
 def parse_specs_zip(zip_path: str) -> List[SpecItem]:
-    """Extracts the zip and returns a list of SpecItem."""
-    items: List[SpecItem] = []
+    """Reads the zip and returns a list of SpecItem."""
+    return list(iter_specs_zip(zip_path))
+
+def iter_specs_zip(zip_path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[SpecItem]:
+    """
+    Yields SpecItem per archive member, reading straight from the ZipFile.
+    Text and PDFs are decoded in memory; only images (and rendered PDF pages)
+    are written under results/tmp_specs, since SpecItem.images holds file paths.
+    PDFs are handed to a process pool (PDF_WORKERS) and yielded back in archive order.
+    start/stop read one slice of the sorted members (a shard); SKU ids stay those of the
+    whole archive, and the shard spills images to its own directory.
+    """
     extract_dir = Path(config.RESULTS_DIR) / "tmp_specs"
-    with log.span("parse_specs_zip", zip_path=str(zip_path)) as sp:
-        if extract_dir.exists():
-            for p in extract_dir.rglob("*"):
-                if p.is_file(): p.unlink()
-            for p in sorted(extract_dir.glob("*"), reverse=True):
-                if p.is_dir(): p.rmdir()
-        extract_dir.mkdir(parents=True, exist_ok=True)
-
-        with zipfile.ZipFile(zip_path, 'r') as z:
-            z.extractall(extract_dir)
-        sp.update("extracted", files=len(list(extract_dir.rglob("*"))))
-
-        counter = 1
-        for path in sorted(extract_dir.rglob("*")):
-            if path.is_dir():
-                continue
-            suffix = path.suffix.lower()
-            sku_id = f"SKU-{counter:03d}"
-            counter += 1
-
-            if suffix == ".pdf":
-                images = []
-                if config.ENABLE_PDF_TO_IMAGE:
-                    try:
-                        from pdf2image import convert_from_path
-                        pages = convert_from_path(str(path), poppler_path=config.POPPLER_PATH)
-                        for i, pg in enumerate(pages[:2]):
-                            out = path.with_suffix(f".page{i+1}.jpg")
-                            pg.save(out, "JPEG")
-                            images.append(str(out))
-                    except Exception as e:
-                        sp.update("pdf_to_image_failed", file=str(path), error=str(e))
-                raw_text = _extract_pdf_text(path)
-                items.append(SpecItem(sku_id=sku_id, title=path.stem, raw_text=raw_text, images=images, metadata={"path": str(path)}))
-                sp.update("item_built_pdf", sku_id=sku_id, file=str(path), images=len(images), text_len=len(raw_text or ""))
-            elif suffix in (".txt", ".md", ".csv"):
-                raw_text = path.read_text(encoding="utf-8", errors="ignore")
-                items.append(SpecItem(sku_id=sku_id, title=path.stem, raw_text=raw_text, images=[], metadata={"path": str(path)}))
-                sp.update("item_built_text", sku_id=sku_id, file=str(path), text_len=len(raw_text))
-            elif suffix in (".png", ".jpg", ".jpeg"):
-                items.append(SpecItem(sku_id=sku_id, title=path.stem, raw_text="", images=[str(path)], metadata={"path": str(path)}))
-                sp.update("item_built_image", sku_id=sku_id, file=str(path))
-            else:
-                items.append(SpecItem(sku_id=sku_id, title=path.stem, raw_text="", images=[], metadata={"path": str(path), "note": "Unsupported file type"}))
-                sp.update("item_built_other", sku_id=sku_id, file=str(path), note="unsupported")
-        sp.update("items_ready", count=len(items))
-    return items
-
-def _extract_pdf_text(pdf_path: Path) -> str:
+    if start or stop is not None:
+        extract_dir = extract_dir / f"shard-{start:06d}"
+    with log.span("parse_specs_zip", zip_path=str(zip_path), pdf_workers=config.PDF_WORKERS, start=start, stop=stop) as sp:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        count = 0
+        pending: deque = deque()  # SpecItem, or (future, sku_id, name) awaiting a worker
+        window = max(1, config.PDF_WORKERS) * 2  # bounds PDF bytes held in flight
+        pool = None
+        try:
+            with zipfile.ZipFile(zip_path, 'r') as z:
+                members = sorted(i.filename for i in z.infolist() if not i.is_dir())[start:stop]
+                sp.update("listed", files=len(members))
+                for counter, name in enumerate(members, start=start + 1):
+                    sku_id = f"SKU-{counter:03d}"
+                    if name.lower().endswith(".pdf") and config.PDF_WORKERS > 0:
+                        if pool is None:
+                            pool = ProcessPoolExecutor(max_workers=config.PDF_WORKERS)
+                        job = (name, z.read(name), _page_paths(extract_dir, name), config.PDF_TIMEOUT_S)
+                        pending.append((pool.submit(_pdf_job, *job), sku_id, name))
+                    else:
+                        pending.append(_spec_from_member(z, name, sku_id, extract_dir, sp))
+                    while pending and (isinstance(pending[0], SpecItem) or len(pending) >= window):
+                        yield _resolve(pending.popleft(), sp)
+                        count += 1
+            while pending:
+                yield _resolve(pending.popleft(), sp)
+                count += 1
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        sp.update("items_ready", count=count)
+
+def _resolve(entry, sp) -> SpecItem:
+    if isinstance(entry, SpecItem):
+        return entry
+    fut, sku_id, name = entry
+    try:
+        # Workers enforce the timeout themselves where SIGALRM exists; this is the backstop.
+        result = fut.result(timeout=config.PDF_TIMEOUT_S + 5 if config.PDF_TIMEOUT_S else None)
+    except FuturesTimeout:
+        fut.cancel()
+        result = {"text": "", "images": [], "timed_out": True, "duration_ms": None, "image_error": None}
+    except Exception as e:
+        result = {"text": "", "images": [], "timed_out": False, "duration_ms": None, "image_error": None, "error": str(e)}
+    return _pdf_item(sku_id, name, result, sp)
+
+def _pdf_item(sku_id: str, name: str, result: Dict[str, Any], sp) -> SpecItem:
+    sp.update("pdf_extracted", sku_id=sku_id, file=name, duration_ms=result.get("duration_ms"),
+              timed_out=result.get("timed_out", False), error=result.get("error"))
+    if result.get("image_error"):
+        sp.update("pdf_to_image_failed", file=name, error=result["image_error"])
+    raw_text, images = result.get("text", ""), result.get("images", [])
+    sp.update("item_built_pdf", sku_id=sku_id, file=name, images=len(images), text_len=len(raw_text or ""))
+    meta = {"path": name}
+    if result.get("timed_out"):
+        meta["note"] = "PDF extraction timed out"
+    return SpecItem(sku_id=sku_id, title=PurePosixPath(name).stem, raw_text=raw_text, images=images, metadata=meta)
+
+def _page_paths(extract_dir: Path, name: str) -> List[str]:
+    if not config.ENABLE_PDF_TO_IMAGE:
+        return []
+    member = PurePosixPath(name)
+    return [str(_spill_path(extract_dir, member.with_suffix(f".page{i+1}.jpg"))) for i in range(2)]
+
+class _PdfTimeout(BaseException):
+    """BaseException, so the parsers' own `except Exception` fallbacks can't swallow the alarm."""
+
+def _raise_pdf_timeout(signum, frame):
+    raise _PdfTimeout()
+
+def _pdf_job(name: str, data: bytes, page_paths: List[str], timeout_s: float) -> Dict[str, Any]:
+    """Text extraction (+ optional page rasterization) for one PDF; runs in a worker process."""
+    t0 = time.time()
+    result: Dict[str, Any] = {"text": "", "images": [], "timed_out": False, "image_error": None}
+    use_alarm = bool(timeout_s) and hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        prev = signal.signal(signal.SIGALRM, _raise_pdf_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout_s)
+    try:
+        if page_paths:
+            try:
+                from pdf2image import convert_from_bytes
+                pages = convert_from_bytes(data, poppler_path=config.POPPLER_PATH, last_page=len(page_paths),
+                                           timeout=timeout_s or None)
+                for pg, out in zip(pages, page_paths):
+                    pg.save(out, "JPEG")
+                    result["images"].append(out)
+            except Exception as e:
+                result["image_error"] = str(e)
+        result["text"] = _extract_pdf_text(BytesIO(data))
+    except _PdfTimeout:
+        result["timed_out"] = True
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, prev)
+    result["duration_ms"] = int((time.time() - t0) * 1000)
+    return result
+
+def _spec_from_member(z: zipfile.ZipFile, name: str, sku_id: str, extract_dir: Path, sp) -> SpecItem:
+    member = PurePosixPath(name)
+    suffix = member.suffix.lower()
+    title = member.stem
+
+    if suffix == ".pdf":
+        # In-process path (PDF_WORKERS=0)
+        result = _pdf_job(name, z.read(name), _page_paths(extract_dir, name), config.PDF_TIMEOUT_S)
+        return _pdf_item(sku_id, name, result, sp)
+    if suffix in (".txt", ".md", ".csv"):
+        raw_text = z.read(name).decode("utf-8", errors="ignore")
+        sp.update("item_built_text", sku_id=sku_id, file=name, text_len=len(raw_text))
+        return SpecItem(sku_id=sku_id, title=title, raw_text=raw_text, images=[], metadata={"path": name})
+    if suffix in (".png", ".jpg", ".jpeg"):
+        out = _spill_path(extract_dir, member)
+        with z.open(name) as src, open(out, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        sp.update("item_built_image", sku_id=sku_id, file=name)
+        return SpecItem(sku_id=sku_id, title=title, raw_text="", images=[str(out)], metadata={"path": name})
+    sp.update("item_built_other", sku_id=sku_id, file=name, note="unsupported")
+    return SpecItem(sku_id=sku_id, title=title, raw_text="", images=[], metadata={"path": name, "note": "Unsupported file type"})
+
+def _spill_path(extract_dir: Path, member: PurePosixPath) -> Path:
+    """Local path for a member that must exist on disk (guards against ../ in archive names)."""
+    parts = [p for p in member.parts if p not in ("", ".", "..", "/")]
+    out = extract_dir.joinpath(*parts)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    return out
+
+def _extract_pdf_text(pdf) -> str:
+    """pdf may be a path or a binary stream."""
     try:
         from pypdf import PdfReader
-        reader = PdfReader(str(pdf_path))
+        reader = PdfReader(pdf if isinstance(pdf, BytesIO) else str(pdf))
         texts = []
         for page in reader.pages[:5]:
             texts.append(page.extract_text() or "")
@@ -97,18 +191,24 @@ def parse_supplier_replies(source: str) -> Dict[str, Any]:
             sp.update("parse_failed", error=str(e))
             return {}
 
-def build_bid_payloads(replies: Dict[str, Any]) -> List[Bid]:
+def build_bid_payloads(replies: Any) -> List[Bid]:
+    """replies: the nested {supplier: {sku_id: payload}} dict or any reply iterable (see reply_sources)."""
     bids: List[Bid] = []
     with log.span("build_bid_payloads") as sp:
-        for supplier_key, skus in (replies or {}).items():
-            for sku_id, payload in (skus or {}).items():
-                components = payload.get("components", {})
-                bids.append(Bid(
-                    sku_id=sku_id,
-                    supplier_id=str(supplier_key),
-                    supplier_name=str(supplier_key),
-                    components=components,
-                    raw_reply=payload.get("raw_reply", "")
-                ))
-        sp.update("bids_built", suppliers=len(replies or {}), bids=len(bids))
+        suppliers = set()
+        for bid in iter_bid_payloads(replies):
+            suppliers.add(bid.supplier_id)
+            bids.append(bid)
+        sp.update("bids_built", suppliers=len(suppliers), bids=len(bids))
     return bids
+
+def iter_bid_payloads(replies: Any) -> Iterator[Bid]:
+    """Lazily turn replies into Bids, so a reply source can be consumed without buffering the inbox."""
+    for r in reply_sources.iter_replies(replies):
+        yield Bid(
+            sku_id=r["sku_id"],
+            supplier_id=r["supplier"],
+            supplier_name=r["supplier"],
+            components=r.get("components") or {},
+            raw_reply=r.get("raw_reply", ""),
+        )
@@ -0,0 +1,242 @@
+# backend/bid_store.py
+# Columnar storage for supplier bids, sized for events with millions of them.
+#
+# One row per (sku, supplier) in first-seen order -- the packing evaluator._pack_bids uses --
+# with SKU and supplier ids interned to ints, one float64 column per component (NaN where the
+# supplier did not bid on it, or quoted something unscoreable; a supplier's first bid per
+# component wins, even an unscoreable one) and every distinct raw reply stored once, referenced
+# by index. matrix() hands the evaluator its (keys, comps,
+# values, present) input without building per-bid dicts.
+from __future__ import annotations
+import math
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from . import event_log as log
+
+NAN = float("nan")
+# Per-cell source codes: no bid, quoted number, average of a quoted range, quoted but not a number
+NO_BID, QUOTED, RANGE_AVG, UNSCORED = 0, 1, 2, 3
+
+def bid_value(val: Any) -> Optional[float]:
+    """Scored value of a quoted component: ranges are averaged; only numbers are scored."""
+    if isinstance(val, (list, tuple)):
+        try:
+            val = sum(val) / len(val)
+        except Exception:
+            return None
+    if not isinstance(val, (int, float)):
+        return None
+    return float(val)
+
+def bid_fields(bid: Any) -> Tuple[str, str, Dict[str, Any], str]:
+    """(sku_id, supplier, components, raw_reply) of a Bid or a Bid-shaped dict."""
+    if not isinstance(bid, dict):
+        return bid.sku_id, bid.supplier_name, bid.components or {}, bid.raw_reply
+    supplier = bid.get("supplier_name", bid.get("supplier_id", "unknown"))
+    return bid["sku_id"], supplier, bid.get("components") or {}, bid.get("raw_reply", "")
+
+class BidStore:
+    __slots__ = ("skus", "suppliers", "replies", "comps", "columns", "sources",
+                 "row_sku", "row_supplier", "row_reply", "_sku_ix", "_supplier_ix", "_reply_ix", "_row_ix", "_known")
+
+    def __init__(self, sku_ids: Optional[Iterable[str]] = None):
+        self.skus: List[str] = []
+        self.suppliers: List[str] = []
+        self.replies: List[str] = [""]  # reply 0: none
+        self.comps: List[str] = []
+        self.columns: Dict[str, array] = {}   # comp -> float64 per row
+        self.sources: Dict[str, array] = {}   # comp -> source code per row
+        self.row_sku = array("i")
+        self.row_supplier = array("i")
+        self.row_reply = array("i")           # first non-empty reply of the row's bids
+        self._sku_ix: Dict[str, int] = {}
+        self._supplier_ix: Dict[str, int] = {}
+        self._reply_ix: Dict[str, int] = {"": 0}
+        # sku_ix << 32 | supplier_ix -> row; only needed while adding, dropped by compact()
+        self._row_ix: Optional[Dict[int, int]] = {}
+        self._known = set(sku_ids) if sku_ids is not None else None
+        for sku in sku_ids or ():
+            self._intern_sku(sku)
+
+    def __len__(self) -> int:
+        return len(self.row_sku)
+
+    @classmethod
+    def from_bids(cls, bids: Iterable[Any], sku_ids: Optional[Iterable[str]] = None) -> "BidStore":
+        """Build from Bids (or Bid-shaped dicts), e.g. a lazy iter_bid_payloads. Unknown SKUs are skipped."""
+        store = cls(sku_ids)
+        with log.span("build_bid_store", skus=len(store.skus)) as sp:
+            added = store.extend(bids)
+            store.compact()
+            sp.update("bid_store_built", bids=added.get("bids", 0), skipped_unknown_sku=added.get("skipped", 0),
+                      rows=len(store), suppliers=len(store.suppliers), components=len(store.comps),
+                      replies=len(store.replies) - 1, bytes=store.nbytes())
+        return store
+
+    @classmethod
+    def from_quotes(cls, quotes: List[Dict[str, Any]]) -> "BidStore":
+        """Pack quotes enriched the legacy way (components.*.supplier_bids)."""
+        store = cls(q["sku_id"] for q in quotes)
+        for q in quotes:
+            for comp, obj in (q.get("components") or {}).items():
+                for b in obj.get("supplier_bids", []):
+                    store.add(q["sku_id"], b["supplier"], {comp: b.get("value")}, b.get("raw", ""))
+        return store
+
+    # ---------- writes ----------
+
+    def extend(self, bids: Iterable[Any]) -> Dict[str, int]:
+        n = skipped = 0
+        for bid in bids:
+            if self.add(*bid_fields(bid)):
+                n += 1
+            else:
+                skipped += 1
+        return {"bids": n, "skipped": skipped}
+
+    def add(self, sku_id: str, supplier: str, components: Dict[str, Any], raw_reply: str = "",
+            replace: bool = False) -> bool:
+        """
+        Add one supplier reply for a SKU (an empty reply adds no row). With replace, a scoreable
+        value overrides the supplier's earlier one (late replies). False (nothing stored) for
+        SKUs outside the known set.
+        """
+        if self._known is not None and sku_id not in self._known:
+            return False
+        if not components:
+            return True
+        row = self._row(self._intern_sku(sku_id), self._intern(supplier, self.suppliers, self._supplier_ix))
+        if raw_reply and (replace or not self.row_reply[row]):
+            self.row_reply[row] = self._intern(raw_reply, self.replies, self._reply_ix)
+        for comp, val in components.items():
+            if comp not in self.columns:
+                self._column(comp)
+            src = self.sources[comp]
+            v = bid_value(val)
+            if src[row] != NO_BID and not (replace and v is not None):
+                continue
+            if v is None:
+                src[row] = UNSCORED
+            else:
+                self.columns[comp][row] = v
+                src[row] = RANGE_AVG if isinstance(val, (list, tuple)) else QUOTED
+        return True
+
+    def merge(self, other: "BidStore") -> None:
+        """Append another store's rows (e.g. one per shard; shards hold disjoint SKUs)."""
+        for sku, supplier, values, raw in other.iter_rows(unscored=True):
+            self.add(sku, supplier, values, raw)
+
+    def _intern(self, value: str, values: List[str], index: Dict[str, int]) -> int:
+        ix = index.get(value)
+        if ix is None:
+            ix = index[value] = len(values)
+            values.append(value)
+        return ix
+
+    def _intern_sku(self, sku_id: str) -> int:
+        return self._intern(sku_id, self.skus, self._sku_ix)
+
+    def compact(self) -> None:
+        """Drop the (sku, supplier) -> row lookup (most of the per-row overhead); add() rebuilds it."""
+        self._row_ix = None
+
+    def _rows_ix(self) -> Dict[int, int]:
+        if self._row_ix is None:
+            self._row_ix = {s << 32 | p: row for row, (s, p) in enumerate(zip(self.row_sku, self.row_supplier))}
+        return self._row_ix
+
+    def _row(self, sku_ix: int, supplier_ix: int) -> int:
+        key = sku_ix << 32 | supplier_ix
+        row = self._rows_ix().get(key)
+        if row is None:
+            row = self._row_ix[key] = len(self.row_sku)
+            self.row_sku.append(sku_ix)
+            self.row_supplier.append(supplier_ix)
+            self.row_reply.append(0)
+            for comp in self.comps:
+                self.columns[comp].append(NAN)
+                self.sources[comp].append(NO_BID)
+        return row
+
+    def _column(self, comp: str) -> None:
+        n = len(self.row_sku)
+        self.comps.append(comp)
+        self.columns[comp] = array("d", [NAN]) * n
+        self.sources[comp] = array("b", [NO_BID]) * n
+
+    # ---------- reads ----------
+
+    def matrix(self) -> Tuple[List[Tuple[str, str]], List[str], np.ndarray, np.ndarray]:
+        """(keys, comps, values, present) in the evaluator's packed layout."""
+        skus, suppliers = self.skus, self.suppliers
+        keys = [(skus[s], suppliers[p]) for s, p in zip(self.row_sku, self.row_supplier)]
+        if self.comps:
+            values = np.column_stack([np.frombuffer(self.columns[c], dtype=np.float64) for c in self.comps])
+        else:
+            values = np.empty((len(keys), 0))
+        return keys, list(self.comps), values, ~np.isnan(values)
+
+    def iter_rows(self, unscored: bool = False) -> Iterator[Tuple[str, str, Dict[str, Any], str]]:
+        """(sku_id, supplier, {comp: value}, raw_reply) per row; unscored bids appear as None if asked for."""
+        cols = [(c, self.columns[c], self.sources[c]) for c in self.comps]
+        for row, (s, p, r) in enumerate(zip(self.row_sku, self.row_supplier, self.row_reply)):
+            values = {c: (None if src[row] == UNSCORED else col[row]) for c, col, src in cols
+                      if src[row] != NO_BID and (unscored or src[row] != UNSCORED)}
+            yield self.skus[s], self.suppliers[p], values, self.replies[r]
+
+    def row_values(self, sku_id: str, supplier: str) -> Dict[str, float]:
+        """Scored values of one (sku, supplier) row; {} if it has none."""
+        s, p = self._sku_ix.get(sku_id), self._supplier_ix.get(supplier)
+        row = None if s is None or p is None else self._rows_ix().get(s << 32 | p)
+        if row is None:
+            return {}
+        return {c: self.columns[c][row] for c in self.comps if self.sources[c][row] in (QUOTED, RANGE_AVG)}
+
+    def rows_for(self, sku_id: str) -> List[Dict[str, Any]]:
+        """Bids on one SKU as table rows: supplier, one column per component, raw reply."""
+        ix = self._sku_ix.get(sku_id)
+        if ix is None:
+            return []
+        rows = np.flatnonzero(np.frombuffer(self.row_sku, dtype=np.int32) == ix)
+        out = []
+        for row in rows.tolist():
+            rec: Dict[str, Any] = {"supplier": self.suppliers[self.row_supplier[row]]}
+            for c in self.comps:
+                v = self.columns[c][row]
+                rec[c] = None if math.isnan(v) else v
+            rec["raw_reply"] = self.replies[self.row_reply[row]]
+            out.append(rec)
+        return out
+
+    def nbytes(self) -> int:
+        """Bytes held by the columns and row arrays (interned strings and the row lookup not included)."""
+        arrays = [self.row_sku, self.row_supplier, self.row_reply, *self.columns.values(), *self.sources.values()]
+        return sum(a.itemsize * len(a) for a in arrays)
+
+    # ---------- transport (sharded runs, JSON) ----------
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "skus": self.skus, "suppliers": self.suppliers, "replies": self.replies, "comps": self.comps,
+            "row_sku": self.row_sku.tolist(), "row_supplier": self.row_supplier.tolist(), "row_reply": self.row_reply.tolist(),
+            # JSON has no NaN: absent values travel as null
+            "columns": {c: [None if math.isnan(v) else v for v in self.columns[c]] for c in self.comps},
+            "sources": {c: self.sources[c].tolist() for c in self.comps},
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], sku_ids: Optional[Iterable[str]] = None) -> "BidStore":
+        """Inverse of to_dict; sku_ids restores the known-SKU filter for further add()s."""
+        store = cls()
+        store._known = set(sku_ids) if sku_ids is not None else None
+        store.skus, store.suppliers, store.replies, store.comps = list(d["skus"]), list(d["suppliers"]), list(d["replies"]), list(d["comps"])
+        store._sku_ix = {s: i for i, s in enumerate(store.skus)}
+        store._supplier_ix = {s: i for i, s in enumerate(store.suppliers)}
+        store._reply_ix = {s: i for i, s in enumerate(store.replies)}
+        store.row_sku, store.row_supplier, store.row_reply = (array("i", d[k]) for k in ("row_sku", "row_supplier", "row_reply"))
+        store.columns = {c: array("d", (NAN if v is None else v for v in d["columns"][c])) for c in store.comps}
+        store.sources = {c: array("b", d["sources"][c]) for c in store.comps}
+        store._row_ix = None
+        return store
@@ -0,0 +1,103 @@
+# backend/checkpoint.py
+# Per-run stage checkpoints keyed by a fingerprint of the stage's inputs.
+#
+# A stage's key hashes its name plus its deps: upstream stage keys, file digests, prompt
+# text, relevant config. Unchanged deps => the stored output is reused; any change
+# re-runs the stage and, through the chained keys, everything downstream of it.
+#
+# Outputs are stored as JSON (<run>/<stage>.json): stages whose output isn't plain data
+# pass dump/load converters. Nothing is unpickled, and a class change can't break a resume.
+from __future__ import annotations
+import hashlib, json, os
+from dataclasses import asdict, is_dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from . import config
+from . import event_log as log
+
+def fingerprint(obj: Any) -> str:
+    blob = json.dumps(_plain(obj), sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+def _plain(obj: Any) -> Any:
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return asdict(obj)
+    if isinstance(obj, (list, tuple)):
+        return [_plain(o) for o in obj]
+    if isinstance(obj, dict):
+        return {str(k): _plain(v) for k, v in obj.items()}
+    return obj
+
+def run_dir(run_id: str) -> Path:
+    return Path(config.CHECKPOINT_DIR) / run_id
+
+class Checkpointer:
+    def __init__(self, run_id: str, enabled: Optional[bool] = None):
+        self.run_id = run_id
+        self.enabled = config.CHECKPOINTS_ENABLED if enabled is None else enabled
+        self.keys: Dict[str, str] = {}
+
+    def _path(self, name: str) -> Path:
+        return run_dir(self.run_id) / f"{name}.json"
+
+    def stage(self, name: str, deps: List[Any], fn: Callable[[], Any],
+              dump: Optional[Callable[[Any], Any]] = None, load: Optional[Callable[[Any], Any]] = None) -> Any:
+        """
+        Return the checkpointed output for (name, deps) or run fn() and store its output.
+        dump/load convert the output to and from JSON-able data (default: dataclasses as dicts).
+        """
+        key = fingerprint([name, deps])
+        self.keys[name] = key
+        if self.enabled:
+            stored = self._read(name, load)
+            if stored is not None and stored.get("key") == key:
+                log.log_event("checkpoint", "hit", stage=name, key=key[:16])
+                return stored["output"]
+            log.log_event("checkpoint", "miss", stage=name, key=key[:16],
+                          reason="absent" if stored is None else "inputs_changed")
+        out = fn()
+        if self.enabled:
+            self._write(name, {"key": key, "output": (dump or _plain)(out)})
+        return out
+
+    def save(self, name: str, value: Any, deps: Optional[List[Any]] = None,
+             dump: Optional[Callable[[Any], Any]] = None) -> None:
+        """
+        Store a value outside stage(), for peek() on recovery. With deps it is keyed like a
+        stage output (for stages that update their stored output incrementally), so
+        downstream stages chain on ck.keys[name].
+        """
+        key = fingerprint([name, deps]) if deps is not None else ""
+        if deps is not None:
+            self.keys[name] = key
+        if self.enabled:
+            self._write(name, {"key": key, "output": (dump or _plain)(value)})
+
+    def peek(self, name: str, load: Optional[Callable[[Any], Any]] = None) -> Any:
+        """Last stored output for a stage regardless of inputs (session recovery); None if absent."""
+        stored = self._read(name, load)
+        if stored is None:
+            return None
+        self.keys[name] = stored.get("key", "")
+        return stored["output"]
+
+    def _read(self, name: str, load: Optional[Callable[[Any], Any]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(name), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if load is not None:
+                stored["output"] = load(stored["output"])
+            return stored
+        except (OSError, ValueError, KeyError, TypeError):
+            return None  # absent, torn or from an incompatible version: recompute
+
+    def _write(self, name: str, payload: Dict[str, Any]) -> None:
+        path = self._path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, default=str)
+        os.replace(tmp, path)  # never leave a half-written checkpoint behind
+
+def prompt_digest(*names: str) -> str:
+    return fingerprint([config.get_prompt(n) for n in names])
@@ -0,0 +1,220 @@
+# backend/classifier.py
+# Local categorization fast path, tried before the LLM in agent.categorize_items:
+#   1) keyword/regex rules from CATEGORY_RULES_FILE (plus the demo catalog's RULES when
+#      CLASSIFIER_DEMO_RULES is set); rules see titles with "_" and "-" turned into spaces
+#   2) TF-IDF nearest neighbours over confirmed categorizations (results/category_examples.jsonl:
+#      reviewed via confirm(), e.g. from the UI; LLM answers only with CLASSIFIER_AUTO_LEARN)
+# A result is only used when its confidence reaches CLASSIFIER_THRESHOLD.
+from __future__ import annotations
+import hashlib, json, math, re, threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from . import config
+from . import event_log as log
+
+# Categories of the demo supplier directory; other catalogs bring their own CATEGORY_RULES_FILE
+RULES: List[Tuple[str, str]] = [
+    ("Ball Bearings", r"\b(ball|roller|needle|thrust)\s+bearings?\b|\bbearings?\b"),
+    ("Gaskets", r"\bgaskets?\b|\bo\s?rings?\b|\bseals?\b"),
+    ("Computer Peripherals", r"\busb\b|\bhubs?\b|\bkeyboards?\b|\bmouse\b|\bmonitors?\b|\bwebcams?\b|\bdocking\b"),
+    ("Packaging Materials", r"\bcartons?\b|\bcorrugated\b|\bpallets?\b|\bstretch\s+film\b|\bpackaging\b|\bbubble\s+wrap\b"),
+    ("Electrical Components", r"\bresistors?\b|\bcapacitors?\b|\bconnectors?\b|\brelays?\b|\bfuses?\b|\bcables?\b"),
+    ("IT Services", r"\bsupport\s+contract\b|\bmanaged\s+services?\b|\bconsulting\b|\bsaas\b|\bsoftware\s+licen[cs]es?\b"),
+]
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SEPARATOR_RE = re.compile(r"[_\-]+")  # file-stem titles: ball_bearing_000001
+_LOCK = threading.Lock()
+_RULES: Optional[List[Tuple[str, "re.Pattern[str]"]]] = None
+_INDEX: Optional["_TfIdfIndex"] = None
+
+def _text(q: Dict[str, Any]) -> str:
+    return " ".join(str(q.get(k) or "") for k in ("title", "description")).strip()
+
+def _compiled_rules() -> List[Tuple[str, "re.Pattern[str]"]]:
+    global _RULES
+    if _RULES is None:
+        rules = list(RULES) if config.CLASSIFIER_DEMO_RULES else []
+        path = config.CATEGORY_RULES_FILE
+        if path and Path(path).exists():
+            # {"Category": ["regex", ...], ...}
+            for category, patterns in json.loads(Path(path).read_text(encoding="utf-8")).items():
+                rules.extend((category, p) for p in patterns)
+        _RULES = [(c, re.compile(p, re.I)) for c, p in rules]
+    return _RULES
+
+def match_rules(text: str) -> Optional[Dict[str, Any]]:
+    """The rule category when rules point to exactly one category; None if none or conflicting."""
+    text = _SEPARATOR_RE.sub(" ", text)
+    hits: Dict[str, str] = {}
+    for category, rx in _compiled_rules():
+        m = rx.search(text)
+        if m and category not in hits:
+            hits[category] = m.group(0)
+    if len(hits) != 1:
+        return None
+    category, matched = next(iter(hits.items()))
+    return {"category": category, "confidence": config.CLASSIFIER_RULE_CONFIDENCE,
+            "rationale": f"Keyword rule matched '{matched}'.", "path": "rule"}
+
+class _TfIdfIndex:
+    """Cosine similarity over TF-IDF vectors with an inverted index (pure Python)."""
+    def __init__(self):
+        self.docs: Dict[str, Tuple[str, Counter]] = {}  # normalized text -> (category, term counts)
+        self.df: Counter = Counter()
+        self._postings: Dict[str, List[Tuple[str, float]]] = {}
+        self._dirty = True
+
+    def add(self, text: str, category: str) -> bool:
+        key = " ".join(_tokens(text))
+        if not key:
+            return False
+        old = self.docs.get(key)
+        if old is not None and old[0] == category:
+            return False
+        if old is None:
+            self.df.update(set(key.split()))
+        self.docs[key] = (category, Counter(key.split()))
+        self._dirty = True
+        return True
+
+    def _idf(self, term: str) -> float:
+        return math.log((1 + len(self.docs)) / (1 + self.df.get(term, 0))) + 1.0
+
+    def _rebuild(self) -> None:
+        postings: Dict[str, List[Tuple[str, float]]] = {}
+        for key, (_, tf) in self.docs.items():
+            vec = {t: c * self._idf(t) for t, c in tf.items()}
+            norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+            for t, w in vec.items():
+                postings.setdefault(t, []).append((key, w / norm))
+        self._postings = postings
+        self._dirty = False
+
+    def exact(self, text: str) -> Optional[str]:
+        doc = self.docs.get(" ".join(_tokens(text)))
+        return doc[0] if doc else None
+
+    def nearest(self, text: str, k: int) -> List[Tuple[float, str, str]]:
+        """Top-k (similarity, category, doc text)."""
+        if self._dirty:
+            self._rebuild()
+        tf = Counter(_tokens(text))
+        vec = {t: c * self._idf(t) for t, c in tf.items() if t in self._postings}
+        norm = math.sqrt(sum(w * w for w in vec.values()))
+        if not norm:
+            return []
+        sims: Dict[str, float] = {}
+        for t, w in vec.items():
+            qw = w / norm
+            for key, dw in self._postings[t]:
+                sims[key] = sims.get(key, 0.0) + qw * dw
+        top = sorted(sims.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        return [(sim, self.docs[key][0], key) for key, sim in top]
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+def _index() -> _TfIdfIndex:
+    global _INDEX
+    if _INDEX is None:
+        idx = _TfIdfIndex()
+        path = Path(config.CLASSIFIER_EXAMPLES)
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        idx.add(rec["text"], rec["category"])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        _INDEX = idx
+    return _INDEX
+
+def match_neighbours(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Exact repeat of a confirmed item => confidence 1.0. Otherwise a similarity-weighted vote of
+    the nearest confirmed examples; confidence = best similarity x the winner's vote share.
+    """
+    with _LOCK:
+        idx = _index()
+        category = idx.exact(text)  # repeat catalog items: a dict lookup, no scoring
+        if category is not None:
+            return {"category": category, "confidence": 1.0, "rationale": "Same item text was confirmed before.", "path": "knn"}
+        top = idx.nearest(text, config.CLASSIFIER_NEIGHBOURS)
+    if not top:
+        return None
+    votes: Dict[str, float] = {}
+    for sim, category, _ in top:
+        votes[category] = votes.get(category, 0.0) + sim
+    category = max(votes, key=votes.get)
+    best_sim, _, best_text = next(t for t in top if t[1] == category)
+    confidence = round(best_sim * votes[category] / sum(votes.values()), 4)
+    return {"category": category, "confidence": confidence,
+            "rationale": f"Nearest confirmed item '{best_text[:60]}' (similarity {best_sim:.2f}).", "path": "knn"}
+
+def classify(q: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Category dict (category, confidence, rationale, path) when the local classifier is confident enough."""
+    if not config.CLASSIFIER_ENABLED:
+        return None
+    text = _text(q)
+    if not text:
+        return None
+    for match in (match_rules, match_neighbours):
+        result = match(text)
+        if result is not None and result["confidence"] >= config.CLASSIFIER_THRESHOLD:
+            return result
+    return None
+
+def confirm(items: Iterable[Tuple[str, str]]) -> int:
+    """Record (text, category) pairs as confirmed examples. Returns how many were new."""
+    new = []
+    with _LOCK:
+        idx = _index()
+        for text, category in items:
+            if text and category and idx.add(text, category):
+                new.append({"text": text, "category": category})
+        if new:
+            path = Path(config.CLASSIFIER_EXAMPLES)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in new))
+    if new:
+        log.log_event("classifier", "examples_added", level="DEBUG", added=len(new), total=len(idx.docs))
+    return len(new)
+
+def confirm_quotes(quotes: Iterable[Dict[str, Any]]) -> int:
+    """Record reviewed categorizations (e.g. accepted in the UI) as confirmed examples."""
+    return confirm((_text(q), q["category"]) for q in quotes if q.get("category") not in (None, "", "Uncategorized"))
+
+def learn(quotes: Iterable[Dict[str, Any]]) -> int:
+    """
+    Confirm unreviewed LLM categorizations at or above CLASSIFIER_LEARN_MIN confidence. Off unless
+    CLASSIFIER_AUTO_LEARN is set: the index would otherwise train on, and repeat, its own mistakes.
+    """
+    if not config.CLASSIFIER_AUTO_LEARN:
+        return 0
+    confident = []
+    for q in quotes:
+        try:
+            conf = float(q.get("confidence") or 0)
+        except (TypeError, ValueError):
+            continue
+        if conf >= config.CLASSIFIER_LEARN_MIN:
+            confident.append(q)
+    return confirm_quotes(confident)
+
+def state_digest() -> str:
+    """Digest of everything that decides local results (rules, examples, settings): a checkpoint dep."""
+    h = hashlib.sha256()
+    h.update(json.dumps([config.CLASSIFIER_ENABLED, config.CLASSIFIER_DEMO_RULES, config.CLASSIFIER_RULE_CONFIDENCE,
+                         config.CLASSIFIER_NEIGHBOURS, config.CLASSIFIER_AUTO_LEARN, config.CLASSIFIER_LEARN_MIN,
+                         RULES if config.CLASSIFIER_DEMO_RULES else []]).encode("utf-8"))
+    for path in (config.CATEGORY_RULES_FILE, config.CLASSIFIER_EXAMPLES):
+        if path and Path(path).exists():
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+        h.update(b"\0")
+    return h.hexdigest()
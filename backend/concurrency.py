@@ -0,0 +1,166 @@
+# backend/concurrency.py
+# Bounded-concurrency helpers for fanning out LLM calls (order-preserving).
+from __future__ import annotations
+import contextvars, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, TypeVar
+from . import config
+from . import event_log as log
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+class RateLimiter:
+    """Sliding one-minute window; acquire() blocks until a request slot is free."""
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._stamps: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.per_minute <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._stamps and now - self._stamps[0] >= 60.0:
+                    self._stamps.popleft()
+                if len(self._stamps) < self.per_minute:
+                    self._stamps.append(now)
+                    return
+                wait = 60.0 - (now - self._stamps[0])
+            time.sleep(max(wait, 0.01))
+
+_LLM_LIMITER: Optional[RateLimiter] = None
+
+def llm_limiter() -> RateLimiter:
+    """Process-wide limiter shared by every stage that calls the LLM."""
+    global _LLM_LIMITER
+    if _LLM_LIMITER is None:
+        _LLM_LIMITER = RateLimiter(config.LLM_REQUESTS_PER_MINUTE)
+    return _LLM_LIMITER
+
+class CircuitBreaker:
+    """
+    Shared across callers of one provider. After `threshold` consecutive transient failures it
+    opens for `cooldown_s`: every caller blocks in before_call() until it half-opens, then a
+    single probe call decides whether it closes (success) or opens again (another failure).
+    pause(s) holds all callers back without counting a failure (e.g. a 429 with retry-after).
+    """
+    def __init__(self, threshold: int, cooldown_s: float, name: str = "llm"):
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self.name = name
+        self.failures = 0
+        self.opened = 0  # times opened, for metrics
+        self._until = 0.0
+        self._probing = False
+        self._cond = threading.Condition()
+
+    @property
+    def is_open(self) -> bool:
+        return self.threshold > 0 and self.failures >= self.threshold
+
+    def before_call(self) -> float:
+        """Block while paused/open (or while another caller probes). Returns seconds waited."""
+        t0 = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._until:
+                    self._cond.wait(self._until - now)
+                    continue
+                if not self.is_open:
+                    break
+                if not self._probing:
+                    self._probing = True
+                    break
+                self._cond.wait(1.0)
+        return time.monotonic() - t0
+
+    def success(self) -> None:
+        """The provider answered (even with a non-retryable error): close."""
+        with self._cond:
+            was_open = self.is_open
+            self.failures = 0
+            self._probing = False
+            self._cond.notify_all()
+        if was_open:
+            log.log_event(self.name, "circuit_closed")
+
+    def failure(self) -> bool:
+        """Record a transient failure. Returns True when this failure (re)opened the circuit."""
+        with self._cond:
+            # Opens on reaching the threshold, and again when the half-open probe fails
+            opened = (self.is_open and self._probing) or (self.threshold > 0 and self.failures + 1 == self.threshold)
+            self.failures += 1
+            self._probing = False
+            if opened:
+                self._until = max(self._until, time.monotonic() + self.cooldown_s)
+                self.opened += 1
+            self._cond.notify_all()
+        if opened:
+            log.log_event(self.name, "circuit_open", level="WARNING", failures=self.failures, cooldown_s=self.cooldown_s)
+        return opened
+
+    def pause(self, seconds: float) -> None:
+        with self._cond:
+            self._until = max(self._until, time.monotonic() + max(seconds, 0.0))
+
+_LLM_BREAKER: Optional[CircuitBreaker] = None
+
+def llm_breaker() -> CircuitBreaker:
+    """Process-wide breaker in front of the LLM provider (shared by every stage)."""
+    global _LLM_BREAKER
+    if _LLM_BREAKER is None:
+        _LLM_BREAKER = CircuitBreaker(config.LLM_BREAKER_THRESHOLD, config.LLM_BREAKER_COOLDOWN_S)
+    return _LLM_BREAKER
+
+def imap_bounded(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    max_workers: Optional[int] = None,
+    limiter: Optional[RateLimiter] = None,
+) -> Iterator[R]:
+    """
+    Yield fn(item) for each item in input order, with at most max_workers in flight.
+    Items are pulled lazily, so generators are consumed as capacity frees up.
+    The first exception raised by fn propagates after pending work is cancelled.
+    """
+    workers = max(1, max_workers or config.LLM_MAX_CONCURRENCY)
+    # Each call runs in a copy of the caller's context as of this point, so the caller's open
+    # span (the stage) is what fn sees -- not spans opened later inside a lazy items generator
+    ctx = contextvars.copy_context()
+
+    def call(item: T) -> R:
+        if limiter is not None:
+            limiter.acquire()
+        return fn(item)
+
+    if workers == 1:
+        for item in items:
+            yield ctx.copy().run(call, item)
+        return
+
+    it = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for item in it:
+                pending.append(pool.submit(ctx.copy().run, call, item))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+def map_bounded(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    max_workers: Optional[int] = None,
+    limiter: Optional[RateLimiter] = None,
+) -> List[R]:
+    return list(imap_bounded(fn, items, max_workers=max_workers, limiter=limiter))
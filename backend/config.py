@@ -7,34 +7,128 @@ from pathlib import Path
 DEMO_MODE: bool = os.getenv("DEMO_MODE", "true").lower() in ("1", "true", "yes")
 BASE_DIR = Path(__file__).resolve().parent.parent
 PROMPTS_DIR = BASE_DIR / "backend" / "prompts"
-RESULTS_DIR = BASE_DIR / "results"
-DEMO_DIR = BASE_DIR / "demo"
+RESULTS_DIR = Path(os.getenv("RESULTS_DIR", BASE_DIR / "results"))
+DEMO_DIR = Path(os.getenv("DEMO_DIR", BASE_DIR / "demo"))
 
 # LLM
 # Recommend Gemini "Flash" for free-tier + image support
 GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# "gemini" or "mock" (deterministic local stand-in for benchmarks/offline runs; see llm_mock.py)
+LLM_BACKEND: str = os.getenv("LLM_BACKEND", "gemini").strip().lower()
+LLM_MOCK_LATENCY_MS: float = float(os.getenv("LLM_MOCK_LATENCY_MS", "50"))  # median
+LLM_MOCK_LATENCY_SIGMA: float = float(os.getenv("LLM_MOCK_LATENCY_SIGMA", "0.5"))  # lognormal spread
+LLM_MOCK_ERROR_RATE: float = float(os.getenv("LLM_MOCK_ERROR_RATE", "0"))
+LLM_MOCK_BAD_JSON_RATE: float = float(os.getenv("LLM_MOCK_BAD_JSON_RATE", "0"))  # truncated replies
+LLM_MOCK_SEED: int = int(os.getenv("LLM_MOCK_SEED", "0"))
 LLM_TEMPERATURE: float = float(os.getenv("LLM_TEMPERATURE", "0.2"))
 MAX_OUTPUT_TOKENS: int = int(os.getenv("MAX_OUTPUT_TOKENS", "2048"))
+# Fan-out: max in-flight LLM requests per stage, and a shared per-minute budget (0 = unlimited)
+LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE: int = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+# Transient provider errors (429/5xx/timeouts): retries with jittered exponential backoff (seconds),
+# honouring retry-after; unparseable JSON gets one stricter re-ask
+LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_S: float = float(os.getenv("LLM_BACKOFF_BASE_S", "1.0"))
+LLM_BACKOFF_MAX_S: float = float(os.getenv("LLM_BACKOFF_MAX_S", "30"))
+LLM_REASK_ON_EMPTY: bool = os.getenv("LLM_REASK_ON_EMPTY", "true").lower() in ("1", "true", "yes")
+# Circuit breaker: this many consecutive transient failures pause every caller for the cooldown (0 = off)
+LLM_BREAKER_THRESHOLD: int = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN_S: float = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+# Response cache: identical (model, temperature, prompts, image bytes) => no API call
+LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_DIR = Path(os.getenv("LLM_CACHE_DIR", RESULTS_DIR / "llm_cache"))
+LLM_CACHE_MAX_BYTES: int = int(float(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024)
+# Per-call metrics: USD per 1M tokens used for the cost column of the LLM report (gemini-2.0-flash list prices)
+LLM_PRICE_IN_PER_M: float = float(os.getenv("LLM_PRICE_IN_PER_M", "0.10"))
+LLM_PRICE_CACHED_IN_PER_M: float = float(os.getenv("LLM_PRICE_CACHED_IN_PER_M", "0.025"))
+LLM_PRICE_OUT_PER_M: float = float(os.getenv("LLM_PRICE_OUT_PER_M", "0.40"))
+# Gemini context caching for system prompts of at least this many (estimated) tokens; 0 disables
+LLM_CONTEXT_CACHE_MIN_TOKENS: int = int(os.getenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "4096"))
+LLM_CONTEXT_CACHE_TTL_S: int = int(os.getenv("LLM_CONTEXT_CACHE_TTL_S", "3600"))
+# Spec text sent per SKU in create_quote_schemas (estimated tokens; relevant sections kept when longer)
+QUOTE_SPEC_TOKEN_BUDGET: int = int(os.getenv("QUOTE_SPEC_TOKEN_BUDGET", "500"))
+# Image parts: longest edge in px and encoded-size budget (0 disables either); encodings cached on disk
+LLM_IMAGE_MAX_EDGE: int = int(os.getenv("LLM_IMAGE_MAX_EDGE", "1536"))
+LLM_IMAGE_MAX_BYTES: int = int(os.getenv("LLM_IMAGE_MAX_BYTES", str(1024 * 1024)))
+IMAGE_CACHE_DIR = Path(os.getenv("IMAGE_CACHE_DIR", RESULTS_DIR / "image_cache"))
+IMAGE_CACHE_MAX_BYTES: int = int(float(os.getenv("IMAGE_CACHE_MAX_MB", "256")) * 1024 * 1024)
+# SKUs packed into one categorization request (1 = one request per SKU)
+CATEGORIZE_BATCH_SIZE: int = int(os.getenv("CATEGORIZE_BATCH_SIZE", "20"))
+# Local categorization fast path (classifier.py): used instead of the LLM at or above the threshold
+CLASSIFIER_ENABLED: bool = os.getenv("CLASSIFIER_ENABLED", "true").lower() in ("1", "true", "yes")
+CLASSIFIER_THRESHOLD: float = float(os.getenv("CLASSIFIER_THRESHOLD", "0.85"))
+CLASSIFIER_RULE_CONFIDENCE: float = float(os.getenv("CLASSIFIER_RULE_CONFIDENCE", "0.9"))
+CLASSIFIER_NEIGHBOURS: int = int(os.getenv("CLASSIFIER_NEIGHBOURS", "5"))
+# Built-in keyword rules for the demo catalog's categories (off: they would override the LLM elsewhere)
+CLASSIFIER_DEMO_RULES: bool = os.getenv("CLASSIFIER_DEMO_RULES", "false").lower() in ("1", "true", "yes")
+# Unreviewed LLM categorizations at or above CLASSIFIER_LEARN_MIN become TF-IDF examples only when
+# CLASSIFIER_AUTO_LEARN is set; otherwise examples come from reviewed confirmations
+CLASSIFIER_AUTO_LEARN: bool = os.getenv("CLASSIFIER_AUTO_LEARN", "false").lower() in ("1", "true", "yes")
+CLASSIFIER_LEARN_MIN: float = float(os.getenv("CLASSIFIER_LEARN_MIN", "0.8"))
+CLASSIFIER_EXAMPLES = Path(os.getenv("CLASSIFIER_EXAMPLES", RESULTS_DIR / "category_examples.jsonl"))
+CATEGORY_RULES_FILE = os.getenv("CATEGORY_RULES_FILE", "")  # optional JSON {"Category": ["regex", ...]}
+
+# Email composition: "per_supplier" (one LLM call each) or "template" (one call per category)
+EMAIL_COMPOSE_MODE: str = os.getenv("EMAIL_COMPOSE_MODE", "per_supplier").strip().lower()
+# Supplier ids/names that still get an individually composed email in template mode
+EMAIL_PERSONALIZE_SUPPLIERS = {s.strip() for s in os.getenv("EMAIL_PERSONALIZE_SUPPLIERS", "").split(",") if s.strip()}
 
 # Email (SendGrid)
 SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL", "procurement@example.com")
 SENDGRID_FROM_NAME = os.getenv("SENDGRID_FROM_NAME", "Procurement Bot")
 SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY", "")  # empty => demo mode outbox
+# Dispatch: parallel sends, retries on 429/5xx, exponential backoff bounds (seconds)
+EMAIL_MAX_CONCURRENCY: int = int(os.getenv("EMAIL_MAX_CONCURRENCY", "8"))
+EMAIL_MAX_RETRIES: int = int(os.getenv("EMAIL_MAX_RETRIES", "4"))
+EMAIL_BACKOFF_BASE_S: float = float(os.getenv("EMAIL_BACKOFF_BASE_S", "0.5"))
+EMAIL_BACKOFF_MAX_S: float = float(os.getenv("EMAIL_BACKOFF_MAX_S", "30"))
+# Durable outbox (per-message state + idempotency keys) used to resume interrupted sends;
+# a drainer's lease on the rows it is sending (renewed while it runs)
+OUTBOX_DB = Path(os.getenv("OUTBOX_DB", RESULTS_DIR / "outbox.db"))
+OUTBOX_LEASE_S: float = float(os.getenv("OUTBOX_LEASE_S", "300"))
+
+# Supplier replies: "simulated" (demo JSON), "directory" (.eml/.json drop dir) or "maildir" (local IMAP stand-in)
+REPLY_SOURCE: str = os.getenv("REPLY_SOURCE", "simulated").strip().lower()
+REPLY_DIR = Path(os.getenv("REPLY_DIR", RESULTS_DIR / "inbox"))
+REPLY_MAILDIR = Path(os.getenv("REPLY_MAILDIR", RESULTS_DIR / "maildir"))
+# Processed-reply cursor (so replies are parsed once) and the watch poll interval in seconds
+REPLY_CURSOR_DB = Path(os.getenv("REPLY_CURSOR_DB", RESULTS_DIR / "reply_cursor.db"))
+REPLY_POLL_S: float = float(os.getenv("REPLY_POLL_S", "2"))
+# Free-text reply extraction: replies per LLM request, and the longest reply (chars) that gets batched
+REPLY_EXTRACT_BATCH_SIZE: int = int(os.getenv("REPLY_EXTRACT_BATCH_SIZE", "10"))
+REPLY_EXTRACT_BATCH_CHARS: int = int(os.getenv("REPLY_EXTRACT_BATCH_CHARS", "1500"))
 
 # Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
+# Supplier directory: cached rows per category expire after this many seconds; bulk query chunk size
+SUPPLIER_CACHE_TTL_S: float = float(os.getenv("SUPPLIER_CACHE_TTL_S", "300"))
+SUPPLIER_QUERY_CHUNK: int = int(os.getenv("SUPPLIER_QUERY_CHUNK", "200"))
 
 # PDF/Image processing
 ENABLE_PDF_TO_IMAGE = os.getenv("ENABLE_PDF_TO_IMAGE", "false").lower() in ("1","true","yes")
 POPPLER_PATH = os.getenv("POPPLER_PATH", None)  # required on Windows for pdf2image
+# PDF text/page extraction worker processes (0 = in-process) and per-file timeout in seconds
+PDF_WORKERS: int = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_TIMEOUT_S: float = float(os.getenv("PDF_TIMEOUT_S", "60"))
+
+# Sharded runs (main.py --workers / sharded.py): SQLite work queue shared by worker processes/nodes,
+# spec files per map shard, task lease (renewed while working), attempts per shard, queue poll interval
+WORK_QUEUE_DB = Path(os.getenv("WORK_QUEUE_DB", RESULTS_DIR / "work_queue.db"))
+WORK_SHARD_SIZE: int = int(os.getenv("WORK_SHARD_SIZE", "250"))
+WORK_LEASE_S: float = float(os.getenv("WORK_LEASE_S", "300"))
+WORK_MAX_ATTEMPTS: int = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+WORK_POLL_S: float = float(os.getenv("WORK_POLL_S", "0.5"))
+
+# Stage checkpoints (main.run_demo / Streamlit) for resuming a run without redoing LLM work
+CHECKPOINTS_ENABLED: bool = os.getenv("CHECKPOINTS_ENABLED", "true").lower() in ("1", "true", "yes")
+CHECKPOINT_DIR = Path(os.getenv("CHECKPOINT_DIR", RESULTS_DIR / "checkpoints"))
 
 def get_prompt(name: str) -> str:
     path = PROMPTS_DIR / f"{name}.txt"
     return path.read_text(encoding="utf-8")
 
 def ensure_dirs():
+    """Create the results tree. Called by entry points (main.run_demo, the Streamlit app), not on import."""
     RESULTS_DIR.mkdir(parents=True, exist_ok=True)
     (RESULTS_DIR / "outbox").mkdir(parents=True, exist_ok=True)
-
-ensure_dirs()
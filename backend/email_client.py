@@ -1,40 +1,221 @@
 # email_client.py
 """
 SendGrid-backed email client with DEMO outbox fallback.
+Talks to the SendGrid v3 HTTP API directly (stdlib http.client) so connections are reused.
 """
-from typing import List, Dict, Any
-from . import config
-import os, json, time
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Optional, Tuple, Callable
+from . import config, outbox
+from . import event_log as log
+from .concurrency import map_bounded
+import os, json, time, random, threading, uuid, http.client
 
-def send_batch(emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def send_batch(emails: List[Dict[str, Any]], transport: Optional["Transport"] = None) -> List[Dict[str, Any]]:
+    """
+    Queue emails in the durable outbox, then send whatever of them is still outstanding.
+    Emails already sent in this run for the same supplier + SKU set are skipped (idempotency key).
+    Sending is concurrent (EMAIL_MAX_CONCURRENCY) over a reused connection per worker
+    (closed once the batch is done), retrying 429/5xx with exponential backoff. Without a transport, DEMO_MODE or a missing
+    API key writes the outbox file instead.
+    """
     if not emails:
         return []
-    if config.DEMO_MODE or not config.SENDGRID_API_KEY:
-        return _write_outbox(emails)
+    keys = outbox.enqueue(emails)
+    return drain(keys=keys, transport=transport)
+
+def drain(keys: Optional[List[str]] = None, transport: Optional["Transport"] = None,
+          retry_failed: bool = False) -> List[Dict[str, Any]]:
+    """
+    Send outstanding outbox messages (all of them, or just keys). Safe to call again after a crash,
+    and next to another drainer: claimed rows are leased (renewed while sending). Failed messages
+    are sent again only with retry_failed (permanent 4xx rejections never are).
+    """
+    owner = uuid.uuid4().hex
+    pending = outbox.claim(keys, owner=owner, retry_failed=retry_failed)
+    skipped = []
+    if keys is not None:
+        claimed = {e["key"] for e in pending}
+        done = outbox.states([k for k in keys if k not in claimed])
+        skipped = [{"key": k, "status": "already_sent"} for k, st in done.items() if st == outbox.SENT]
+    if not pending:
+        return skipped
+    if transport is None:
+        if config.DEMO_MODE or not config.SENDGRID_API_KEY:
+            results = _write_outbox(pending)
+            for e in pending:
+                outbox.mark(e["key"], outbox.SENT, status="demo_outbox")
+            return results + skipped
+        transport = SendGridTransport(config.SENDGRID_API_KEY)
+
+    def record(e: Dict[str, Any], res: Dict[str, Any]) -> None:
+        outbox.mark(e["key"], outbox.FAILED if "error" in res else outbox.SENT,
+                    status=res["status"], error=res.get("error"), attempts=res["attempts"])
+    stop = threading.Event()
+    renewer = threading.Thread(target=_renew_lease, args=(owner, stop), daemon=True)
+    renewer.start()
     try:
-        from sendgrid import SendGridAPIClient
-        from sendgrid.helpers.mail import Mail, From, To
-    except Exception as e:
-        # fall back
-        return _write_outbox(emails)
-
-    client = SendGridAPIClient(config.SENDGRID_API_KEY)
-    results = []
-    for e in emails:
-        to_email = e["to_email"]
-        subject = e["subject"]
-        body = e["body"]
-        message = Mail(
-            from_email=(config.SENDGRID_FROM_EMAIL, config.SENDGRID_FROM_NAME),
-            to_emails=[to_email],
-            subject=subject,
-            plain_text_content=body
-        )
+        results = _dispatch(pending, transport, on_result=record) + skipped
+    finally:
+        stop.set()
+        renewer.join()
+        transport.close()
+    if keys is not None:
+        order = {k: i for i, k in enumerate(keys)}
+        results.sort(key=lambda r: order.get(r["key"], 0))
+    return results
+
+def _renew_lease(owner: str, stop: threading.Event) -> None:
+    while not stop.wait(max(1.0, config.OUTBOX_LEASE_S / 3)):
+        if not outbox.renew(owner):
+            return
+
+# ---------- Transports ----------
+
+class Transport(ABC):
+    """send(payload) -> (status_code, lowercase headers). May raise on network errors."""
+    @abstractmethod
+    def send(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, str]]:
+        ...
+
+    def close(self) -> None:
+        """Release connections; drain() calls this after each batch (send() may reopen them)."""
+
+class SendGridTransport(Transport):
+    """POSTs to SendGrid v3 mail/send; one keep-alive HTTPS connection per worker thread, closed by close()."""
+    HOST = "api.sendgrid.com"
+    PATH = "/v3/mail/send"
+
+    def __init__(self, api_key: str, timeout_s: float = 30.0):
+        self._headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        self._timeout = timeout_s
+        self._local = threading.local()
+        self._conns: List[http.client.HTTPSConnection] = []  # every thread's, so close() can reach them
+        self._lock = threading.Lock()
+
+    def _conn(self) -> http.client.HTTPSConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPSConnection(self.HOST, timeout=self._timeout)
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self) -> None:
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()  # a thread still holding one reconnects on its next request
+
+    def send(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, str]]:
+        conn = self._conn()
         try:
-            resp = client.send(message)
-            results.append({"to": to_email, "status": resp.status_code})
-        except Exception as ex:
-            results.append({"to": to_email, "status": "failed", "error": str(ex)})
+            conn.request("POST", self.PATH, body=json.dumps(payload).encode("utf-8"), headers=self._headers)
+            resp = conn.getresponse()
+            resp.read()  # drain so the connection can be reused
+            return resp.status, {k.lower(): v for k, v in resp.getheaders()}
+        except Exception:
+            conn.close()
+            self._local.conn = None
+            with self._lock:
+                if conn in self._conns:
+                    self._conns.remove(conn)
+            raise
+
+class OfflineTransport(Transport):
+    """
+    Stand-in for tests/benchmarks: records payloads, never touches the network.
+    statuses: optional per-recipient script of status codes, consumed one per attempt (default 202).
+    """
+    def __init__(self, statuses: Optional[Dict[str, List[int]]] = None, latency_s: float = 0.0):
+        self.statuses = {k: list(v) for k, v in (statuses or {}).items()}
+        self.latency_s = latency_s
+        self.sent: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def send(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, str]]:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        to = payload["personalizations"][0]["to"][0]["email"]
+        with self._lock:
+            script = self.statuses.get(to)
+            status = script.pop(0) if script else 202
+            if 200 <= status < 300:
+                self.sent.append(payload)
+        return status, {}
+
+# ---------- Dispatcher ----------
+
+def _payload(e: Dict[str, Any]) -> Dict[str, Any]:
+    to = {"email": e["to_email"]}
+    if e.get("to_name"):
+        to["name"] = e["to_name"]
+    return {
+        "personalizations": [{"to": [to]}],
+        "from": {"email": config.SENDGRID_FROM_EMAIL, "name": config.SENDGRID_FROM_NAME},
+        "subject": e["subject"],
+        "content": [{"type": "text/plain", "value": e["body"]}],
+    }
+
+def _retry_after(headers: Dict[str, str]) -> Optional[float]:
+    try:
+        return max(0.0, float(headers.get("retry-after", "")))
+    except ValueError:
+        return None
+
+def _dispatch(emails: List[Dict[str, Any]], transport: Transport,
+              on_result: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+    pause = {"until": 0.0}  # shared: a 429 on one worker holds back all of them
+    pause_lock = threading.Lock()
+
+    with log.span("send_batch", emails=len(emails), workers=config.EMAIL_MAX_CONCURRENCY) as sp:
+        def send_one(e: Dict[str, Any]) -> Dict[str, Any]:
+            payload = _payload(e)
+            t0 = time.time()
+            status: Any = None
+            error = None
+            attempt = 0
+            for attempt in range(1, config.EMAIL_MAX_RETRIES + 2):
+                wait = pause["until"] - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                retry_after = None
+                try:
+                    status, headers = transport.send(payload)
+                    error = None
+                    if 200 <= status < 300:
+                        break
+                    if status != 429 and status < 500:
+                        break  # client error: retrying won't help
+                    retry_after = _retry_after(headers)
+                except Exception as ex:
+                    status, error = "failed", str(ex)
+                if attempt > config.EMAIL_MAX_RETRIES:
+                    break
+                delay = retry_after if retry_after is not None else min(
+                    config.EMAIL_BACKOFF_MAX_S, config.EMAIL_BACKOFF_BASE_S * 2 ** (attempt - 1)
+                ) * random.uniform(0.5, 1.0)
+                if status == 429:
+                    with pause_lock:
+                        pause["until"] = max(pause["until"], time.time() + delay)
+                sp.update("send_retry", level="DEBUG", to=e["to_email"], status=status, attempt=attempt, delay_s=round(delay, 3))
+                time.sleep(delay)
+            ok = isinstance(status, int) and 200 <= status < 300
+            res = {"to": e["to_email"], "status": status, "attempts": attempt, "latency_ms": int((time.time() - t0) * 1000)}
+            if not ok:
+                res["error"] = error or f"HTTP {status}"
+            if e.get("key"):
+                res["key"] = e["key"]
+            if on_result is not None:
+                on_result(e, res)  # persist per message, so a crash mid-batch loses nothing
+            sp.update("sent" if ok else "send_failed", to=e["to_email"], status=res["status"], attempts=attempt, latency_ms=res["latency_ms"])
+            return res
+
+        results = map_bounded(send_one, emails, max_workers=config.EMAIL_MAX_CONCURRENCY)
+        lat = sorted(r["latency_ms"] for r in results)
+        sent = sum(1 for r in results if "error" not in r)
+        sp.update("send_summary", sent=sent, failed=len(results) - sent,
+                  retries=sum(r["attempts"] - 1 for r in results),
+                  p50_ms=lat[len(lat) // 2], p95_ms=lat[min(len(lat) - 1, int(len(lat) * 0.95))])
     return results
 
 def _write_outbox(emails: List[Dict[str, Any]]):
@@ -48,13 +229,8 @@ def _write_outbox(emails: List[Dict[str, Any]]):
     summary = [{"to": e["to_email"], "subject": e["subject"][:60]} for e in emails]
     return [{"mode": "demo_outbox", "file": str(path), "summary": summary}]
 
-def collect_replies() -> Dict[str, Any]:
-    """
-    DEMO: read replies from demo/simulated_replies.json
-    """
-    sim = config.DEMO_DIR / "simulated_replies.json"
-    if sim.exists():
-        import json
-        with open(sim, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+if __name__ == "__main__":
+    # Resume an interrupted send: python -m backend.email_client [--retry-failed]
+    import sys
+    print(json.dumps(drain(retry_failed="--retry-failed" in sys.argv), ensure_ascii=False, indent=2))
+    print(json.dumps(outbox.counts()))
@@ -1,18 +1,25 @@
 # evaluator.py
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Union
 from .models import ScoringFormula, Score, Scorecard
+from .bid_store import BidStore
 from . import config, llm
+from . import event_log as log
 import math, uuid, json
+import numpy as np
 
 DEFAULT_FORMULA = {
     "weights": {"price": 0.5, "OTIF": 0.2, "payment_timeline": 0.2, "specification": 0.1},
     "directions": {"price": "lower", "OTIF": "higher", "payment_timeline": "higher", "specification": "higher"}
 }
 
-def derive_formula(quotes: List[Dict[str, Any]]) -> ScoringFormula:
+def derive_formula(quotes: List[Dict[str, Any]], bids: Optional[BidStore] = None) -> ScoringFormula:
     sys = config.get_prompt("WEIGHTED_SCORING_FORMULA_GEN_SYS")
-    user = {"components_present": _collect_components(quotes), "request": "Return weights that sum to 1.0 and directions."}
-    resp = llm.generate_json(system_prompt=sys, user_prompt=json.dumps(user))
+    components = _collect_components(quotes)
+    if bids is not None:
+        components = sorted(set(components) | set(bids.comps))
+    user = {"components_present": components, "request": "Return weights that sum to 1.0 and directions."}
+    with log.span("derive_formula", components=len(user["components_present"])):
+        resp = llm.generate_json(system_prompt=sys, user_prompt=json.dumps(user))
     weights = resp.get("weights") or DEFAULT_FORMULA["weights"]
     directions = resp.get("directions") or DEFAULT_FORMULA["directions"]
     # Optional min/max
@@ -20,63 +27,96 @@ def derive_formula(quotes: List[Dict[str, Any]]) -> ScoringFormula:
     maxs = resp.get("max_values", {})
     return ScoringFormula(weights=weights, directions=directions, min_values=mins, max_values=maxs)
 
-def score_bids(quotes: List[Dict[str, Any]], formula: ScoringFormula) -> Scorecard:
-    # Build per-sku per-supplier values
-    rows = []
+def score_bids(bids: Union[BidStore, List[Dict[str, Any]]], formula: ScoringFormula) -> Scorecard:
+    """bids: a BidStore, or quotes enriched with supplier_bids (packed here)."""
+    keys, comps, values, present = bids.matrix() if isinstance(bids, BidStore) else _pack_bids(bids)
+    totals, norms = _score_matrix(values, present, comps, formula)
+    scores = _build_scores(keys, comps, present, totals, norms, formula)
+    session_id = str(uuid.uuid4())
+    return Scorecard(session_id=session_id, scores=scores, formula=formula)
+
+def _build_scores(keys, comps: List[str], present, totals, norms, formula: ScoringFormula) -> List[Score]:
+    # Only weighted components that the (sku, supplier) actually bid on are reported
+    weighted = [(j, c) for j, c in enumerate(comps) if c in formula.weights]
+    scores: List[Score] = []
+    for (sku, supplier), total, row_norms, row_present in zip(keys, totals.tolist(), norms.tolist(), present.tolist()):
+        comp_scores = {c: round(row_norms[j], 4) for j, c in weighted if row_present[j]}
+        scores.append(Score(sku_id=sku, supplier_id=supplier, supplier_name=supplier, total_score=round(total, 4), component_scores=comp_scores))
+    return scores
+
+def _pack_bids(quotes: List[Dict[str, Any]]):
+    """
+    Pack bids into a dense (bid x component) float matrix plus a presence mask.
+    One row per (sku, supplier) in first-seen order; a supplier's first bid per component wins.
+    """
+    comp_index: Dict[str, int] = {}
+    keys: List[tuple] = []
+    rows: List[int] = []
+    cols: List[int] = []
+    vals: List[float] = []
     for q in quotes:
         sku = q["sku_id"]
-        comp_map = q.get("components", {})
-        # collect all suppliers
-        suppliers = set()
-        for comp, obj in comp_map.items():
+        sku_rows: Dict[str, int] = {}
+        for comp, obj in q.get("components", {}).items():
+            col = None
+            seen = set()
             for b in obj.get("supplier_bids", []):
-                suppliers.add(b["supplier"])
-        for supplier in suppliers:
-            comp_vals: Dict[str, float] = {}
-            for comp, obj in comp_map.items():
-                # pick supplier's value if present
-                val = None
-                for b in obj.get("supplier_bids", []):
-                    if b["supplier"] == supplier:
-                        val = b.get("value")
-                        break
-                # simple normalization later
+                supplier = b["supplier"]
+                row = sku_rows.get(supplier)
+                if row is None:
+                    row = sku_rows[supplier] = len(keys)
+                    keys.append((sku, supplier))
+                if supplier in seen:
+                    continue
+                seen.add(supplier)
+                val = b.get("value")
                 if isinstance(val, (int, float)):
-                    comp_vals[comp] = float(val)
-            rows.append((sku, supplier, comp_vals))
+                    if col is None:
+                        col = comp_index.setdefault(comp, len(comp_index))
+                    rows.append(row)
+                    cols.append(col)
+                    vals.append(val)
 
-    # Compute min/max per component to normalize [0,1]
-    all_vals: Dict[str, List[float]] = {}
-    for _, _, comps in rows:
-        for k, v in comps.items():
-            all_vals.setdefault(k, []).append(v)
-    mins = {k: min(vs) for k, vs in all_vals.items()}
-    maxs = {k: max(vs) for k, vs in all_vals.items()}
+    comps = list(comp_index)
+    values = np.full((len(keys), len(comps)), np.nan)
+    if vals:
+        values[rows, cols] = np.asarray(vals, dtype=float)
+    return keys, comps, values, ~np.isnan(values)
 
-    scores: List[Score] = []
-    for sku, supplier, comps in rows:
-        comp_scores: Dict[str, float] = {}
-        total = 0.0
-        for comp, weight in formula.weights.items():
-            if comp not in comps:
-                continue
-            raw = comps[comp]
-            lo = formula.min_values.get(comp, mins.get(comp, raw))
-            hi = formula.max_values.get(comp, maxs.get(comp, raw))
-            if hi == lo:
-                norm = 1.0
-            else:
-                # normalize to [0,1], then invert if "lower is better"
-                t = (raw - lo) / (hi - lo)
-                if formula.directions.get(comp, "higher") == "lower":
-                    t = 1.0 - t
-                norm = max(0.0, min(1.0, t))
-            comp_scores[comp] = round(norm, 4)
-            total += weight * norm
-        scores.append(Score(sku_id=sku, supplier_id=supplier, supplier_name=supplier, total_score=round(total,4), component_scores=comp_scores))
+def _score_matrix(values, present, comps: List[str], formula: ScoringFormula, bounds=None):
+    """
+    Vectorized min/max normalization, direction inversion, clamping and weighted sum.
+    bounds: optional (mins, maxs) arrays of observed bounds; computed from values if omitted.
+    """
+    n_rows, n_cols = values.shape
+    if n_rows == 0 or n_cols == 0:
+        return np.zeros(n_rows), np.zeros((n_rows, n_cols))
+    safe = np.where(present, values, 0.0)
+    if bounds is None:
+        has_any = present.any(axis=0)
+        mins = np.where(has_any, np.min(np.where(present, values, np.inf), axis=0), np.nan)
+        maxs = np.where(has_any, np.max(np.where(present, values, -np.inf), axis=0), np.nan)
+    else:
+        mins, maxs = (np.array(b, dtype=float) for b in bounds)
+    # Formula-provided bounds override observed ones
+    for j, comp in enumerate(comps):
+        if comp in formula.min_values:
+            mins[j] = formula.min_values[comp]
+        if comp in formula.max_values:
+            maxs[j] = formula.max_values[comp]
 
-    session_id = str(uuid.uuid4())
-    return Scorecard(session_id=session_id, scores=scores, formula=formula)
+    span = maxs - mins
+    flat = span == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (safe - mins) / np.where(flat, 1.0, span)
+    lower = np.array([formula.directions.get(c, "higher") == "lower" for c in comps])
+    t = np.where(lower, 1.0 - t, t)
+    norms = np.where(flat, 1.0, np.clip(t, 0.0, 1.0))
+    norms = np.where(present, norms, 0.0)
+
+    weights = np.array([float(formula.weights.get(c, 0.0)) for c in comps])
+    totals = norms @ weights
+    return totals, norms
 
 def _collect_components(quotes: List[Dict[str, Any]]):
     comps = set()
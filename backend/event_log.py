@@ -1,14 +1,43 @@
 # backend/event_log.py
 from __future__ import annotations
-import json, time, uuid, os
+import atexit, contextvars, json, time, uuid, os, sys, threading
+from multiprocessing import util as mp_util
 from pathlib import Path
-from typing import Any, Optional
-from . import config
+from typing import Any, Dict, List, Optional, Tuple
+from . import log_store
 
-# Change path via env if you want separate files per run.
-LOG_PATH = Path(os.getenv("AGENT_LOG_PATH", config.RESULTS_DIR / "agent_events.jsonl"))
+# Events are stored per run (rotating segments + offset index) under log_store.LOG_DIR.
+LOG_DIR = log_store.LOG_DIR
 RUN_ID: Optional[str] = None
 
+# Buffered writer: events are serialized on the caller's thread, appended to an in-memory
+# buffer and written in batches by a background thread (or on span exit / shutdown).
+# The console echo rides the same batches: one stdout write per flush, not a print per event.
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_LEVEL = os.getenv("AGENT_LOG_LEVEL", "DEBUG").upper()
+STDOUT = os.getenv("AGENT_LOG_STDOUT", "1").lower() in ("1", "true", "yes")
+STDOUT_LEVEL = os.getenv("AGENT_LOG_STDOUT_LEVEL", "INFO").upper()
+FLUSH_EVENTS = int(os.getenv("AGENT_LOG_FLUSH_EVENTS", "256"))
+FLUSH_INTERVAL_S = float(os.getenv("AGENT_LOG_FLUSH_S", "0.5"))
+_BUFFER: List[Tuple[str, log_store.Record, Optional[str]]] = []  # (run_id, record, message to echo)
+_LOCK = threading.Lock()        # guards _BUFFER
+_WRITE_LOCK = threading.Lock()  # serializes file writes within this process
+_WAKE = threading.Event()
+_FLUSHER: Optional[threading.Thread] = None
+
+# Innermost open span's step in this context (copied into concurrency workers), for attribution
+_STEP: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("event_log_step", default=None)
+
+def current_step() -> Optional[str]:
+    return _STEP.get()
+
+# In-process span timings: step -> [spans closed, total ms] (cheap per-stage wall time for benchmarks)
+_SPAN_TOTALS: Dict[str, List[float]] = {}
+
+def span_totals() -> Dict[str, Dict[str, float]]:
+    with _LOCK:
+        return {step: {"spans": int(n), "total_ms": round(ms, 1)} for step, (n, ms) in _SPAN_TOTALS.items()}
+
 def new_run(run_id: Optional[str] = None) -> str:
     """Generate or set a run_id and log the run start."""
     global RUN_ID
@@ -16,9 +45,14 @@ def new_run(run_id: Optional[str] = None) -> str:
     log_event("_run", "start", run_id=RUN_ID)
     return RUN_ID
 
+def enabled(level: str) -> bool:
+    return LEVELS.get(level.upper(), 20) >= LEVELS.get(LOG_LEVEL, 10)
+
 def log_event(step: str, message: str = "", level: str = "INFO", **payload: Any) -> None:
-    """Append a structured event to JSONL and (optionally) echo to stdout."""
+    """Buffer a structured JSONL event (dropped if below AGENT_LOG_LEVEL); echoed to stdout on flush at AGENT_LOG_STDOUT_LEVEL+."""
     global RUN_ID
+    if not enabled(level):
+        return
     if RUN_ID is None:
         RUN_ID = str(uuid.uuid4())
     rec = {
@@ -29,11 +63,69 @@ def log_event(step: str, message: str = "", level: str = "INFO", **payload: Any)
         "message": message,
         "payload": payload,
     }
-    LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-    if os.getenv("AGENT_LOG_STDOUT", "1").lower() in ("1", "true", "yes"):
-        print(f"[{time.strftime('%H:%M:%S')}] {step}: {message}")
+    line = json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+    echo = message if STDOUT and LEVELS.get(level.upper(), 20) >= LEVELS.get(STDOUT_LEVEL, 20) else None
+    with _LOCK:
+        _BUFFER.append((RUN_ID, (step, level, rec["ts"], line), echo))
+        pending = len(_BUFFER)
+    _ensure_flusher()
+    if pending >= FLUSH_EVENTS:
+        _WAKE.set()
+
+def flush() -> None:
+    """Write all buffered events to their run's log segment (one append + index line group per run)."""
+    global _BUFFER
+    with _WRITE_LOCK:
+        with _LOCK:
+            pending, _BUFFER = _BUFFER, []
+        by_run: Dict[str, List[log_store.Record]] = {}
+        echoes = []
+        for run_id, rec, echo in pending:
+            by_run.setdefault(run_id, []).append(rec)
+            if echo is not None:
+                echoes.append(f"[{time.strftime('%H:%M:%S', time.localtime(rec[2]))}] {rec[0]}: {echo}\n")
+        for run_id, records in by_run.items():
+            log_store.append_batch(run_id, records)
+        if echoes:
+            sys.stdout.write("".join(echoes))
+            sys.stdout.flush()
+
+def run_log_dir(run_id: Optional[str] = None) -> Path:
+    return log_store.run_dir(run_id or RUN_ID or "")
+
+def _flush_loop() -> None:
+    while True:
+        _WAKE.wait(FLUSH_INTERVAL_S)
+        _WAKE.clear()
+        try:
+            flush()
+        except Exception:
+            pass  # logging must never take the pipeline down; retry next tick
+
+def _ensure_flusher() -> None:
+    global _FLUSHER
+    if _FLUSHER is None:
+        with _LOCK:
+            if _FLUSHER is None:
+                _FLUSHER = threading.Thread(target=_flush_loop, name="event-log-flush", daemon=True)
+                _FLUSHER.start()
+
+def _after_fork_in_child() -> None:
+    # The flusher thread does not survive fork; child starts with a fresh buffer and locks
+    global _BUFFER, _LOCK, _WRITE_LOCK, _WAKE, _FLUSHER
+    _BUFFER, _LOCK, _WRITE_LOCK, _WAKE, _FLUSHER = [], threading.Lock(), threading.Lock(), threading.Event(), None
+    _SPAN_TOTALS.clear()
+
+class _ForkHook:
+    """multiprocessing children exit via os._exit (no atexit), so flush from its finalizers instead."""
+    def __call__(self) -> None:
+        mp_util.Finalize(None, flush, exitpriority=100)
+
+_FORK_HOOK = _ForkHook()
+atexit.register(flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+mp_util.register_after_fork(_FORK_HOOK, lambda hook: hook())
 
 class span:
     """Context manager to automatically log start/end + duration."""
@@ -41,19 +133,33 @@ class span:
         self.step = step
         self.start_payload = start_payload
         self.t0 = None
+        self._token = None
 
     def __enter__(self):
         self.t0 = time.time()
+        self._token = _STEP.set(self.step)
         log_event(self.step, "start", **self.start_payload)
         return self
 
-    def update(self, message: str, **payload: Any):
-        log_event(self.step, message, **payload)
+    def update(self, message: str, level: str = "INFO", **payload: Any):
+        log_event(self.step, message, level=level, **payload)
 
     def __exit__(self, exc_type, exc, tb):
-        dur_ms = int((time.time() - self.t0) * 1000) if self.t0 else None
+        if self._token is not None:
+            try:
+                _STEP.reset(self._token)
+            except ValueError:  # exited in a different context (e.g. a generator closed elsewhere)
+                pass
+        elapsed_ms = (time.time() - self.t0) * 1000 if self.t0 else None
+        dur_ms = int(elapsed_ms) if elapsed_ms is not None else None
+        if elapsed_ms is not None:
+            with _LOCK:
+                tot = _SPAN_TOTALS.setdefault(self.step, [0, 0.0])
+                tot[0] += 1
+                tot[1] += elapsed_ms
         if exc:
             log_event(self.step, "error", level="ERROR", error=str(exc), duration_ms=dur_ms)
-            return False
-        log_event(self.step, "end", duration_ms=dur_ms)
+        else:
+            log_event(self.step, "end", duration_ms=dur_ms)
+        flush()
         return False
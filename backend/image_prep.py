@@ -0,0 +1,72 @@
+# backend/image_prep.py
+# Downscale + JPEG-encode images for multimodal prompts, cached by content digest and settings.
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from . import config
+from .llm_cache import DiskLRU, file_digest
+
+_QUALITY_LADDER = (90, 82, 74, 66, 58, 50, 42, 35)
+_MEM: "OrderedDict[str, bytes]" = OrderedDict()
+_MEM_MAX_ENTRIES = 256
+_LOCK = threading.Lock()
+_DISK = DiskLRU("*.jpg")
+
+def _cache_key(digest: str) -> str:
+    return f"{digest}-e{config.LLM_IMAGE_MAX_EDGE}-b{config.LLM_IMAGE_MAX_BYTES}"
+
+def _disk_path(key: str) -> Path:
+    return Path(config.IMAGE_CACHE_DIR) / f"{key}.jpg"
+
+def encode_jpeg(path: str) -> bytes:
+    """
+    Return JPEG bytes for the image at path: RGB, longest edge <= LLM_IMAGE_MAX_EDGE,
+    highest quality on the ladder that fits LLM_IMAGE_MAX_BYTES (lowest rung otherwise).
+    Results are memoized in memory and on disk (size-bounded LRU by mtime, like llm_cache)
+    so repeated SKUs/retries reuse the payload.
+    """
+    key = _cache_key(file_digest(path))
+    with _LOCK:
+        data = _MEM.get(key)
+        if data is not None:
+            _MEM.move_to_end(key)
+            return data
+    disk = _disk_path(key)
+    data = _DISK.read(disk)
+    if data is None:
+        data = _encode(path)
+        _DISK.write(Path(config.IMAGE_CACHE_DIR), disk, data, config.IMAGE_CACHE_MAX_BYTES)
+    with _LOCK:
+        _MEM[key] = data
+        while len(_MEM) > _MEM_MAX_ENTRIES:
+            _MEM.popitem(last=False)
+    return data
+
+def _encode(path: str) -> bytes:
+    from PIL import Image  # only needed on a cache miss
+    with Image.open(path) as src:
+        img = src.convert("RGB")
+    max_edge = config.LLM_IMAGE_MAX_EDGE
+    if max_edge and max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    budget = config.LLM_IMAGE_MAX_BYTES
+    encoded = {}
+    def enc(q: int) -> bytes:
+        if q not in encoded:
+            buf = BytesIO()
+            img.save(buf, format="JPEG", quality=q, optimize=True)
+            encoded[q] = buf.getvalue()
+        return encoded[q]
+    if not budget or len(enc(_QUALITY_LADDER[0])) <= budget:
+        return enc(_QUALITY_LADDER[0])
+    # Binary search the ladder (size shrinks with quality) for the best rung under budget
+    lo, hi, best = 1, len(_QUALITY_LADDER) - 1, None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if len(enc(_QUALITY_LADDER[mid])) <= budget:
+            best, hi = _QUALITY_LADDER[mid], mid - 1
+        else:
+            lo = mid + 1
+    return enc(best if best is not None else _QUALITY_LADDER[-1])
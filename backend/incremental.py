@@ -0,0 +1,163 @@
+# backend/incremental.py
+# Incremental scoring state for replies that trickle in during a live negotiation.
+#
+# evaluator.score_bids normalizes every component by its min/max across all bids, so a new
+# bid can move other SKUs' scores only through those bounds. This keeps a multiset of values
+# per component and re-scores just the SKUs that received a bid plus, when a component's
+# bounds moved, the SKUs that bid on that component. Late bids go through the scorer's BidStore
+# (BidStore.add with replace), so the store stays current and both normalize bids the same way.
+from __future__ import annotations
+import uuid
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from .models import ScoringFormula, Score, Scorecard
+from . import evaluator
+from .bid_store import BidStore, bid_fields
+from . import event_log as log
+
+Key = Tuple[str, str]  # (sku_id, supplier)
+
+class IncrementalScorer:
+    def __init__(self, formula: ScoringFormula, store: BidStore):
+        self.formula = formula
+        self.store = store
+        self.session_id = str(uuid.uuid4())
+        self.comps: List[str] = []
+        self._comp_index: Dict[str, int] = {}
+        self._cells: Dict[Key, Dict[str, float]] = {}       # (sku, supplier) -> {comp: value}
+        self._rows: Dict[str, List[str]] = {s: [] for s in store.skus}  # sku -> suppliers, first-seen order
+        self._values: Dict[str, Counter] = {}               # comp -> multiset of bid values
+        self._bounds: Dict[str, Tuple[float, float]] = {}   # comp -> (lo, hi) observed
+        self._comp_skus: Dict[str, Set[str]] = {}           # comp -> skus with a bid on it
+        self._scores: Dict[str, List[Score]] = {}           # sku -> scores in row order
+
+    @classmethod
+    def from_quotes(cls, quotes: List[Dict[str, Any]], formula: ScoringFormula) -> "IncrementalScorer":
+        """Seed from enriched quotes (same first-bid-wins packing as evaluator.score_bids)."""
+        return cls.from_store(BidStore.from_quotes(quotes), formula)
+
+    @classmethod
+    def from_store(cls, bids: BidStore, formula: ScoringFormula) -> "IncrementalScorer":
+        """Seed from a BidStore; its SKUs are the known ones, and apply() adds late bids to it."""
+        inc = cls(formula, bids)
+        keys, comps, values, present = bids.matrix()
+        for comp in comps:
+            inc._column(comp)
+        for (sku, supplier), row, row_present in zip(keys, values.tolist(), present.tolist()):
+            inc._row(sku, supplier)
+            for j, comp in enumerate(comps):
+                if row_present[j]:
+                    inc._set(sku, supplier, comp, row[j])
+        inc._rescore(set(inc._rows))
+        return inc
+
+    def apply(self, bids: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+        """
+        Apply bid deltas (Bid-shaped dicts, e.g. from build_bid_payloads). A later bid replaces
+        the supplier's earlier value for the same (sku, component).
+        Returns the ranking diff {sku_id: {"before": [...], "after": [...]}} for SKUs whose
+        ranking or scores changed.
+        """
+        with log.span("incremental_score") as sp:
+            dirty: Set[str] = set()
+            prev: Dict[str, Optional[Tuple[float, float]]] = {}  # comp -> bounds before this delta
+            n_bids = 0
+            for bid in bids:
+                n_bids += 1
+                sku, supplier, components, raw = bid_fields(bid)
+                if sku not in self._rows:
+                    sp.update("skipped_bid_unknown_sku", sku_id=sku, supplier=supplier)
+                    continue
+                self.store.add(sku, supplier, components, raw, replace=True)
+                if not components:
+                    continue  # no row, as in the store
+                self._row(sku, supplier)
+                dirty.add(sku)
+                for comp, val in self.store.row_values(sku, supplier).items():
+                    if comp not in components:
+                        continue
+                    self._column(comp)
+                    prev.setdefault(comp, self._bounds.get(comp))
+                    self._set(sku, supplier, comp, val)
+
+            moved = []
+            for comp, bounds in prev.items():
+                if bounds != self._bounds.get(comp):
+                    if not (comp in self.formula.min_values and comp in self.formula.max_values):
+                        moved.append(comp)
+                        dirty |= self._comp_skus.get(comp, set())
+
+            before = {sku: _ranking(self._scores.get(sku, [])) for sku in dirty}
+            self._rescore(dirty)
+            diff = {}
+            for sku in dirty:
+                after = _ranking(self._scores[sku])
+                if after != before[sku]:
+                    diff[sku] = {"before": before[sku], "after": after}
+            sp.update("rescored", bids=n_bids, bounds_moved=sorted(moved), rescored_skus=len(dirty),
+                      changed_skus=len(diff), total_skus=len(self._rows))
+        return diff
+
+    def scorecard(self) -> Scorecard:
+        scores = [s for sku in self._rows for s in self._scores.get(sku, [])]
+        return Scorecard(session_id=self.session_id, scores=scores, formula=self.formula)
+
+    # ---------- internals ----------
+
+    def _column(self, comp: str) -> None:
+        if comp not in self._comp_index:
+            self._comp_index[comp] = len(self.comps)
+            self.comps.append(comp)
+            self._values[comp] = Counter()
+
+    def _row(self, sku: str, supplier: str) -> None:
+        if (sku, supplier) not in self._cells:
+            self._cells[(sku, supplier)] = {}
+            self._rows[sku].append(supplier)
+
+    def _set(self, sku: str, supplier: str, comp: str, val: float) -> None:
+        """Set one bid value, keeping the component's value multiset and running min/max current."""
+        cell = self._cells[(sku, supplier)]
+        counts = self._values[comp]
+        old = cell.get(comp)
+        stale = False
+        if old is not None:
+            counts[old] -= 1
+            if counts[old] <= 0:
+                del counts[old]
+                stale = old in self._bounds[comp]  # removed an extreme: rescan the distinct values
+        cell[comp] = val
+        counts[val] += 1
+        self._comp_skus.setdefault(comp, set()).add(sku)
+        if stale:
+            self._bounds[comp] = (min(counts), max(counts))
+        else:
+            lo, hi = self._bounds.get(comp, (val, val))
+            self._bounds[comp] = (min(lo, val), max(hi, val))
+
+    def _rescore(self, skus: Set[str]) -> None:
+        if not skus:
+            return
+        keys = [(sku, supplier) for sku in skus for supplier in self._rows[sku]]
+        values = np.full((len(keys), len(self.comps)), np.nan)
+        for i, key in enumerate(keys):
+            for comp, val in self._cells[key].items():
+                values[i, self._comp_index[comp]] = val
+        present = ~np.isnan(values)
+        bounds = self._bounds_arrays()
+        totals, norms = evaluator._score_matrix(values, present, self.comps, self.formula, bounds=bounds)
+        scores = evaluator._build_scores(keys, self.comps, present, totals, norms, self.formula)
+        for sku in skus:
+            self._scores[sku] = []
+        for s in scores:
+            self._scores[s.sku_id].append(s)
+
+    def _bounds_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        nan = (float("nan"), float("nan"))
+        lo_hi = [self._bounds.get(c, nan) for c in self.comps]
+        return np.array([b[0] for b in lo_hi], dtype=float), np.array([b[1] for b in lo_hi], dtype=float)
+
+def _ranking(scores: List[Score]) -> List[Dict[str, Any]]:
+    ranked = sorted(scores, key=lambda s: s.total_score, reverse=True)
+    return [{"supplier": s.supplier_name, "total_score": s.total_score} for s in ranked]
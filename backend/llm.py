@@ -4,55 +4,111 @@ LLM gateway using Google's GenAI SDK (free-tier capable, image-friendly).
 - Requires: pip install google-genai
 - Auth: set GEMINI_API_KEY or GOOGLE_API_KEY env var.
 """
-import json, re
-from typing import List, Optional, Any, Dict
-from PIL import Image
-from io import BytesIO
-from . import config
-from dotenv import load_dotenv
-
-load_dotenv()  # load .env
-
-# --- GenAI SDK imports / client ---
-try:
-    from google import genai
-    from google.genai.types import Part
-    _CLIENT = genai.Client()  # picks up GEMINI_API_KEY or GOOGLE_API_KEY
-    _INIT_ERROR = None
-except Exception as e:
-    _CLIENT = None
-    Part = None
-    _INIT_ERROR = e
+import hashlib, json, random, re, threading, time
+from abc import ABC, abstractmethod
+from typing import List, Optional, Any, Dict, Tuple
+from . import config, llm_cache, image_prep, prompt_budget, llm_metrics
+from . import event_log as log
+from .concurrency import llm_breaker
+
+# The GenAI SDK (~0.5s to import) and its client are loaded on first use, not at import:
+# CLI runs on the mock backend, worker processes and Streamlit reruns never pay for them.
+_CLIENT = None
+_INIT_ERROR: Optional[Exception] = None
+_CLIENT_LOCK = threading.Lock()
+Part = None
 
 JSON_INSTRUCTIONS = "Always respond with **only** minified JSON. Do not include prose."
 
 def _ensure_client():
+    """Import the SDK and build the client once (picks up GEMINI_API_KEY or GOOGLE_API_KEY, .env included)."""
+    global _CLIENT, _INIT_ERROR, Part
+    if _CLIENT is not None:
+        return _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None and _INIT_ERROR is None:
+            try:
+                from dotenv import load_dotenv
+                load_dotenv()  # load .env
+            except ImportError:
+                pass
+            try:
+                from google import genai
+                from google.genai.types import Part as _Part
+                _CLIENT, Part = genai.Client(), _Part
+            except Exception as e:
+                _INIT_ERROR = e
     if _CLIENT is None:
         raise RuntimeError(f"LLM client not initialized: {_INIT_ERROR}")
+    return _CLIENT
+
+# Gemini context caches for long system prompts: sha256(model + prompt) -> (cache name, expires_at)
+_CONTEXT_CACHES: Dict[str, Any] = {}
+_CONTEXT_LOCK = threading.Lock()
+
+def _context_cache(sys: str) -> Optional[str]:
+    """
+    Name of a server-side cached content holding this system prompt, creating it on first use.
+    Only prompts of at least LLM_CONTEXT_CACHE_MIN_TOKENS are cached (the API has a minimum);
+    None means "send the prompt inline" (too short, unsupported model/SDK, or creation failed).
+    """
+    if config.LLM_CONTEXT_CACHE_MIN_TOKENS <= 0 or prompt_budget.estimate_tokens(sys) < config.LLM_CONTEXT_CACHE_MIN_TOKENS:
+        return None
+    key = hashlib.sha256(f"{config.GEMINI_MODEL}\n{sys}".encode("utf-8")).hexdigest()
+    with _CONTEXT_LOCK:
+        entry = _CONTEXT_CACHES.get(key)
+        if entry is not None and (entry[0] is None or entry[1] > time.time() + 60):
+            return entry[0]
+        ttl = config.LLM_CONTEXT_CACHE_TTL_S
+        try:
+            cached = _CLIENT.caches.create(
+                model=config.GEMINI_MODEL,
+                config={"system_instruction": sys, "ttl": f"{ttl}s", "display_name": f"sys-{key[:12]}"},
+            )
+            _CONTEXT_CACHES[key] = (cached.name, time.time() + ttl)
+            log.log_event("llm", "context_cache_created", level="DEBUG", name=cached.name,
+                          est_tokens=prompt_budget.estimate_tokens(sys), ttl_s=ttl)
+        except Exception as e:
+            _CONTEXT_CACHES[key] = (None, float("inf"))  # don't retry a failing create on every call
+            log.log_event("llm", "context_cache_unavailable", level="WARNING", error=str(e)[:300])
+        return _CONTEXT_CACHES[key][0]
+
+def _forget_context_cache(name: str) -> None:
+    with _CONTEXT_LOCK:
+        for key, entry in list(_CONTEXT_CACHES.items()):
+            if entry[0] == name:
+                del _CONTEXT_CACHES[key]
+
+def _is_cache_miss(e: Exception) -> bool:
+    """The request's cached_content no longer exists (expired, evicted or deleted)."""
+    msg = str(e).lower()
+    return _status_code(e) in (400, 403, 404) and "cache" in msg and any(
+        w in msg for w in ("not found", "expired", "not exist", "notfound", "permission"))
 
 def _image_to_part(path: str):
-    """Return a google.genai.types.Part for an image (JPEG)."""
-    img = Image.open(path).convert("RGB")
-    buf = BytesIO()
-    img.save(buf, format="JPEG")
-    data = buf.getvalue()
+    """Return a google.genai.types.Part for an image (downscaled JPEG, cached per file digest)."""
+    data = image_prep.encode_jpeg(path)
     # From the new SDK: use keyword args for Part constructors
     return Part.from_bytes(data=data, mime_type="image/jpeg")
 
 def extract_json(text: str) -> Dict[str, Any]:
     """Robustly coerce LLM output into JSON dict."""
+    return extract_json_with_path(text)[0]
+
+def extract_json_with_path(text: str) -> Tuple[Dict[str, Any], str]:
+    """extract_json plus which step parsed it: direct | fence | span | repaired | failed | empty."""
     if not text:
-        return {}
+        return {}, "empty"
     # 1) direct parse
     try:
-        return json.loads(text)
+        return json.loads(text), "direct"
     except Exception:
         pass
     # 2) fenced ```json blocks
     fence = re.findall(r"```json\s*(\{.*?\})\s*```", text, flags=re.S)
     if fence:
         try:
-            return json.loads(fence[0])
+            return json.loads(fence[0]), "fence"
         except Exception:
             pass
     # 3) first {...} span
@@ -61,15 +117,15 @@ def extract_json(text: str) -> Dict[str, Any]:
     if start != -1 and end != -1 and end > start:
         snippet = text[start:end+1]
         try:
-            return json.loads(snippet)
+            return json.loads(snippet), "span"
         except Exception:
             # small repair: remove trailing commas
             snippet = re.sub(r",(\s*[}\]])", r"\1", snippet)
             try:
-                return json.loads(snippet)
+                return json.loads(snippet), "repaired"
             except Exception:
                 pass
-    return {}
+    return {}, "failed"
 
 def generate_json(
     system_prompt: str,
@@ -79,50 +135,204 @@ def generate_json(
 ) -> Dict[str, Any]:
     """
     Calls Gemini with optional image parts, enforcing JSON-only output.
-    Returns a parsed dict (empty dict if parsing fails).
+    Returns a parsed dict (empty dict if parsing fails, even after one stricter re-ask).
+    Responses are served from the on-disk cache when the exact request was seen before.
+    Transient provider errors are retried with backoff behind the shared circuit breaker;
+    other errors, and transient ones past LLM_MAX_RETRIES, raise.
+    Every call is recorded as an llm_call event (see llm_metrics).
     """
-    _ensure_client()
-    sys = f"{system_prompt}\n\n{JSON_INSTRUCTIONS}"
+    t0 = time.perf_counter()
+    cache_key = llm_cache.make_key(system_prompt, user_prompt, images) if config.LLM_CACHE_ENABLED else None
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            llm_metrics.record((time.perf_counter() - t0) * 1000, cache="hit")
+            return cached
+    breaker = llm_breaker()
+    stats = {"attempts": 0, "retries": 0, "throttled": 0, "breaker_wait_ms": 0.0, "reask": None}
+    sys = system_prompt
+    while True:
+        stats["attempts"] += 1
+        stats["breaker_wait_ms"] += breaker.before_call() * 1000
+        try:
+            data, usage, parse, backend_retries = _call(sys, user_prompt, images)
+        except Exception as e:
+            status = _status_code(e)
+            transient = _is_transient(e, status)
+            if transient:
+                breaker.failure()
+                stats["throttled"] += status == 429
+            else:
+                breaker.success()  # the provider answered; the request itself is bad
+            if not transient or stats["attempts"] > config.LLM_MAX_RETRIES:
+                llm_metrics.record((time.perf_counter() - t0) * 1000, outcome="error", level="WARNING",
+                                   cache="miss" if cache_key else "off", status=status,
+                                   error=f"{type(e).__name__}: {str(e)[:200]}", **_rounded(stats))
+                raise
+            retry_after = _retry_after(e)
+            delay = retry_after if retry_after is not None else min(
+                config.LLM_BACKOFF_MAX_S, config.LLM_BACKOFF_BASE_S * 2 ** (stats["attempts"] - 1)
+            ) * random.uniform(0.5, 1.0)
+            if status == 429 and retry_after is not None:
+                breaker.pause(retry_after)  # the provider said when: hold every caller back, not just this one
+            stats["retries"] += 1
+            log.log_event("llm", "retry", level="DEBUG", status=status, attempt=stats["attempts"],
+                          delay_s=round(delay, 3), error=f"{type(e).__name__}: {str(e)[:200]}")
+            time.sleep(delay)
+            continue
+        breaker.success()
+        stats["retries"] += backend_retries
+        if parse in ("failed", "empty") and stats["reask"] is None and config.LLM_REASK_ON_EMPTY:
+            stats["reask"] = parse
+            sys = system_prompt + STRICT_JSON_SUFFIX
+            log.log_event("llm", "reask", level="DEBUG", parse=parse)
+            continue
+        break
+    llm_metrics.record((time.perf_counter() - t0) * 1000, usage, cache="miss" if cache_key else "off",
+                       parse=parse, images=len(images or []), **_rounded(stats))
+    if cache_key and data:
+        llm_cache.put(cache_key, data)
+    return data or {}
+
+# Appended to the system prompt when a response could not be parsed as JSON
+STRICT_JSON_SUFFIX = (
+    "\n\nYour previous answer was not valid JSON. Reply with exactly one JSON object that follows the "
+    "requested shape: no markdown fences, no comments, no trailing commas, no text before or after it."
+)
+_TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+_TRANSIENT_NAMES = ("Timeout", "ConnectError", "RemoteProtocolError", "ServerDisconnected")
 
-    # Build content parts: user text + optional images
-    parts: List[Any] = []
+def _status_code(e: Exception) -> Optional[int]:
+    """HTTP status of a provider error (.code on google-genai APIError, .status_code on httpx-style errors)."""
+    for attr in ("code", "status_code", "status"):
+        v = getattr(e, attr, None)
+        if isinstance(v, int):
+            return v
+    return None
+
+def _is_transient(e: Exception, status: Optional[int]) -> bool:
+    if status is not None:
+        return status in _TRANSIENT_STATUS
+    return isinstance(e, (ConnectionError, TimeoutError)) or any(n in type(e).__name__ for n in _TRANSIENT_NAMES)
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """Seconds from the error's retry_after, or the Retry-After header of its HTTP response."""
+    v = getattr(e, "retry_after", None)
+    if v is None:
+        headers = getattr(getattr(e, "response", None), "headers", None)
+        try:
+            v = headers.get("retry-after") if headers is not None else None
+        except Exception:
+            v = None
     try:
-        parts.append(Part.from_text(text=sys))
-    except Exception:
-        parts.append(sys)
-    # IMPORTANT: Part.from_text requires keyword arg
-    if Part is not None:
-        parts.append(Part.from_text(text=user_prompt))
-        if images:
-            for p in images:
-                try:
-                    parts.append(_image_to_part(p))
-                except Exception:
-                    # ignore bad image; continue
-                    pass
-    else:
-        # Fallback: let SDK accept raw string if Part import failed
-        parts.append(user_prompt)
-
-    # New SDK call signature:
-    #   client.models.generate_content(model=..., contents=[Part|str,...], system_instruction=str, config={...})
-    response = _CLIENT.models.generate_content(
-        model=config.GEMINI_MODEL,
-        contents=parts,
-        config={
+        return max(0.0, float(v)) if v is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _rounded(stats: Dict[str, Any]) -> Dict[str, Any]:
+    return {**stats, "breaker_wait_ms": round(stats["breaker_wait_ms"], 1)}
+
+def _call(system_prompt: str, user_prompt: str, images: Optional[List[str]]) -> Tuple[Dict[str, Any], Any, str, int]:
+    """One backend round-trip. Returns (data, usage_metadata, parse path, retries)."""
+    text, usage, retries = get_backend().generate(system_prompt, user_prompt, images)
+    data, parse = extract_json_with_path(text)
+    return data, usage, parse, retries
+
+# ---------- Backends ----------
+
+class Backend(ABC):
+    """An LLM provider. generate() returns (response text, usage metadata or None, retries)."""
+    name = "base"
+
+    @abstractmethod
+    def generate(self, system_prompt: str, user_prompt: str, images: Optional[List[str]] = None) -> Tuple[str, Any, int]:
+        ...
+
+class GeminiBackend(Backend):
+    name = "gemini"
+
+    def generate(self, system_prompt: str, user_prompt: str, images: Optional[List[str]] = None) -> Tuple[str, Any, int]:
+        _ensure_client()
+        retries = 0
+        sys = f"{system_prompt}\n\n{JSON_INSTRUCTIONS}"
+
+        # Build content parts: system text (unless served from a context cache) + user text + optional images
+        cached_sys = _context_cache(sys)
+        parts: List[Any] = []
+        if cached_sys is None:
+            try:
+                parts.append(Part.from_text(text=sys))
+            except Exception:
+                parts.append(sys)
+        # IMPORTANT: Part.from_text requires keyword arg
+        if Part is not None:
+            parts.append(Part.from_text(text=user_prompt))
+            if images:
+                for p in images:
+                    try:
+                        parts.append(_image_to_part(p))
+                    except Exception:
+                        # ignore bad image; continue
+                        pass
+        else:
+            # Fallback: let SDK accept raw string if Part import failed
+            parts.append(user_prompt)
+
+        # New SDK call signature:
+        #   client.models.generate_content(model=..., contents=[Part|str,...], system_instruction=str, config={...})
+        gen_config = {
             "temperature": config.LLM_TEMPERATURE,
             "max_output_tokens": config.MAX_OUTPUT_TOKENS,
-        },
-    )
-
-    # Prefer response.text; fallback to first candidate part text
-    out_text = getattr(response, "text", None) or ""
-    if not out_text and getattr(response, "candidates", None):
+        }
+        if cached_sys is not None:
+            gen_config["cached_content"] = cached_sys
         try:
-            # candidates[0].content.parts[0].text is typical
-            out_text = response.candidates[0].content.parts[0].text
-        except Exception:
-            out_text = ""
+            response = _CLIENT.models.generate_content(
+                model=config.GEMINI_MODEL,
+                contents=parts,
+                config=gen_config,
+            )
+        except Exception as e:
+            # Only a cache evicted/expired server-side is handled here: forget it and send the system
+            # prompt inline. Anything else (429/5xx included) goes to generate_json's backoff and breaker.
+            if cached_sys is None or not _is_cache_miss(e):
+                raise
+            _forget_context_cache(cached_sys)
+            log.log_event("llm", "context_cache_failed", level="WARNING", name=cached_sys, error=str(e)[:300])
+            gen_config.pop("cached_content")
+            retries += 1
+            response = _CLIENT.models.generate_content(
+                model=config.GEMINI_MODEL,
+                contents=[sys] + parts,
+                config=gen_config,
+            )
 
-    data = extract_json(out_text)
-    return data or {}
+        # Prefer response.text; fallback to first candidate part text
+        out_text = getattr(response, "text", None) or ""
+        if not out_text and getattr(response, "candidates", None):
+            try:
+                # candidates[0].content.parts[0].text is typical
+                out_text = response.candidates[0].content.parts[0].text
+            except Exception:
+                out_text = ""
+        return out_text, getattr(response, "usage_metadata", None), retries
+
+_BACKEND: Optional[Backend] = None
+
+def get_backend() -> Backend:
+    """The active backend: set_backend(), else LLM_BACKEND ("gemini" | "mock")."""
+    global _BACKEND
+    if _BACKEND is None:
+        if config.LLM_BACKEND == "mock":
+            from .llm_mock import MockBackend
+            _BACKEND = MockBackend()
+        elif config.LLM_BACKEND == "gemini":
+            _BACKEND = GeminiBackend()
+        else:
+            raise ValueError(f"Unknown LLM_BACKEND: {config.LLM_BACKEND!r} (expected gemini or mock)")
+    return _BACKEND
+
+def set_backend(backend: Optional[Backend]) -> None:
+    """Install a backend for this process (None: back to LLM_BACKEND on next call)."""
+    global _BACKEND
+    _BACKEND = backend
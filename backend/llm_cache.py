@@ -0,0 +1,143 @@
+# backend/llm_cache.py
+# Content-addressed on-disk cache for LLM JSON responses (size-bounded LRU by mtime).
+from __future__ import annotations
+import hashlib, json, os, threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from . import config
+from . import event_log as log
+
+_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+class DiskLRU:
+    """
+    Files matching `pattern` under a cache directory, kept under a byte budget by evicting the
+    least recently used (oldest mtime; reads touch the file). Shared by llm_cache and image_prep.
+    """
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self._lock = threading.Lock()
+        self._root: Optional[Path] = None
+        self._size: Optional[int] = None  # bytes under _root; computed lazily on first write
+
+    def read(self, path: Path) -> Optional[bytes]:
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # touch => most recently used
+        except OSError:
+            return None
+        return data
+
+    def write(self, root: Path, path: Path, data: bytes, max_bytes: int) -> int:
+        """Atomically write path (under root); returns how many entries were evicted to fit max_bytes."""
+        with self._lock:
+            if self._size is None or self._root != root:
+                self._root = root
+                self._size = sum(p.stat().st_size for p in root.rglob(self.pattern)) if root.exists() else 0
+            path.parent.mkdir(parents=True, exist_ok=True)
+            old = path.stat().st_size if path.exists() else 0
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+            self._size += len(data) - old
+            return self._evict_locked(max_bytes) if self._size > max_bytes else 0
+
+    def _evict_locked(self, max_bytes: int) -> int:
+        entries = []
+        for p in self._root.rglob(self.pattern):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        target = int(max_bytes * 0.9)  # leave headroom so we don't evict on every put
+        evicted = 0
+        for _, size, p in entries:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        self._size = total
+        return evicted
+
+    def clear(self, root: Path) -> None:
+        with self._lock:
+            if root.exists():
+                for p in root.rglob(self.pattern):
+                    p.unlink()
+            self._root, self._size = root, 0
+
+_DISK = DiskLRU("*.json")
+
+def _cache_dir() -> Path:
+    return Path(config.LLM_CACHE_DIR)
+
+def file_digest(path: str) -> str:
+    """sha256 of a file's bytes (images are keyed by content, not by path)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def make_key(system_prompt: str, user_prompt: str, images: Optional[List[str]] = None) -> str:
+    digests = []
+    for p in images or []:
+        try:
+            digests.append(file_digest(p))
+        except OSError:
+            digests.append(f"missing:{p}")
+    material = {
+        "model": config.GEMINI_MODEL if config.LLM_BACKEND == "gemini" else f"{config.LLM_BACKEND}:{config.GEMINI_MODEL}",
+        "temperature": config.LLM_TEMPERATURE,
+        "max_output_tokens": config.MAX_OUTPUT_TOKENS,
+        "system": system_prompt,
+        "user": user_prompt,
+        "images": digests,
+    }
+    blob = json.dumps(material, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+def _entry_path(key: str) -> Path:
+    return _cache_dir() / key[:2] / f"{key}.json"
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    if not config.LLM_CACHE_ENABLED:
+        return None
+    blob = _DISK.read(_entry_path(key))
+    try:
+        data = json.loads(blob.decode("utf-8")) if blob is not None else None
+    except ValueError:
+        data = None
+    if data is None:
+        with _LOCK:
+            _STATS["misses"] += 1
+        log.log_event("llm_cache", "miss", level="DEBUG", key=key[:16], **stats())
+        return None
+    with _LOCK:
+        _STATS["hits"] += 1
+    log.log_event("llm_cache", "hit", level="DEBUG", key=key[:16], **stats())
+    return data
+
+def put(key: str, data: Dict[str, Any]) -> None:
+    """Store a non-empty response; evict least-recently-used entries past the size budget."""
+    if not config.LLM_CACHE_ENABLED or not data:
+        return
+    blob = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    evicted = _DISK.write(_cache_dir(), _entry_path(key), blob, config.LLM_CACHE_MAX_BYTES)
+    if evicted:
+        with _LOCK:
+            _STATS["evictions"] += evicted
+
+def stats() -> Dict[str, int]:
+    return dict(_STATS)
+
+def clear() -> None:
+    _DISK.clear(_cache_dir())
@@ -0,0 +1,116 @@
+# backend/llm_metrics.py
+# Per-call LLM metrics ("llm_call" events) and their per-stage / per-run aggregation.
+#
+# Each generate_json call logs one event: stage (innermost open span), latency, token usage
+# from the response's usage metadata, how the JSON was parsed, retries (429s among them),
+# stricter re-asks, time spent held by the circuit breaker, and cache outcome.
+# Reports are rebuilt from the run's event log, so calls made by other processes count too.
+from __future__ import annotations
+import json
+from typing import Any, Dict, Iterator, List, Optional
+from . import config, log_store
+from . import event_log as log
+
+STEP = "llm_call"
+
+def record(latency_ms: float, usage: Any = None, outcome: str = "ok", level: str = "INFO", **fields: Any) -> None:
+    """Log one call. usage: the response's usage_metadata (or None for cache hits / failures)."""
+    log.log_event(STEP, outcome, level=level, stage=log.current_step() or "unknown",
+                  latency_ms=round(latency_ms, 1), **usage_tokens(usage), **fields)
+
+def usage_tokens(usage: Any) -> Dict[str, int]:
+    def get(name: str) -> int:
+        v = getattr(usage, name, None) if usage is not None else None
+        if v is None and isinstance(usage, dict):
+            v = usage.get(name)
+        return int(v or 0)
+    return {
+        "in_tokens": get("prompt_token_count"),
+        "out_tokens": get("candidates_token_count"),
+        "cached_tokens": get("cached_content_token_count"),
+    }
+
+def cost_usd(in_tokens: int, out_tokens: int, cached_tokens: int = 0) -> float:
+    fresh_in = max(in_tokens - cached_tokens, 0)
+    return (fresh_in * config.LLM_PRICE_IN_PER_M
+            + cached_tokens * config.LLM_PRICE_CACHED_IN_PER_M
+            + out_tokens * config.LLM_PRICE_OUT_PER_M) / 1_000_000
+
+def _events(run_id: str, step: str = STEP, page: int = 5000) -> Iterator[Dict[str, Any]]:
+    offset = 0
+    while True:
+        recs, total = log_store.query(run_id, steps=[step], offset=offset, limit=page)
+        yield from recs
+        offset += page
+        if offset >= total:
+            return
+
+def _pct(sorted_vals: List[float], p: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(len(sorted_vals) - 1, int(round(p * (len(sorted_vals) - 1))))]
+
+def _new_bucket() -> Dict[str, Any]:
+    return {"calls": 0, "api_calls": 0, "cache_hits": 0, "errors": 0, "retries": 0, "throttled": 0,
+            "reasks": 0, "breaker_wait_ms": 0.0, "in_tokens": 0, "out_tokens": 0, "cached_tokens": 0,
+            "parse": {}, "_lat": []}
+
+def run_report(run_id: Optional[str] = None) -> Dict[str, Any]:
+    """{"run_id", "total": {...}, "stages": {stage: {...}}} from the run's llm_call events."""
+    run_id = run_id or log.RUN_ID or ""
+    log.flush()
+    total, stages = _new_bucket(), {}
+    for rec in _events(run_id):
+        p = rec.get("payload") or {}
+        for b in (total, stages.setdefault(p.get("stage") or "unknown", _new_bucket())):
+            b["calls"] += 1
+            if p.get("cache") == "hit":
+                b["cache_hits"] += 1
+            else:
+                b["api_calls"] += 1
+                b["_lat"].append(float(p.get("latency_ms") or 0))
+            if rec.get("message") == "error":
+                b["errors"] += 1
+            b["retries"] += int(p.get("retries") or 0)
+            b["throttled"] += int(p.get("throttled") or 0)
+            b["reasks"] += 1 if p.get("reask") else 0
+            b["breaker_wait_ms"] += float(p.get("breaker_wait_ms") or 0)
+            for k in ("in_tokens", "out_tokens", "cached_tokens"):
+                b[k] += int(p.get(k) or 0)
+            parse = p.get("parse")
+            if parse:
+                b["parse"][parse] = b["parse"].get(parse, 0) + 1
+    for b in [total, *stages.values()]:
+        lat = sorted(b.pop("_lat"))
+        b["latency_ms"] = {"p50": _pct(lat, 0.5), "p95": _pct(lat, 0.95), "max": lat[-1] if lat else None,
+                           "sum": round(sum(lat), 1)}
+        b["cost_usd"] = round(cost_usd(b["in_tokens"], b["out_tokens"], b["cached_tokens"]), 6)
+        b["breaker_wait_ms"] = round(b["breaker_wait_ms"], 1)
+    total["circuit_opens"] = sum(1 for rec in _events(run_id, step="llm") if rec.get("message") == "circuit_open")
+    return {"run_id": run_id, "model": config.GEMINI_MODEL, "total": total, "stages": stages}
+
+def write_report(run_id: Optional[str] = None) -> Dict[str, Any]:
+    """Compute the report, log it as an event and store it next to the run's log segments."""
+    report = run_report(run_id)
+    log.log_event("llm_summary", "report", **report["total"])
+    path = log.run_log_dir(report["run_id"]) / "llm_report.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    report["path"] = str(path)
+    return report
+
+def format_report(report: Dict[str, Any]) -> str:
+    rows = [("stage", "calls", "api", "hits", "err", "retry", "429", "reask", "in_tok", "out_tok", "p50_ms", "p95_ms", "cost_$")]
+    for name, b in sorted(report["stages"].items()) + [("TOTAL", report["total"])]:
+        lat = b["latency_ms"]
+        rows.append((name, b["calls"], b["api_calls"], b["cache_hits"], b["errors"], b["retries"],
+                     b.get("throttled", 0), b.get("reasks", 0),
+                     b["in_tokens"], b["out_tokens"], lat["p50"] if lat["p50"] is not None else "-",
+                     lat["p95"] if lat["p95"] is not None else "-", f"{b['cost_usd']:.4f}"))
+    widths = [max(len(str(r[i])) for r in rows) for i in range(len(rows[0]))]
+    table = "\n".join("  ".join(str(v).ljust(w) if i == 0 else str(v).rjust(w) for i, (v, w) in enumerate(zip(r, widths)))
+                       for r in rows)
+    total = report["total"]
+    if total.get("circuit_opens") or total.get("breaker_wait_ms"):
+        table += f"\ncircuit breaker: opened {total.get('circuit_opens', 0)}x, callers held {total['breaker_wait_ms'] / 1000:.1f}s"
+    return table
@@ -0,0 +1,145 @@
+# backend/llm_mock.py
+# Deterministic local LLM backend (LLM_BACKEND=mock) for offline runs and benchmarks.
+#
+# Responses are canned per prompt type (recognized by the system prompt text) and derived
+# from a hash of the request, so the same request always gets the same answer. Latency is
+# lognormal around LLM_MOCK_LATENCY_MS; LLM_MOCK_ERROR_RATE of calls raise MockProviderError
+# with a 429/503 code, like a degraded provider would, and LLM_MOCK_BAD_JSON_RATE of answers
+# come back truncated (unparseable).
+from __future__ import annotations
+import hashlib, json, random, re, threading, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from . import config, prompt_budget
+from .llm import Backend, JSON_INSTRUCTIONS, STRICT_JSON_SUFFIX
+
+CATEGORIES = ["Ball Bearings", "Gaskets", "Computer Peripherals", "Packaging Materials", "Electrical Components"]
+_CATEGORY_WORDS = {c: [w.lower().rstrip("s") for w in c.split()] for c in CATEGORIES}
+
+class MockProviderError(Exception):
+    """Shaped like the SDK's API errors: .code is the HTTP status."""
+    def __init__(self, code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.retry_after = retry_after
+
+class MockUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = 0
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+class MockBackend(Backend):
+    name = "mock"
+
+    def __init__(self, latency_ms: Optional[float] = None, sigma: Optional[float] = None,
+                 error_rate: Optional[float] = None, seed: Optional[int] = None,
+                 bad_json_rate: Optional[float] = None):
+        self.latency_ms = config.LLM_MOCK_LATENCY_MS if latency_ms is None else latency_ms
+        self.sigma = config.LLM_MOCK_LATENCY_SIGMA if sigma is None else sigma
+        self.error_rate = config.LLM_MOCK_ERROR_RATE if error_rate is None else error_rate
+        self.seed = config.LLM_MOCK_SEED if seed is None else seed
+        self.bad_json_rate = config.LLM_MOCK_BAD_JSON_RATE if bad_json_rate is None else bad_json_rate
+        self.calls = 0
+        self._attempts: Dict[str, int] = {}  # request digest -> failed attempts, so a retry rolls again
+        self._lock = threading.Lock()
+        self._prompts: Optional[Dict[str, str]] = None
+
+    def _prompt_name(self, system_prompt: str) -> Optional[str]:
+        if self._prompts is None:
+            self._prompts = {config.get_prompt(p.stem): p.stem for p in config.PROMPTS_DIR.glob("*.txt")}
+        return self._prompts.get(system_prompt.split(STRICT_JSON_SUFFIX)[0])
+
+    def generate(self, system_prompt: str, user_prompt: str, images: Optional[List[str]] = None) -> Tuple[str, Any, int]:
+        digest = hashlib.sha256(f"{self.seed}\n{system_prompt}\n{user_prompt}".encode("utf-8")).hexdigest()
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts.get(digest, 0)
+        rng = random.Random(f"{digest}:{attempt}")
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms * rng.lognormvariate(0.0, self.sigma) / 1000.0)
+        if self.error_rate > 0 and rng.random() < self.error_rate:
+            with self._lock:
+                self._attempts[digest] = attempt + 1
+            code = rng.choice((429, 503))
+            raise MockProviderError(code, "mock provider overloaded", retry_after=0.01 if code == 429 else None)
+        if attempt:
+            with self._lock:
+                self._attempts.pop(digest, None)
+        responder = _RESPONDERS.get(self._prompt_name(system_prompt) or "", lambda u, r: {})
+        try:
+            user = json.loads(user_prompt)
+        except ValueError:
+            user = {}
+        text = json.dumps(responder(user, random.Random(digest)), ensure_ascii=False, separators=(",", ":"))
+        if self.bad_json_rate > 0 and rng.random() < self.bad_json_rate:
+            text = "Sure! Here is the JSON: " + text[: max(1, len(text) // 2)]
+        usage = MockUsage(prompt_budget.estimate_tokens(system_prompt + JSON_INSTRUCTIONS + user_prompt) + 258 * len(images or []),
+                          prompt_budget.estimate_tokens(text))
+        return text, usage, 0
+
+# ---------- Canned responses per prompt ----------
+
+def _category(title: str, rng: random.Random) -> Tuple[str, float]:
+    words = set(re.findall(r"[a-z]+", (title or "").lower().replace("_", " ")))
+    words |= {w.rstrip("s") for w in words}
+    for c, cw in _CATEGORY_WORDS.items():
+        if any(w in words for w in cw if len(w) > 3):
+            return c, round(rng.uniform(0.8, 0.97), 2)
+    return rng.choice(CATEGORIES), round(rng.uniform(0.4, 0.7), 2)
+
+def _quote(user: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    price = round(rng.uniform(50, 2000), 2)
+    return {
+        "sku_id": user.get("sku_id"),
+        "title": user.get("title"),
+        "components": {
+            "specification": {"ideal_value": 1, "floor_value": round(rng.uniform(0.5, 0.8), 2), "supplier_bids": []},
+            "OTIF": {"ideal_value": rng.choice([95, 98, 99]), "floor_value": 90, "supplier_bids": []},
+            "payment_timeline": {"ideal_value": rng.choice([30, 45, 60]), "floor_value": 15, "supplier_bids": []},
+            "price": {"ideal_value": price, "floor_value": round(price * 1.3, 2), "supplier_bids": []},
+        },
+    }
+
+def _categorize(user: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    category, conf = _category(user.get("title") or "", rng)
+    return {"category": category, "confidence": conf, "rationale": "Mock categorization from title keywords."}
+
+def _categorize_batch(user: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    return {"items": [{"sku_id": it.get("sku_id"), **_categorize(it, rng)} for it in user.get("items") or []]}
+
+def _email(user: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    skus = ", ".join(s.get("sku_id", "") for s in (user.get("skus") or [])[:20])
+    name = user.get("supplier_name", "{supplier_name}")
+    return {"subject": f"RFQ: {user.get('category', 'items')}",
+            "body": f"Hello {name},\nPlease quote specification (0-1), OTIF (%), payment_timeline (days) and price for: {skus}.\nThanks,\nProcurement"}
+
+def _formula(user: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    from .evaluator import DEFAULT_FORMULA
+    return dict(DEFAULT_FORMULA)
+
+def _terms(text: str) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for comp, rx in (("price", r"price\D{0,12}(\d+(?:\.\d+)?)"), ("OTIF", r"otif\D{0,12}(\d+(?:\.\d+)?)"),
+                     ("payment_timeline", r"net\s*(\d+)|(\d+)\s*days")):
+        m = re.search(rx, text or "", flags=re.I)
+        if m:
+            out[comp] = float(next(g for g in m.groups() if g))
+    return out
+
+def _reply(user: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    return {"components": _terms(user.get("reply", ""))}
+
+def _reply_batch(user: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    return {"items": [{"id": it.get("id"), "components": _terms(it.get("reply", ""))} for it in user.get("items") or []]}
+
+_RESPONDERS: Dict[str, Callable[[Dict[str, Any], random.Random], Dict[str, Any]]] = {
+    "INITIAL_QUOTE_SYS": _quote,
+    "CATEGORIZE_SKU_SERVICE_SYS": _categorize,
+    "CATEGORIZE_SKU_BATCH_SYS": _categorize_batch,
+    "INITIAL_EMAIL_SYS": _email,
+    "INITIAL_EMAIL_TEMPLATE_SYS": _email,
+    "WEIGHTED_SCORING_FORMULA_GEN_SYS": _formula,
+    "REPLY_EXTRACT_SYS": _reply,
+    "REPLY_EXTRACT_BATCH_SYS": _reply_batch,
+}
@@ -0,0 +1,217 @@
+# backend/log_store.py
+# Per-run, size-rotated JSONL segments with a sidecar offset index for lazy/paged reads.
+#
+# Layout under AGENT_LOG_DIR (default results/logs):
+#   runs.jsonl                       one line per run: {"run_id", "ts"}
+#   <run_id>/events-00000.jsonl      event segments, rotated at AGENT_LOG_SEGMENT_MB
+#   <run_id>/index.jsonl             one line per (flush batch, step, level):
+#                                    {"seg", "step", "level", "t0", "t1", "off": [...], "len": [...], "ts": [...]}
+from __future__ import annotations
+import json, os, threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from . import config
+
+try:
+    import fcntl  # cross-process lock around offset bookkeeping (POSIX)
+except ImportError:  # pragma: no cover - Windows: single-writer-process assumption
+    fcntl = None
+
+LOG_DIR = Path(os.getenv("AGENT_LOG_DIR", config.RESULTS_DIR / "logs"))
+SEGMENT_MAX_BYTES = int(float(os.getenv("AGENT_LOG_SEGMENT_MB", "64")) * 1024 * 1024)
+RUNS_FILE = "runs.jsonl"
+INDEX_FILE = "index.jsonl"
+
+# (step, level, ts, serialized line)
+Record = Tuple[str, str, float, str]
+
+_LOCK = threading.Lock()
+_INDEX_CACHE: Dict[str, Tuple[int, List[Dict[str, Any]]]] = {}  # run_id -> (bytes read, entries)
+
+def run_dir(run_id: str) -> Path:
+    return LOG_DIR / run_id
+
+def _segment_name(n: int) -> str:
+    return f"events-{n:05d}.jsonl"
+
+def _append(path: Path, data: bytes) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+class _RunLock:
+    def __init__(self, d: Path):
+        self.path = d / ".lock"
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        return False
+
+def append_batch(run_id: str, records: Sequence[Record]) -> None:
+    """Append records to the run's current segment (rotating by size) and index them."""
+    if not records:
+        return
+    d = run_dir(run_id)
+    with _LOCK:
+        if not d.exists():
+            d.mkdir(parents=True, exist_ok=True)
+            _append(LOG_DIR / RUNS_FILE, (json.dumps({"run_id": run_id, "ts": records[0][2]}) + "\n").encode("utf-8"))
+        with _RunLock(d):
+            segs = sorted(d.glob("events-*.jsonl"))
+            seg_no = int(segs[-1].stem.split("-")[1]) if segs else 0
+            seg = d / _segment_name(seg_no)
+            size = seg.stat().st_size if seg.exists() else 0
+            if size >= SEGMENT_MAX_BYTES:
+                seg_no, size = seg_no + 1, 0
+                seg = d / _segment_name(seg_no)
+
+            groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+            chunks: List[bytes] = []
+            off = size
+            for step, level, ts, line in records:
+                b = line.encode("utf-8")
+                g = groups.get((step, level))
+                if g is None:
+                    g = groups[(step, level)] = {"seg": seg_no, "step": step, "level": level, "t0": ts, "t1": ts,
+                                                 "off": [], "len": [], "ts": []}
+                g["t0"], g["t1"] = min(g["t0"], ts), max(g["t1"], ts)
+                g["off"].append(off)
+                g["len"].append(len(b))
+                g["ts"].append(ts)
+                chunks.append(b)
+                off += len(b)
+            _append(seg, b"".join(chunks))
+            _append(d / INDEX_FILE, "".join(json.dumps(g, separators=(",", ":")) + "\n" for g in groups.values()).encode("utf-8"))
+
+# ---------- Readers ----------
+
+def list_runs(limit: int = 50) -> List[Dict[str, Any]]:
+    """Most recent runs first; reads only the tail of runs.jsonl."""
+    out, seen = [], set()
+    for line in reversed(_tail_lines(LOG_DIR / RUNS_FILE, limit)):
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if rec.get("run_id") not in seen:
+            seen.add(rec.get("run_id"))
+            out.append(rec)
+    return out
+
+def _tail_lines(path: Path, n: int, chunk: int = 8192) -> List[str]:
+    if not path.exists():
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= n:
+            step = min(chunk, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+    lines = [l for l in buf.decode("utf-8", errors="ignore").splitlines() if l.strip()]
+    return lines[-n:]
+
+def load_index(run_id: str) -> List[Dict[str, Any]]:
+    """Index entries for one run; re-reads only what was appended since the last call."""
+    path = run_dir(run_id) / INDEX_FILE
+    if not path.exists():
+        return []
+    read, entries = _INDEX_CACHE.get(run_id, (0, []))
+    size = path.stat().st_size
+    if size < read:  # truncated/replaced
+        read, entries = 0, []
+    if size > read:
+        with open(path, "rb") as f:
+            f.seek(read)
+            data = f.read(size - read)
+        # keep a partially-written trailing line for next time
+        complete = data[: data.rfind(b"\n") + 1]
+        for line in complete.decode("utf-8").splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                pass
+        read += len(complete)
+        _INDEX_CACHE[run_id] = (read, entries)
+    return entries
+
+def run_summary(run_id: str) -> Dict[str, Any]:
+    entries = load_index(run_id)
+    steps: Dict[str, int] = {}
+    levels: Dict[str, int] = {}
+    for e in entries:
+        steps[e["step"]] = steps.get(e["step"], 0) + len(e["off"])
+        levels[e["level"]] = levels.get(e["level"], 0) + len(e["off"])
+    return {
+        "run_id": run_id,
+        "events": sum(steps.values()),
+        "steps": steps,
+        "levels": levels,
+        "t0": min((e["t0"] for e in entries), default=None),
+        "t1": max((e["t1"] for e in entries), default=None),
+    }
+
+def query(
+    run_id: str,
+    steps: Optional[Iterable[str]] = None,
+    levels: Optional[Iterable[str]] = None,
+    t0: Optional[float] = None,
+    t1: Optional[float] = None,
+    offset: int = 0,
+    limit: int = 500,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Return (records, total_matches) for one run in chronological order.
+    Filters (including the exact per-record time range) are applied on the index before
+    paging; only the byte ranges for the requested page are read from the segments.
+    """
+    steps = set(steps) if steps else None
+    levels = set(levels) if levels else None
+    refs: List[Tuple[int, int, int]] = []  # (seg, offset, length)
+    for e in load_index(run_id):
+        if steps is not None and e["step"] not in steps:
+            continue
+        if levels is not None and e["level"] not in levels:
+            continue
+        if (t0 is not None and e["t1"] < t0) or (t1 is not None and e["t0"] > t1):
+            continue
+        if (t0 is None or e["t0"] >= t0) and (t1 is None or e["t1"] <= t1):
+            refs.extend((e["seg"], o, n) for o, n in zip(e["off"], e["len"]))
+            continue
+        # Group straddles the range: filter per record
+        refs.extend((e["seg"], o, n) for o, n, ts in zip(e["off"], e["len"], e["ts"])
+                    if (t0 is None or ts >= t0) and (t1 is None or ts <= t1))
+    refs.sort()
+    total = len(refs)
+    page = refs[offset: offset + limit]
+
+    out: List[Dict[str, Any]] = []
+    handles: Dict[int, Any] = {}
+    try:
+        for seg, o, n in page:
+            f = handles.get(seg)
+            if f is None:
+                f = handles[seg] = open(run_dir(run_id) / _segment_name(seg), "rb")
+            f.seek(o)
+            try:
+                rec = json.loads(f.read(n))
+            except ValueError:
+                continue
+            out.append(rec)
+    finally:
+        for f in handles.values():
+            f.close()
+    return out, total
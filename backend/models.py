@@ -1,8 +1,10 @@
 # models.py
-from dataclasses import dataclass, field, asdict
+# Slotted dataclasses (no per-instance __dict__): a large event holds millions of Bids and Scores.
+# Serialize with dataclasses.asdict / to_json rather than __dict__.
+from dataclasses import dataclass, field, fields, is_dataclass
 from typing import List, Dict, Optional, Any
 
-@dataclass
+@dataclass(slots=True)
 class SpecItem:
     sku_id: str
     title: str
@@ -10,13 +12,13 @@ class SpecItem:
     images: List[str] = field(default_factory=list)  # file paths to images (optional)
     metadata: Dict[str, Any] = field(default_factory=dict)
 
-@dataclass
+@dataclass(slots=True)
 class QuoteComponent:
     ideal_value: Optional[float] = None
     floor_value: Optional[float] = None
     supplier_bids: List[Dict[str, Any]] = field(default_factory=list)  # [{supplier: str, value: float, source: str, raw: str}]
 
-@dataclass
+@dataclass(slots=True)
 class QuoteSchema:
     sku_id: str
     category: Optional[str] = None
@@ -24,14 +26,14 @@ class QuoteSchema:
     rationale: Optional[str] = None
     components: Dict[str, QuoteComponent] = field(default_factory=dict)  # e.g., {"specification": QuoteComponent(), ...}
 
-@dataclass
+@dataclass(slots=True)
 class Supplier:
     id: str
     name: str
     category: str
     email: str
 
-@dataclass
+@dataclass(slots=True)
 class Bid:
     sku_id: str
     supplier_id: str
@@ -39,7 +41,7 @@ class Bid:
     components: Dict[str, float]  # normalized numeric values for scoring
     raw_reply: str = ""
 
-@dataclass
+@dataclass(slots=True)
 class ScoringFormula:
     # weights must sum to 1.0; direction: "higher" or "lower"
     weights: Dict[str, float] = field(default_factory=dict)
@@ -48,7 +50,7 @@ class ScoringFormula:
     min_values: Dict[str, float] = field(default_factory=dict)
     max_values: Dict[str, float] = field(default_factory=dict)
 
-@dataclass
+@dataclass(slots=True)
 class Score:
     sku_id: str
     supplier_id: str
@@ -56,21 +58,24 @@ class Score:
     total_score: float
     component_scores: Dict[str, float]
 
-@dataclass
+@dataclass(slots=True)
 class Scorecard:
     session_id: str
     scores: List[Score]
     formula: ScoringFormula
 
-def to_json(obj) -> Dict[str, Any]:
-    if hasattr(obj, "__dict__") or isinstance(obj, (list, dict)):
-        def convert(o):
-            if hasattr(o, "__dict__"):
-                return {k: convert(v) for k, v in o.__dict__.items()}
-            if isinstance(o, list):
-                return [convert(i) for i in o]
-            if isinstance(o, dict):
-                return {k: convert(v) for k, v in o.items()}
-            return o
-        return convert(obj)
-    return asdict(obj)
+def to_json(obj) -> Any:
+    if is_dataclass(obj):
+        return {f.name: to_json(getattr(obj, f.name)) for f in fields(obj)}
+    if isinstance(obj, list):
+        return [to_json(i) for i in obj]
+    if isinstance(obj, dict):
+        return {k: to_json(v) for k, v in obj.items()}
+    return obj
+
+def formula_from_json(d: Dict[str, Any]) -> ScoringFormula:
+    return ScoringFormula(**d)
+
+def scorecard_from_json(d: Dict[str, Any]) -> Scorecard:
+    return Scorecard(session_id=d["session_id"], scores=[Score(**s) for s in d["scores"]],
+                     formula=formula_from_json(d["formula"]))
@@ -0,0 +1,153 @@
+# backend/outbox.py
+# Durable outbox (SQLite): per-message state + idempotency keys so sending can resume after a crash.
+# A drainer leases the rows it claims (lease_owner/lease_until, renewed while it sends); rows left
+# in 'sending' are reclaimed only once their lease has lapsed, so concurrent drainers don't double-send.
+from __future__ import annotations
+import hashlib, json, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from . import config
+
+QUEUED, SENDING, SENT, FAILED = "queued", "sending", "sent", "failed"
+
+_SCHEMA = """
+create table if not exists messages (
+  key text primary key,
+  to_email text not null,
+  to_name text,
+  subject text,
+  body text,
+  meta text,
+  state text not null default 'queued',
+  attempts integer not null default 0,
+  last_status text,
+  last_error text,
+  lease_owner text,
+  lease_until real not null default 0,
+  created_at real not null,
+  updated_at real not null
+);
+create index if not exists messages_state on messages(state);
+"""
+
+_LOCK = threading.Lock()
+_CONN: Optional[sqlite3.Connection] = None
+_CONN_PATH: Optional[Path] = None
+
+def _conn() -> sqlite3.Connection:
+    global _CONN, _CONN_PATH
+    path = Path(config.OUTBOX_DB)
+    if _CONN is None or _CONN_PATH != path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _CONN = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        _CONN.row_factory = sqlite3.Row
+        _CONN.execute("pragma journal_mode=wal")
+        _CONN.executescript(_SCHEMA)
+        _CONN_PATH = path
+    return _CONN
+
+def idempotency_key(email: Dict[str, Any]) -> str:
+    """
+    Same supplier + SKU set => same key, regardless of subject/body wording or which run sends
+    it, so a crashed run restarted under a new run id skips what was already sent. SKU ids are
+    positional (SKU-001, ...): meta["items_digest"] (a hash of the SKUs' ids and titles) keeps
+    another catalog's SKU-001 from matching.
+    """
+    meta = email.get("meta") or {}
+    supplier = meta.get("supplier_id") or email["to_email"].strip().lower()
+    skus = ",".join(sorted(str(s) for s in meta.get("sku_ids") or []))
+    material = f"{supplier}|{meta.get('category', '')}|{skus}|{meta.get('items_digest', '')}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def items_digest(skus: Iterable[Dict[str, Any]]) -> str:
+    """Content hash of the SKUs an email asks about (ids and titles), for idempotency_key."""
+    items = sorted((str(s["sku_id"]), str(s.get("title", ""))) for s in skus)
+    return hashlib.sha256(json.dumps(items, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def enqueue(emails: Iterable[Dict[str, Any]]) -> List[str]:
+    """Insert emails as queued (no-op for keys already known). Returns keys in input order."""
+    keys, rows = [], []
+    now = time.time()
+    for e in emails:
+        k = idempotency_key(e)
+        keys.append(k)
+        rows.append((k, e["to_email"], e.get("to_name"), e.get("subject"), e.get("body"),
+                     json.dumps(e.get("meta") or {}, ensure_ascii=False), now, now))
+    with _LOCK:
+        c = _conn()
+        c.execute("begin")
+        c.executemany(
+            "insert or ignore into messages(key,to_email,to_name,subject,body,meta,created_at,updated_at) values (?,?,?,?,?,?,?,?)",
+            rows,
+        )
+        c.execute("commit")
+    return keys
+
+def claim(keys: Optional[List[str]] = None, owner: str = "", retry_failed: bool = False) -> List[Dict[str, Any]]:
+    """
+    Lease outstanding messages to owner (state 'sending', OUTBOX_LEASE_S; see renew()) and
+    return them as email dicts (with "key"). Rows in 'sending' whose lease lapsed (a crashed
+    drainer) are outstanding again (at-least-once delivery). Failed rows are retried only with
+    retry_failed, and never after a permanent client error (4xx other than 429).
+    """
+    now = time.time()
+    where = "(state=? or (state=? and lease_until<?))"
+    params: List[Any] = [QUEUED, SENDING, now]
+    if retry_failed:
+        where = f"({where} or (state=? and not (last_status glob '4[0-9][0-9]' and last_status!='429')))"
+        params.append(FAILED)
+    with _LOCK:
+        c = _conn()
+        c.execute("begin immediate")
+        if keys is None:
+            rows = c.execute(f"select * from messages where {where} order by created_at, key", params).fetchall()
+        else:
+            rows = []
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows += c.execute(
+                    f"select * from messages where {where} and key in ({','.join('?' * len(chunk))})",
+                    params + chunk,
+                ).fetchall()
+        c.executemany("update messages set state=?, lease_owner=?, lease_until=?, updated_at=? where key=?",
+                      [(SENDING, owner, now + config.OUTBOX_LEASE_S, now, r["key"]) for r in rows])
+        c.execute("commit")
+    out = [dict(r) for r in rows]
+    if keys is not None:
+        order = {k: i for i, k in enumerate(keys)}
+        out.sort(key=lambda r: order.get(r["key"], 0))
+    return [_to_email(r) for r in out]
+
+def _to_email(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {"key": row["key"], "to_email": row["to_email"], "to_name": row["to_name"], "subject": row["subject"],
+            "body": row["body"], "meta": json.loads(row["meta"] or "{}")}
+
+def renew(owner: str) -> int:
+    """Extend the lease on owner's rows still in 'sending'; returns how many it holds."""
+    now = time.time()
+    with _LOCK:
+        return _conn().execute(
+            "update messages set lease_until=?, updated_at=? where lease_owner=? and state=?",
+            (now + config.OUTBOX_LEASE_S, now, owner, SENDING),
+        ).rowcount
+
+def mark(key: str, state: str, status: Any = None, error: Optional[str] = None, attempts: int = 1) -> None:
+    with _LOCK:
+        _conn().execute(
+            "update messages set state=?, last_status=?, last_error=?, attempts=attempts+?, lease_until=0, updated_at=? where key=?",
+            (state, None if status is None else str(status), error, attempts, time.time(), key),
+        )
+
+def states(keys: List[str]) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    with _LOCK:
+        c = _conn()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            for k, st in c.execute(f"select key, state from messages where key in ({','.join('?' * len(chunk))})", chunk):
+                out[k] = st
+    return out
+
+def counts() -> Dict[str, int]:
+    with _LOCK:
+        return dict(_conn().execute("select state, count(*) from messages group by state").fetchall())
@@ -0,0 +1,99 @@
+# backend/pipeline.py
+# Checkpointed pipeline stages shared by main.run_demo and the Streamlit app.
+# Each stage declares what its output depends on; see checkpoint.Checkpointer.
+from typing import List, Dict, Any, Optional
+from . import config, agent_functions as F, agent, evaluator, email_client, checkpoint, llm_cache, classifier
+from . import event_log as log
+from .reply_sources import ReplySource
+from .models import ScoringFormula, Scorecard, formula_from_json, scorecard_from_json
+from .bid_store import BidStore
+
+def _llm_deps() -> List[Any]:
+    """Settings that change what any LLM stage returns."""
+    return [config.LLM_BACKEND, config.GEMINI_MODEL, config.LLM_TEMPERATURE, config.MAX_OUTPUT_TOKENS]
+
+def generate_schemas(ck: checkpoint.Checkpointer, specs_zip: str) -> List[Dict[str, Any]]:
+    ck.save("specs_zip", str(specs_zip))  # lets a reloaded UI session re-run from the same archive
+    # Specs stream lazily from the zip: schema generation starts with the first item
+    return ck.stage(
+        "quote_schemas",
+        [llm_cache.file_digest(specs_zip), checkpoint.prompt_digest("INITIAL_QUOTE_SYS"), _llm_deps(),
+         config.QUOTE_SPEC_TOKEN_BUDGET, config.ENABLE_PDF_TO_IMAGE, config.PDF_TIMEOUT_S,
+         config.LLM_IMAGE_MAX_EDGE, config.LLM_IMAGE_MAX_BYTES],
+        lambda: agent.create_quote_schemas(F.iter_specs_zip(specs_zip)),
+    )
+
+def categorize(ck: checkpoint.Checkpointer, quotes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return ck.stage(
+        "categorized",
+        [ck.keys.get("quote_schemas") or checkpoint.fingerprint(quotes),
+         checkpoint.prompt_digest("CATEGORIZE_SKU_SERVICE_SYS", "CATEGORIZE_SKU_BATCH_SYS"), _llm_deps(),
+         config.CLASSIFIER_THRESHOLD, classifier.state_digest()],
+        lambda: agent.categorize_items(quotes),
+    )
+
+def compose_emails(ck: checkpoint.Checkpointer, grouped: Dict[str, Dict[str, Any]], supplier_rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return ck.stage(
+        "emails",
+        [ck.keys.get("categorized"), checkpoint.fingerprint(supplier_rows), config.EMAIL_COMPOSE_MODE,
+         checkpoint.prompt_digest("INITIAL_EMAIL_SYS", "INITIAL_EMAIL_TEMPLATE_SYS"), _llm_deps()],
+        lambda: agent.prepare_initial_emails(grouped),
+    )
+
+def send_emails(ck: checkpoint.Checkpointer, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # The outbox already skips anything sent before; this also skips the drain itself
+    return ck.stage("send_results", [ck.keys.get("emails")], lambda: email_client.send_batch(emails))
+
+def build_bids(ck: checkpoint.Checkpointer, quotes: List[Dict[str, Any]], source: ReplySource) -> BidStore:
+    """
+    Replies streamed from source -> extracted terms -> columnar bids on the known SKUs.
+    With a cursor (open_source(use_cursor=True, scope=run_id)) the run's stored bids are extended
+    with only the replies not packed yet, and the checkpoint key follows the cursor position;
+    without one every reply is packed again. The cursor is acked once the bids are stored.
+    """
+    sku_ids = [q["sku_id"] for q in quotes]
+    base = checkpoint.fingerprint([ck.keys.get("categorized") or checkpoint.fingerprint(quotes),
+                                   checkpoint.prompt_digest("REPLY_EXTRACT_SYS", "REPLY_EXTRACT_BATCH_SYS"), _llm_deps()])
+    cursor = source.cursor
+    prev = ck.peek("bids") if ck.enabled and cursor is not None else None
+    if prev is not None and prev.get("base") == base:
+        store, prev_key = BidStore.from_dict(prev["bids"], sku_ids=sku_ids), ck.keys["bids"]
+    else:
+        store, prev_key = BidStore(sku_ids), None
+        if cursor is not None:
+            cursor.reset()  # nothing reusable stored: pack every reply again
+    with log.span("build_bid_store", skus=len(sku_ids), resumed=prev_key is not None) as sp:
+        added = store.extend(F.iter_bid_payloads(agent.extract_reply_components(source)))
+        store.compact()
+        sp.update("bid_store_built", new_bids=added["bids"], skipped_unknown_sku=added["skipped"], rows=len(store),
+                  suppliers=len(store.suppliers), components=len(store.comps), bytes=store.nbytes())
+    deps = [base, cursor.position() if cursor is not None else checkpoint.fingerprint(store.to_dict())]
+    if checkpoint.fingerprint(["bids", deps]) == prev_key:
+        log.log_event("checkpoint", "hit", stage="bids", key=prev_key[:16])
+    else:
+        ck.save("bids", store, deps=deps, dump=lambda s: {"base": base, "bids": s.to_dict()})
+    # Ack after the bids are stored: a crash in between re-delivers the replies, and add() keeps first values
+    source.commit()
+    return store
+
+def load_bids(ck: checkpoint.Checkpointer) -> Optional[BidStore]:
+    """The run's stored bids (session recovery); None if absent."""
+    stored = ck.peek("bids")
+    return BidStore.from_dict(stored["bids"]) if stored else None
+
+def derive_formula(ck: checkpoint.Checkpointer, quotes: List[Dict[str, Any]], bids: BidStore) -> ScoringFormula:
+    return ck.stage(
+        "formula",
+        [ck.keys.get("categorized"), ck.keys.get("bids"),
+         checkpoint.prompt_digest("WEIGHTED_SCORING_FORMULA_GEN_SYS"), _llm_deps()],
+        lambda: evaluator.derive_formula(quotes, bids),
+        load=formula_from_json,
+    )
+
+def score(ck: checkpoint.Checkpointer, bids: BidStore, formula: ScoringFormula) -> Scorecard:
+    return ck.stage(
+        "scorecard",
+        [ck.keys.get("bids"), ck.keys.get("formula")],
+        lambda: evaluator.score_bids(bids, formula),
+        load=scorecard_from_json,
+    )
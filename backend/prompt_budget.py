@@ -0,0 +1,81 @@
+# backend/prompt_budget.py
+# Local token estimates and budget-aware spec excerpts for prompts.
+from __future__ import annotations
+import math, re
+from typing import Iterable, List, Optional, Tuple
+
+# Terms that mark the parts of a spec the quote schema is built from
+QUOTE_TERMS = (
+    "price", "cost", "usd", "eur", "$", "budget", "per unit", "lot", "moq", "quantity", "qty",
+    "otif", "delivery", "lead time", "on-time", "ship", "weeks", "days",
+    "payment", "terms", "net", "invoice", "credit",
+    "spec", "material", "dimension", "size", "mm", "tolerance", "rating", "grade", "standard",
+    "warranty", "certif", "iso", "compliance",
+)
+
+_SPLIT_RE = re.compile(r"\n\s*\n|\n(?=\s*(?:#|\d+[.)]|[-*•]|[A-Z][A-Za-z /&]{2,40}:))")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+")
+GAP = "\n…\n"
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count without a tokenizer: ~4 chars/token, but never fewer than ~0.75 tokens/word."""
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), math.ceil(len(text.split()) * 0.75))
+
+def sections(text: str) -> List[str]:
+    """Paragraphs / headed or bulleted blocks; a single run-on block is split into sentences."""
+    parts = [p.strip() for p in _SPLIT_RE.split(text) if p and p.strip()]
+    if len(parts) <= 1:
+        parts = [p.strip() for p in _SENTENCE_RE.split(text) if p.strip()]
+    return parts
+
+def _relevance(section: str, terms: Iterable[str]) -> float:
+    """0 for sections with no quote terms (boilerplate); otherwise term/number density."""
+    low = section.lower()
+    hits = sum(low.count(t) for t in terms)
+    if not hits:
+        return 0.0
+    digits = sum(ch.isdigit() for ch in section)
+    return (hits * 4 + min(digits, 40) / 4) / math.sqrt(max(estimate_tokens(section), 1))
+
+def fit_text(text: str, max_tokens: int, hints: Optional[Iterable[str]] = None) -> Tuple[str, dict]:
+    """
+    Return (excerpt, info). Text within budget is returned unchanged. Otherwise the first
+    section is kept for context and the most relevant remaining sections fill the budget,
+    in their original order, joined by an ellipsis line. Sections without any quote
+    term are dropped even if budget remains.
+    """
+    total = estimate_tokens(text or "")
+    if total <= max_tokens:
+        return text or "", {"tokens": total, "source_tokens": total, "sections": None, "compacted": False}
+    parts = sections(text)
+    terms = list(QUOTE_TERMS) + [h.lower() for h in hints or () if h and len(h) > 2]
+    cost = [estimate_tokens(p) + 1 for p in parts]
+    chosen = set()
+    used = estimate_tokens(GAP)
+    if parts and cost[0] <= max_tokens // 3:
+        chosen.add(0)
+        used += cost[0]
+    scores = [_relevance(p, terms) for p in parts]
+    for i in sorted(range(len(parts)), key=lambda i: scores[i], reverse=True):
+        if i in chosen or not scores[i]:
+            continue
+        if used + cost[i] + estimate_tokens(GAP) <= max_tokens:
+            chosen.add(i)
+            used += cost[i] + estimate_tokens(GAP)
+    if chosen <= {0}:  # every relevant section is over budget: add a prefix of the best one
+        best = max(range(len(parts)), key=lambda i: scores[i])
+        if best not in chosen:
+            room = max(max_tokens - used - estimate_tokens(GAP), 0)
+            parts[best] = parts[best][: room * 4]
+            chosen.add(best)
+    out, prev = [], -1
+    for i in sorted(chosen):
+        if out and i != prev + 1:
+            out.append(GAP.strip())
+        out.append(parts[i])
+        prev = i
+    excerpt = "\n".join(out)
+    return excerpt, {"tokens": estimate_tokens(excerpt), "source_tokens": total,
+                     "sections": f"{len(chosen)}/{len(parts)}", "compacted": True}
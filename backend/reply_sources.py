@@ -0,0 +1,333 @@
+# backend/reply_sources.py
+# Streaming supplier-reply sources. Each source yields one reply dict per (supplier, sku):
+#   {"id": str, "supplier": str, "sku_id": str, "components": {...}, "raw_reply": str}
+#
+# Sources read one file/message at a time, so memory stays bounded by the largest reply,
+# not the inbox. With a Cursor, yielded items are held as delivered and recorded as processed
+# only when the consumer acks them with commit() after handling them; later scans skip them
+# without re-parsing. A consumer that raises or stops early leaves its items unacked, so they
+# are delivered again (at-least-once, also on a crash).
+from __future__ import annotations
+import email, json, mailbox, os, re, sqlite3, threading, time
+from abc import ABC, abstractmethod
+from email import policy
+from email.message import Message
+from email.utils import parseaddr
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from . import config
+from . import event_log as log
+
+_SKU_RE = re.compile(r"\bSKU-[A-Za-z0-9_-]+\b")
+
+class Cursor:
+    """
+    Persistent set of processed reply ids per source (SQLite; one row per reply). mark()
+    records a delivered item in memory; commit() persists the marks, rollback() drops them.
+    """
+    def __init__(self, source: str, path: Optional[Path] = None):
+        self.source = source
+        self.path = Path(path or config.REPLY_CURSOR_DB)
+        self._pending: Dict[str, float] = {}  # delivered, not acked yet
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute(
+            "create table if not exists processed (source text not null, item text not null, ts real not null, primary key (source, item))"
+        )
+
+    def seen(self, item: str) -> bool:
+        """Processed, or delivered in this process and awaiting its ack."""
+        with self._lock:
+            if item in self._pending:
+                return True
+            return self._conn.execute(
+                "select 1 from processed where source=? and item=?", (self.source, item)
+            ).fetchone() is not None
+
+    def mark(self, item: str) -> None:
+        with self._lock:
+            self._pending[item] = time.time()
+
+    def commit(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if pending:
+                self._conn.executemany("insert or ignore into processed(source,item,ts) values (?,?,?)",
+                                       [(self.source, item, ts) for item, ts in pending.items()])
+
+    def rollback(self) -> None:
+        with self._lock:
+            self._pending = {}
+
+    def position(self) -> Tuple[int, float]:
+        """(items processed, latest mark), counting unacked marks: moves whenever new items are handled."""
+        with self._lock:
+            n, ts = self._conn.execute(
+                "select count(*), coalesce(max(ts), 0) from processed where source=?", (self.source,)
+            ).fetchone()
+            return n + len(self._pending), max([ts, *self._pending.values()])
+
+    def reset(self) -> None:
+        with self._lock:
+            self._pending = {}
+            self._conn.execute("delete from processed where source=?", (self.source,))
+
+class ReplySource(ABC):
+    """
+    Base class: subclasses yield (item_id, [replies]) from _scan(); iteration applies the cursor.
+    With a cursor, call commit() once the yielded replies have been handled.
+    """
+    name = "replies"
+
+    def __init__(self, cursor: Optional[Cursor] = None):
+        self.cursor = cursor
+
+    @abstractmethod
+    def _scan(self) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        ...
+
+    def _unseen(self, item: str) -> bool:
+        return self.cursor is None or not self.cursor.seen(item)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        n_items = n_replies = 0
+        with log.span("reply_source", source=self.name, cursor=self.cursor is not None) as sp:
+            try:
+                for item, replies in self._scan():
+                    n_items += 1
+                    for r in replies:
+                        n_replies += 1
+                        yield r
+                    if self.cursor is not None:
+                        self.cursor.mark(item)
+            except BaseException:
+                # The consumer failed or stopped early (GeneratorExit): nothing it was given is acked
+                if self.cursor is not None:
+                    self.cursor.rollback()
+                raise
+            finally:
+                sp.update("replies_read", items=n_items, replies=n_replies)
+
+    def commit(self) -> None:
+        """Ack every reply yielded so far: later scans (and other processes) skip them."""
+        if self.cursor is not None:
+            self.cursor.commit()
+
+    def watch(self, poll_s: Optional[float] = None, stop: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+        """Re-scan every poll_s seconds, yielding only new replies (requires a cursor; ack with commit())."""
+        if self.cursor is None:
+            raise ValueError("watch() needs a cursor to tell new replies from old ones")
+        poll_s = config.REPLY_POLL_S if poll_s is None else poll_s
+        while stop is None or not stop.is_set():
+            yield from self
+            if stop is not None:
+                stop.wait(poll_s)
+            else:
+                time.sleep(poll_s)
+
+class SimulatedSource(ReplySource):
+    """The demo file ({supplier: {sku_id: {components, raw_reply}}}), decoded one supplier at a time."""
+    name = "simulated"
+
+    def __init__(self, path: Optional[Path] = None, cursor: Optional[Cursor] = None):
+        super().__init__(cursor)
+        self.path = Path(path or config.DEMO_DIR / "simulated_replies.json")
+
+    def _scan(self):
+        if not self.path.exists():
+            return
+        for supplier, skus in _iter_json_object(self.path):
+            item = f"{self.path.name}:{supplier}"
+            if self._unseen(item):
+                yield item, _from_nested(item, {supplier: skus})
+
+class DirectorySource(ReplySource):
+    """
+    A drop directory of .eml and .json files (one reply file per message). Writers should
+    write to a temporary name and rename into place; other suffixes are ignored.
+    """
+    name = "directory"
+
+    def __init__(self, path: Optional[Path] = None, cursor: Optional[Cursor] = None):
+        super().__init__(cursor)
+        self.path = Path(path or config.REPLY_DIR)
+
+    def _scan(self):
+        if not self.path.is_dir():
+            return
+        with os.scandir(self.path) as it:
+            names = sorted(e.name for e in it if e.is_file() and e.name.endswith((".eml", ".json")))
+        for name in names:
+            if not self._unseen(name):
+                continue
+            p = self.path / name
+            try:
+                if name.endswith(".eml"):
+                    with open(p, "rb") as f:
+                        replies = _from_message(name, email.message_from_binary_file(f, policy=policy.default))
+                else:
+                    replies = _from_json_doc(name, json.loads(p.read_text(encoding="utf-8")))
+            except OSError as e:  # retried on the next scan
+                log.log_event("reply_source", "unreadable_reply", level="WARNING", file=name, error=str(e))
+                continue
+            except ValueError as e:  # malformed for good: mark it processed, don't re-parse every scan
+                log.log_event("reply_source", "malformed_reply", level="WARNING", file=name, error=str(e))
+                replies = []
+            yield name, replies
+
+class MaildirSource(ReplySource):
+    """Local stand-in for an IMAP inbox: a Maildir that a fetcher (fetchmail, offlineimap, ...) fills."""
+    name = "maildir"
+
+    def __init__(self, path: Optional[Path] = None, cursor: Optional[Cursor] = None):
+        super().__init__(cursor)
+        self.path = Path(path or config.REPLY_MAILDIR)
+
+    def _scan(self):
+        if not self.path.is_dir():
+            return
+        md = mailbox.Maildir(str(self.path), factory=None, create=False)
+        for key in sorted(md.iterkeys()):
+            if not self._unseen(key):
+                continue
+            try:
+                with md.get_file(key) as f:
+                    msg = email.message_from_binary_file(f, policy=policy.default)
+            except (OSError, KeyError) as e:  # message moved/deleted by the fetcher mid-scan
+                log.log_event("reply_source", "unreadable_reply", level="WARNING", key=key, error=str(e))
+                continue
+            yield key, _from_message(key, msg)
+
+SOURCES = {"simulated": SimulatedSource, "directory": DirectorySource, "maildir": MaildirSource}
+
+def open_source(kind: Optional[str] = None, use_cursor: bool = False, scope: Optional[str] = None) -> ReplySource:
+    """
+    The configured reply source (REPLY_SOURCE); with use_cursor, only unprocessed replies are
+    yielded. scope (e.g. a run id) gives the consumer its own cursor over the same source.
+    """
+    kind = (kind or config.REPLY_SOURCE).strip().lower()
+    if kind not in SOURCES:
+        raise ValueError(f"Unknown reply source: {kind!r} (expected one of {', '.join(SOURCES)})")
+    return SOURCES[kind](cursor=Cursor(f"{kind}:{scope}" if scope else kind) if use_cursor else None)
+
+def iter_replies(replies: Any) -> Iterator[Dict[str, Any]]:
+    """Normalize input for build_bid_payloads: a nested {supplier: {sku_id: payload}} dict or an iterable of replies."""
+    if isinstance(replies, dict):
+        return iter(_from_nested("inline", replies))
+    return iter(replies or ())
+
+# ---------- Parsing ----------
+
+def _reply(item: str, supplier: Any, sku_id: Any, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": f"{item}#{sku_id}",
+        "supplier": str(supplier),
+        "sku_id": str(sku_id),
+        "components": payload.get("components") or {},
+        "raw_reply": payload.get("raw_reply", ""),
+    }
+
+def _from_nested(item: str, doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [_reply(item, supplier, sku, payload or {})
+            for supplier, skus in doc.items() for sku, payload in (skus or {}).items()]
+
+def _from_json_doc(item: str, doc: Any) -> List[Dict[str, Any]]:
+    # A single reply, a list of replies, or the nested demo shape
+    if isinstance(doc, list):
+        return [r for d in doc for r in _from_json_doc(item, d)]
+    if isinstance(doc, dict) and "sku_id" in doc:
+        return [_reply(item, doc.get("supplier") or doc.get("supplier_name") or "unknown", doc["sku_id"], doc)]
+    if isinstance(doc, dict):
+        return _from_nested(item, doc)
+    return []
+
+def _from_message(item: str, msg: Message) -> List[Dict[str, Any]]:
+    """One reply per SKU referenced by an email (X-SKU-ID header, else SKU-... in subject, else body)."""
+    name, addr = parseaddr(str(msg.get("From", "")))
+    supplier = name or addr or "unknown"
+    body = _body_text(msg)
+    skus = [s.strip() for s in str(msg.get("X-SKU-ID", "")).split(",") if s.strip()]
+    skus = skus or _SKU_RE.findall(str(msg.get("Subject", ""))) or _SKU_RE.findall(body)
+    payload = {"components": {}, "raw_reply": body}
+    return [_reply(item, supplier, sku, payload) for sku in dict.fromkeys(skus)]
+
+def _body_text(msg: Message) -> str:
+    part = msg.get_body(preferencelist=("plain", "html")) if hasattr(msg, "get_body") else None
+    if part is None:
+        return ""
+    try:
+        text = part.get_content()
+    except (LookupError, ValueError):
+        text = (part.get_payload(decode=True) or b"").decode("utf-8", errors="ignore")
+    if part.get_content_type() == "text/html":
+        text = re.sub(r"<[^>]+>", " ", text)
+    return text.strip()
+
+def _iter_json_object(path: Path, chunk: int = 1 << 16) -> Iterator[Tuple[str, Any]]:
+    """Yield (key, value) pairs of a top-level JSON object without loading the whole file."""
+    dec = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def need(n: int = 1) -> bool:
+            nonlocal buf, pos, eof
+            while len(buf) - pos < n and not eof:
+                data = f.read(chunk)
+                eof = not data
+                buf = buf[pos:] + data
+                pos = 0
+            return len(buf) - pos >= n
+
+        def skip_ws() -> None:
+            nonlocal pos
+            while need() and buf[pos] in " \t\r\n,:":
+                pos += 1
+
+        skip_ws()
+        if not need() or buf[pos] != "{":
+            raise ValueError(f"{path}: expected a JSON object")
+        pos += 1
+        while True:
+            skip_ws()
+            if not need() or buf[pos] == "}":
+                return
+            key = value = None
+            for target in ("key", "value"):
+                while True:
+                    try:
+                        obj, end = dec.raw_decode(buf, pos)
+                        if end < len(buf) or eof:  # a number ending at the buffer edge may be cut short
+                            break
+                    except ValueError:
+                        if eof:
+                            raise
+                    need(len(buf) - pos + chunk)  # value spans the buffer edge: read more
+                if target == "key":
+                    key, pos = obj, end
+                    skip_ws()
+                else:
+                    value, pos = obj, end
+            yield key, value
+
+if __name__ == "__main__":
+    # Emit bids for replies not processed yet, one JSON line each:
+    #   python -m backend.reply_sources [directory|maildir|simulated] [--watch]
+    import sys
+    from dataclasses import asdict
+    from .agent_functions import iter_bid_payloads
+    from .agent import extract_reply_components
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    src = open_source(args[0] if args else None, use_cursor=True)
+    try:
+        while True:
+            # One scan per pass: extraction batches within a scan, then the window is flushed
+            for bid in iter_bid_payloads(extract_reply_components(src)):
+                print(json.dumps(asdict(bid), ensure_ascii=False), flush=True)
+            src.commit()  # every bid of the pass is out: ack its replies
+            if "--watch" not in sys.argv:
+                break
+            time.sleep(config.REPLY_POLL_S)
+    except KeyboardInterrupt:
+        pass
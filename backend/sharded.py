@@ -0,0 +1,204 @@
+# backend/sharded.py
+# Sharded execution of the sourcing pipeline over the work queue (work_queue.py).
+#
+#   map 1  "specs"     slices of the specs zip -> quote schemas -> categorized quotes
+#   reduce             group_by_category over all quotes + the supplier directory
+#   reduce             read the reply source once and split it by category
+#   map 2  "category"  one shard per category -> emails, send, its replies -> columnar bids (BidStore)
+#   reduce             merge the shards' bid stores -> derive_formula + score_bids
+#
+# The coordinator (run) queues the tasks and starts local worker processes; more workers can
+# join from other nodes that share the queue database:
+#   python -m backend.sharded worker --run-id <run_id> [--queue path/to/work_queue.db]
+# Re-running with the same run_id resumes: finished shards are not redone.
+from __future__ import annotations
+import argparse, os, subprocess, sys, threading, time, traceback, zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from . import config
+from . import event_log as log
+from .work_queue import WorkQueue, worker_name, QUEUED, CLAIMED, FAILED
+
+SPECS, CATEGORY = "specs", "category"
+
+# ---------- Coordinator ----------
+
+def run(specs_zip: str, workers: int, run_id: Optional[str] = None, queue_path: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Run the pipeline with `workers` local worker processes (0: only external workers).
+    Returns {"run_id", "quotes", "emails", "send_results", "bids", "formula", "scorecard"}.
+    """
+    from . import agent_functions as F, evaluator, supabase_client, reply_sources
+    from .bid_store import BidStore
+    run_id = run_id or log.RUN_ID or log.new_run()
+    q = WorkQueue(queue_path)
+    q.open_run(run_id)
+    procs = _start_workers(workers, run_id, q.path)
+    try:
+        with zipfile.ZipFile(specs_zip) as z:
+            n_specs = sum(1 for i in z.infolist() if not i.is_dir())
+        size = max(1, config.WORK_SHARD_SIZE)
+        with log.span("shard_specs", specs=n_specs, shard_size=size, workers=workers) as sp:
+            added = q.put(run_id, SPECS, ((f"{i:08d}", {"zip": str(Path(specs_zip).resolve()), "start": i, "stop": i + size})
+                                          for i in range(0, n_specs, size)))
+            sp.update("queued", shards=-(-n_specs // size), new=added)
+            _wait(q, run_id, SPECS, procs, sp)
+            quotes = [quote for _, shard in q.results(run_id, SPECS) for quote in shard]
+
+        # Reduce: one supplier lookup and grouping over every shard's quotes
+        categories = sorted({qt.get("category", "Uncategorized") for qt in quotes})
+        supplier_rows = supabase_client.get_suppliers_by_category(categories)
+        grouped = F.group_by_category(quotes, supplier_rows)
+
+        # One pass over the reply source; each category shard gets only its SKUs' replies
+        category_of = {qt["sku_id"]: cat for cat, bundle in grouped.items() for qt in bundle["quotes"]}
+        replies: Dict[str, List[Dict[str, Any]]] = {}
+        with log.span("partition_replies", categories=len(grouped)) as sp:
+            skipped = 0
+            for r in reply_sources.open_source():
+                cat = category_of.get(r["sku_id"])
+                if cat is None:
+                    skipped += 1
+                    continue
+                replies.setdefault(cat, []).append(r)
+            sp.update("partitioned", replies=sum(map(len, replies.values())), skipped_unknown_sku=skipped)
+
+        with log.span("shard_categories", categories=len(grouped), workers=workers) as sp:
+            q.put(run_id, CATEGORY, ((cat, {"category": cat, "bundle": bundle, "replies": replies.get(cat, [])})
+                                     for cat, bundle in sorted(grouped.items())))
+            _wait(q, run_id, CATEGORY, procs, sp)
+            emails, send_results, bids = [], [], BidStore(qt["sku_id"] for qt in quotes)
+            for _, res in q.results(run_id, CATEGORY):
+                emails += res["emails"]
+                send_results += res["send_results"]
+                bids.merge(BidStore.from_dict(res["bids"]))
+
+        # Reduce: the formula and the min/max normalization need every bid
+        formula = evaluator.derive_formula(quotes, bids)
+        with log.span("score_bids", bids=len(bids)):
+            scorecard = evaluator.score_bids(bids, formula)
+    finally:
+        q.close_run(run_id)
+        _stop_workers(procs)
+        q.close()
+    return {"run_id": run_id, "quotes": quotes, "emails": emails, "send_results": send_results,
+            "bids": bids, "formula": formula, "scorecard": scorecard}
+
+def _start_workers(n: int, run_id: str, queue_path: Path) -> List[subprocess.Popen]:
+    env = dict(os.environ)
+    env["RESULTS_DIR"] = str(config.RESULTS_DIR)
+    # Process-local budgets are split so n workers together stay within the configured totals
+    if config.LLM_REQUESTS_PER_MINUTE > 0:
+        env["LLM_REQUESTS_PER_MINUTE"] = str(max(1, config.LLM_REQUESTS_PER_MINUTE // max(n, 1)))
+    if config.PDF_WORKERS > 0:
+        env["PDF_WORKERS"] = str(max(1, config.PDF_WORKERS // max(n, 1)))
+    cmd = [sys.executable, "-m", "backend.sharded", "worker", "--run-id", run_id, "--queue", str(queue_path)]
+    return [subprocess.Popen(cmd, cwd=str(config.BASE_DIR), env=env) for _ in range(max(0, n))]
+
+def _stop_workers(procs: List[subprocess.Popen], timeout_s: float = 30.0) -> None:
+    deadline = time.time() + timeout_s
+    for p in procs:
+        try:
+            p.wait(max(0.1, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            p.terminate()
+
+def _wait(q: WorkQueue, run_id: str, kind: str, procs: List[subprocess.Popen], sp) -> None:
+    """Block until every task of this kind is done; raise if some failed or all local workers died."""
+    last = None
+    while True:
+        counts = q.counts(run_id, kind)
+        if counts != last:
+            sp.update("progress", level="DEBUG", **counts)
+            last = counts
+        if not counts.get(QUEUED) and not counts.get(CLAIMED):
+            break
+        if procs and all(p.poll() is not None for p in procs):
+            raise RuntimeError(f"All {len(procs)} local workers exited (codes {[p.returncode for p in procs]}) "
+                               f"with {kind} tasks outstanding: {counts}")
+        time.sleep(config.WORK_POLL_S)
+    if counts.get(FAILED):
+        errors = q.errors(run_id, kind)
+        sp.update("shards_failed", level="ERROR", failed=len(errors), first=errors[0])
+        raise RuntimeError(f"{len(errors)} {kind} shard(s) failed; first: {errors[0]['shard']}: {errors[0]['error']}")
+
+# ---------- Worker ----------
+
+def _do_specs(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    from . import agent, agent_functions as F
+    quotes = agent.create_quote_schemas(F.iter_specs_zip(payload["zip"], payload["start"], payload["stop"]))
+    return agent.categorize_items(quotes)
+
+def _do_category(payload: Dict[str, Any]) -> Dict[str, Any]:
+    from . import agent, agent_functions as F, email_client
+    from .bid_store import BidStore
+    bundle = payload["bundle"]
+    emails = agent.prepare_initial_emails({payload["category"]: bundle})
+    send_results = email_client.send_batch(emails)
+    # The coordinator already picked this category's replies out of the source
+    skus = [qt["sku_id"] for qt in bundle["quotes"]]
+    bids = BidStore.from_bids(F.iter_bid_payloads(agent.extract_reply_components(payload.get("replies") or [])), sku_ids=skus)
+    return {"emails": emails, "send_results": send_results, "bids": bids.to_dict()}
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {SPECS: _do_specs, CATEGORY: _do_category}
+
+def work(run_id: str, queue_path: Optional[Path] = None, worker: Optional[str] = None,
+         exit_when_idle: bool = False) -> int:
+    """Claim and run tasks of run_id until the coordinator closes the run. Returns tasks completed."""
+    log.new_run(run_id)
+    q = WorkQueue(queue_path)
+    worker = worker or worker_name()
+    done = 0
+    try:
+        while True:
+            task = q.claim(run_id, worker)
+            if task is None:
+                if q.run_state(run_id) != "open" or exit_when_idle:
+                    break
+                time.sleep(config.WORK_POLL_S)
+                continue
+            stop = threading.Event()
+            beat = threading.Thread(target=_heartbeat, args=(q, task, stop), daemon=True)
+            beat.start()
+            try:
+                with log.span("work_task", kind=task["kind"], shard=task["shard"], worker=worker, attempt=task["attempts"]):
+                    result = HANDLERS[task["kind"]](task["payload"])
+            except Exception as e:
+                q.fail(task, f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}")
+            else:
+                q.complete(task, result)
+                done += 1
+            finally:
+                stop.set()
+                beat.join()
+    finally:
+        q.close()
+        log.flush()
+    return done
+
+def _heartbeat(q: WorkQueue, task: Dict[str, Any], stop: threading.Event) -> None:
+    while not stop.wait(max(1.0, config.WORK_LEASE_S / 3)):
+        if not q.extend(task):
+            log.log_event("work_task", "lease_lost", level="WARNING", kind=task["kind"], shard=task["shard"])
+            return
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Sharded pipeline worker / coordinator")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    w = sub.add_parser("worker", help="process tasks of a run until it is closed")
+    w.add_argument("--run-id", required=True)
+    w.add_argument("--queue", default=None, help="work queue database (default WORK_QUEUE_DB)")
+    w.add_argument("--exit-when-idle", action="store_true")
+    c = sub.add_parser("run", help="coordinate a run (same as main.py --workers)")
+    c.add_argument("specs_zip")
+    c.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    c.add_argument("--run-id", default=None)
+    c.add_argument("--queue", default=None)
+    args = ap.parse_args()
+    if args.cmd == "worker":
+        work(args.run_id, Path(args.queue) if args.queue else None, exit_when_idle=args.exit_when_idle)
+    else:
+        config.ensure_dirs()
+        out = run(args.specs_zip, args.workers, log.new_run(args.run_id), Path(args.queue) if args.queue else None)
+        print(f"run {out['run_id']}: {len(out['quotes'])} quotes, {len(out['emails'])} emails, "
+              f"{len(out['scorecard'].scores)} scores")
@@ -1,17 +1,20 @@
 # supabase_client.py
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+import threading, time
 from . import config
-try:
-    from supabase import create_client, Client
-except Exception:
-    create_client = None
-    Client = None
-
 _client = None
+# source -> {category: (expires_at, rows)}
+_DIRECTORY: Dict[str, Dict[str, Tuple[float, List[Dict[str, Any]]]]] = {}
+_DIR_LOCK = threading.Lock()
+_SEED: Optional[Tuple[float, float, Dict[str, List[Dict[str, Any]]]]] = None  # (expires_at, mtime, by_category)
 
 def _ensure_client():
     global _client
-    if _client is None and config.SUPABASE_URL and config.SUPABASE_ANON_KEY and create_client:
+    if _client is None and config.SUPABASE_URL and config.SUPABASE_ANON_KEY:
+        try:
+            from supabase import create_client  # heavy SDK: only imported when credentials are set
+        except Exception:
+            return None
         _client = create_client(config.SUPABASE_URL, config.SUPABASE_ANON_KEY)
     return _client
 
@@ -19,15 +22,71 @@ def get_suppliers_by_category(categories: List[str]) -> List[Dict[str, Any]]:
     """
     Returns rows with keys: id, name, category, email.
     In DEMO_MODE or missing client, reads demo/suppliers_seed.csv
+    Lookups go through an in-process directory keyed by category (SUPPLIER_CACHE_TTL_S);
+    only expired/unknown categories are fetched, in one bulk query per chunk.
     """
     if config.DEMO_MODE or not _ensure_client():
-        return _read_suppliers_seed(categories)
-    data = []
-    for cat in categories:
-        res = _client.table("suppliers").select("id,name,category,email").eq("category", cat).execute()
-        rows = res.data or []
-        data.extend(rows)
-    return data
+        source, loader = "seed", _load_seed_categories
+        if not categories:
+            return [r for rows in _seed_index().values() for r in rows]
+    else:
+        source, loader = "supabase", _load_supabase_categories
+    cats = list(dict.fromkeys(categories))
+    now = time.time()
+    with _DIR_LOCK:
+        directory = _DIRECTORY.setdefault(source, {})
+        missing = [c for c in cats if c not in directory or directory[c][0] <= now]
+    if missing:
+        fetched = loader(missing)
+        expires = time.time() + config.SUPPLIER_CACHE_TTL_S
+        with _DIR_LOCK:
+            for c in missing:
+                directory[c] = (expires, fetched.get(c, []))
+    with _DIR_LOCK:
+        return [row for c in cats for row in directory[c][1]]
+
+def invalidate_supplier_cache(category: Optional[str] = None) -> None:
+    """Drop cached directory entries (all, or one category) so the next lookup refetches."""
+    global _SEED
+    with _DIR_LOCK:
+        for directory in _DIRECTORY.values():
+            if category is None:
+                directory.clear()
+            else:
+                directory.pop(category, None)
+        if category is None:
+            _SEED = None
+
+def _load_supabase_categories(categories: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    by_cat: Dict[str, List[Dict[str, Any]]] = {}
+    size = max(1, config.SUPPLIER_QUERY_CHUNK)
+    for i in range(0, len(categories), size):
+        chunk = categories[i:i + size]
+        res = _client.table("suppliers").select("id,name,category,email").in_("category", chunk).execute()
+        for row in res.data or []:
+            by_cat.setdefault(row.get("category"), []).append(row)
+    return by_cat
+
+def _load_seed_categories(categories: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    index = _seed_index()
+    return {c: index.get(c, []) for c in categories}
+
+def _seed_index() -> Dict[str, List[Dict[str, Any]]]:
+    """demo/suppliers_seed.csv parsed once into {category: rows}; re-read on TTL expiry or file change."""
+    global _SEED
+    path = config.DEMO_DIR / "suppliers_seed.csv"
+    mtime = path.stat().st_mtime if path.exists() else 0.0
+    seed = _SEED
+    if seed is not None and seed[0] > time.time() and seed[1] == mtime:
+        return seed[2]
+    by_cat: Dict[str, List[Dict[str, Any]]] = {}
+    for row in _read_suppliers_seed([]):
+        by_cat.setdefault(row["category"], []).append(row)
+    _SEED = (time.time() + config.SUPPLIER_CACHE_TTL_S, mtime, by_cat)
+    if seed is not None and seed[1] != mtime:
+        with _DIR_LOCK:
+            _DIRECTORY.get("seed", {}).clear()
+    return by_cat
 
 def _read_suppliers_seed(categories: List[str]) -> List[Dict[str, Any]]:
     import csv, os
@@ -0,0 +1,185 @@
+# backend/work_queue.py
+# Durable work queue (SQLite) for sharded runs: the broker stand-in between the coordinator and
+# worker processes, on this machine or on other nodes that share the database file.
+#
+# A task is (run_id, kind, shard) with a JSON payload. Workers claim tasks under a lease and
+# extend it while working; a task whose lease ran out (its worker died) is handed out again,
+# up to WORK_MAX_ATTEMPTS. Results are stored with the task, so a run can be resumed.
+from __future__ import annotations
+import json, os, socket, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from . import config
+
+QUEUED, CLAIMED, DONE, FAILED = "queued", "claimed", "done", "failed"
+
+_SCHEMA = """
+create table if not exists tasks (
+  run_id text not null,
+  kind text not null,
+  shard text not null,
+  payload text not null,
+  state text not null default 'queued',
+  worker text,
+  attempts integer not null default 0,
+  lease_until real not null default 0,
+  result text,
+  error text,
+  created_at real not null,
+  updated_at real not null,
+  primary key (run_id, kind, shard)
+);
+create index if not exists tasks_state on tasks(run_id, state, lease_until);
+create table if not exists runs (
+  run_id text primary key,
+  state text not null,
+  updated_at real not null
+);
+"""
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class WorkQueue:
+    """One connection per instance; safe to share between threads of a process."""
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or config.WORK_QUEUE_DB)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # timeout: other processes hold the write lock briefly while claiming
+        self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---------- Runs ----------
+
+    def open_run(self, run_id: str) -> None:
+        with self._lock:
+            self._conn.execute("insert or replace into runs(run_id, state, updated_at) values (?, 'open', ?)", (run_id, time.time()))
+
+    def close_run(self, run_id: str) -> None:
+        """Workers waiting on this run exit once they see it closed."""
+        with self._lock:
+            self._conn.execute("update runs set state='closed', updated_at=? where run_id=?", (time.time(), run_id))
+
+    def run_state(self, run_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("select state from runs where run_id=?", (run_id,)).fetchone()
+        return row["state"] if row else None
+
+    # ---------- Tasks ----------
+
+    def put(self, run_id: str, kind: str, tasks: Iterable[Tuple[str, Any]]) -> int:
+        """
+        Queue (shard, payload) tasks. Shards already known for this run/kind keep their state,
+        so a resumed run skips finished ones; failed ones get a fresh set of attempts.
+        """
+        now = time.time()
+        rows = [(run_id, kind, shard, json.dumps(payload, ensure_ascii=False), now, now) for shard, payload in tasks]
+        with self._lock:
+            c = self._conn
+            c.execute("begin immediate")
+            before = c.total_changes
+            c.executemany("insert or ignore into tasks(run_id,kind,shard,payload,created_at,updated_at) values (?,?,?,?,?,?)", rows)
+            added = c.total_changes - before
+            c.execute("update tasks set state=?, attempts=0, updated_at=? where run_id=? and kind=? and state=?",
+                      (QUEUED, now, run_id, kind, FAILED))
+            c.execute("commit")
+        return added
+
+    def claim(self, run_id: str, worker: str, lease_s: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Claim the oldest runnable task: queued, or claimed with an expired lease (its worker is
+        gone) and attempts left. Tasks out of attempts are marked failed. None when nothing is runnable.
+        """
+        lease_s = config.WORK_LEASE_S if lease_s is None else lease_s
+        now = time.time()
+        with self._lock:
+            c = self._conn
+            c.execute("begin immediate")
+            try:
+                c.execute(
+                    "update tasks set state=?, error=coalesce(error, 'lease expired'), updated_at=? "
+                    "where run_id=? and state=? and lease_until<? and attempts>=?",
+                    (FAILED, now, run_id, CLAIMED, now, config.WORK_MAX_ATTEMPTS),
+                )
+                row = c.execute(
+                    "select * from tasks where run_id=? and (state=? or (state=? and lease_until<?)) "
+                    "order by created_at, kind, shard limit 1",
+                    (run_id, QUEUED, CLAIMED, now),
+                ).fetchone()
+                if row is not None:
+                    c.execute(
+                        "update tasks set state=?, worker=?, attempts=attempts+1, lease_until=?, updated_at=? "
+                        "where run_id=? and kind=? and shard=?",
+                        (CLAIMED, worker, now + lease_s, now, run_id, row["kind"], row["shard"]),
+                    )
+            finally:
+                c.execute("commit")
+        if row is None:
+            return None
+        task = dict(row)
+        task["payload"] = json.loads(task["payload"])
+        task.update(worker=worker, state=CLAIMED, attempts=row["attempts"] + 1, lease_until=now + lease_s)
+        return task
+
+    def extend(self, task: Dict[str, Any], lease_s: Optional[float] = None) -> bool:
+        """Heartbeat: push the lease out. False if the task was taken over by another worker."""
+        lease_s = config.WORK_LEASE_S if lease_s is None else lease_s
+        with self._lock:
+            cur = self._conn.execute(
+                "update tasks set lease_until=?, updated_at=? where run_id=? and kind=? and shard=? and state=? and worker=?",
+                (time.time() + lease_s, time.time(), task["run_id"], task["kind"], task["shard"], CLAIMED, task["worker"]),
+            )
+        return cur.rowcount == 1
+
+    def complete(self, task: Dict[str, Any], result: Any) -> None:
+        self._finish(task, DONE, result=json.dumps(result, ensure_ascii=False, default=str))
+
+    def fail(self, task: Dict[str, Any], error: str) -> None:
+        """Requeue while attempts are left, else mark failed."""
+        state = FAILED if task["attempts"] >= config.WORK_MAX_ATTEMPTS else QUEUED
+        self._finish(task, state, error=error[:2000])
+
+    def _finish(self, task: Dict[str, Any], state: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "update tasks set state=?, result=?, error=?, lease_until=0, updated_at=? "
+                "where run_id=? and kind=? and shard=? and worker=?",
+                (state, result, error, time.time(), task["run_id"], task["kind"], task["shard"], task["worker"]),
+            )
+
+    def counts(self, run_id: str, kind: Optional[str] = None) -> Dict[str, int]:
+        sql, args = "select state, count(*) from tasks where run_id=?", [run_id]
+        if kind is not None:
+            sql, args = sql + " and kind=?", args + [kind]
+        with self._lock:
+            return dict(self._conn.execute(sql + " group by state", args).fetchall())
+
+    def errors(self, run_id: str, kind: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "select shard, attempts, error from tasks where run_id=? and kind=? and state=? order by shard",
+                (run_id, kind, FAILED),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def results(self, run_id: str, kind: str, page: int = 200) -> Iterator[Tuple[str, Any]]:
+        """(shard, result) of finished tasks in shard order, decoded a page at a time."""
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "select shard, result from tasks where run_id=? and kind=? and state=? and shard>? order by shard limit ?",
+                    (run_id, kind, DONE, last, page),
+                ).fetchall()
+            if not rows:
+                return
+            for r in rows:
+                yield r["shard"], json.loads(r["result"]) if r["result"] is not None else None
+            last = rows[-1]["shard"]
@@ -2,46 +2,61 @@
 """
 Orchestrates the end-to-end demo flow.
 """
-import json, sys
-from pathlib import Path
-from backend import config, agent_functions as F, agent, evaluator, supabase_client, email_client
-from backend import event_log
+import json
+from dataclasses import asdict
+from backend import config, agent_functions as F, supabase_client
+from backend import event_log, checkpoint, pipeline, llm_metrics, reply_sources
 
-def run_demo(specs_zip: str = None):
-    run_id = event_log.new_run()
-    print(f"Agent run_id: {run_id} | Log: {event_log.LOG_PATH}")    
+def run_demo(specs_zip: str = None, run_id: str = None, workers: int = 0):
+    """
+    Pass the run_id of an earlier run to resume it: stages whose inputs are unchanged
+    are loaded from results/checkpoints/<run_id>/ instead of being recomputed.
+    workers > 0 runs sharded over that many worker processes (see backend/sharded.py);
+    resuming then skips the shards that already finished.
+    """
+    config.ensure_dirs()
+    run_id = event_log.new_run(run_id)
+    print(f"Agent run_id: {run_id} | Log: {event_log.run_log_dir(run_id)}")
     # 1) Load specs
     if not specs_zip:
         specs_zip = str(config.DEMO_DIR / "sample_specs.zip")
-    specs = F.parse_specs_zip(specs_zip)
+
+    if workers > 0:
+        from backend import sharded
+        out = sharded.run(specs_zip, workers, run_id)
+        _summarize(run_id, out["emails"], out["scorecard"])
+        return
+    ck = checkpoint.Checkpointer(run_id)
 
     # 2) Generate quote schemas
-    quote_schemas = agent.create_quote_schemas(specs)
+    quote_schemas = pipeline.generate_schemas(ck, specs_zip)
 
     # 3) Categorize
-    quote_schemas = agent.categorize_items(quote_schemas)
+    quote_schemas = pipeline.categorize(ck, quote_schemas)
 
     # 4) Fetch suppliers & prepare emails
     categories = sorted({q.get("category","Uncategorized") for q in quote_schemas})
     supplier_rows = supabase_client.get_suppliers_by_category(categories)
     grouped = F.group_by_category(quote_schemas, supplier_rows)
-    emails = agent.prepare_initial_emails(grouped)
+    emails = pipeline.compose_emails(ck, grouped, supplier_rows)
 
     # 5) Send emails
-    send_results = email_client.send_batch(emails)
-
-    # 6) Collect replies (demo) -> build bids
-    raw_replies = email_client.collect_replies()
-    bids = F.build_bid_payloads(raw_replies)
+    send_results = pipeline.send_emails(ck, emails)
 
-    # 7) Enrich schemas with supplier bids
-    enriched = agent.enrich_with_supplier_bids(quote_schemas, [b.__dict__ for b in bids])
+    # 6) Stream replies not packed yet in this run (REPLY_SOURCE) -> extracted terms ->
+    # 7) bids on known SKUs in the columnar store (no per-bid objects kept)
+    replies = reply_sources.open_source(use_cursor=True, scope=run_id)
+    bids = pipeline.build_bids(ck, quote_schemas, replies)
 
     # 8) Derive formula & score
-    formula = evaluator.derive_formula(enriched)
-    scorecard = evaluator.score_bids(enriched, formula)
+    formula = pipeline.derive_formula(ck, quote_schemas, bids)
+    scorecard = pipeline.score(ck, bids, formula)
 
     # 9) Save & print summary
+    _summarize(run_id, emails, scorecard)
+
+def _summarize(run_id: str, emails, scorecard):
+    formula = scorecard.formula
     out_path = config.RESULTS_DIR / "scorecard.json"
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump({
@@ -51,7 +66,7 @@ def run_demo(specs_zip: str = None):
                 "min_values": formula.min_values,
                 "max_values": formula.max_values,
             },
-            "scores": [s.__dict__ for s in scorecard.scores],
+            "scores": [asdict(s) for s in scorecard.scores],
             "session_id": scorecard.session_id
         }, f, ensure_ascii=False, indent=2)
 
@@ -68,6 +83,16 @@ def run_demo(specs_zip: str = None):
         top = arr[0]
         print(f"SKU {sku}: winner -> {top.supplier_name} (score={top.total_score})")
 
+    # LLM latency / tokens / cost per stage for this run
+    report = llm_metrics.write_report(run_id)
+    print(f"\n=== LLM CALLS (report: {report['path']}) ===")
+    print(llm_metrics.format_report(report))
+
 if __name__ == "__main__":
-    specs_zip = sys.argv[1] if len(sys.argv) > 1 else None
-    run_demo(specs_zip)
+    import argparse
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("specs_zip", nargs="?", default=None)
+    ap.add_argument("--run-id", default=None, help="resume this run from its checkpoints")
+    ap.add_argument("--workers", type=int, default=0, help="shard the run across this many worker processes")
+    args = ap.parse_args()
+    run_demo(args.specs_zip, run_id=args.run_id, workers=args.workers)
@@ -1,18 +1,12 @@
 import streamlit as st
 import pandas as pd
 import json, io, zipfile, time
+from dataclasses import asdict
 from pathlib import Path
 
-# Backend imports
-from backend import (
-    config,
-    agent_functions as F,
-    agent,
-    evaluator,
-    supabase_client,
-    email_client,
-    event_log,
-)
+# Backend imports. Only the light modules load on every rerun; the pipeline stack (LLM,
+# NumPy scoring, email/supplier clients) is imported by the step that first needs it.
+from backend import config, event_log, log_store, checkpoint, llm_metrics
 
 # ---------- Helpers ----------
 def _save_upload(file) -> Path:
@@ -73,14 +67,24 @@ def _email_chain_card(supplier_name, emails_for_supplier, replies_for_supplier):
             st.write(f"**Subject:** {em['subject']}")
             st.code(em["body"])
     if replies_for_supplier:
-        for sku_id, payload in replies_for_supplier.items():
-            with st.expander(f"Supplier → Agent (reply for {sku_id})", expanded=True):
-                st.code(payload.get("raw_reply", "(no text)"))
-                st.json(payload.get("components", {}))
+        for r in replies_for_supplier:
+            with st.expander(f"Supplier → Agent (reply for {r['sku_id']})", expanded=True):
+                st.code(r.get("raw_reply") or "(no text)")
+                st.json(r.get("components", {}))
     else:
         st.info("No reply available (demo shows from simulated_replies.json).")
 
-def _score_card(scorecard):
+def _reply_preview(suppliers, per_supplier=20):
+    """Replies to show per emailed supplier, streamed once from the reply source and capped per supplier."""
+    from backend import reply_sources
+    out = {s: [] for s in suppliers}
+    for r in reply_sources.open_source():
+        shown = out.get(r["supplier"])
+        if shown is not None and len(shown) < per_supplier:
+            shown.append(r)
+    return out
+
+def _score_card(scorecard, bids=None):
     # Show formula
     st.subheader("Weighted scoring formula")
     st.json({
@@ -108,20 +112,22 @@ def _score_card(scorecard):
     } for r in rows])
     st.markdown(f"**SKU {sku} — ranking**")
     st.dataframe(df, use_container_width=True)
-
-def _load_log_df():
-    p = event_log.LOG_PATH
-    if not p.exists():
-        return pd.DataFrame(), pd.DataFrame()
-    rows = []
-    with p.open("r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                rows.append(json.loads(line))
-            except Exception:
-                pass
+    if bids is not None:
+        # Quoted values straight from the bid store's columns
+        st.markdown(f"**SKU {sku} — bids**")
+        st.dataframe(pd.DataFrame(bids.rows_for(sku)), use_container_width=True)
+
+@st.cache_data(show_spinner=False, max_entries=20)
+def _llm_report(run_id, llm_events):
+    """Per-stage LLM report; llm_events (the index's count) keys the cache, so reruns reuse it until new calls land."""
+    return llm_metrics.run_report(run_id)
+
+def _load_log_page(run_id, steps=None, levels=None, page=0, page_size=500):
+    """Load one page of a run's events via the sidecar index (cost independent of log history)."""
+    event_log.flush()
+    rows, total = log_store.query(run_id, steps=steps, levels=levels, offset=page * page_size, limit=page_size)
     if not rows:
-        return pd.DataFrame(), pd.DataFrame()
+        return pd.DataFrame(), pd.DataFrame(), total
 
     # Raw keeps a 'payload' column for display/search
     raw = pd.DataFrame(rows)
@@ -130,11 +136,29 @@ def _load_log_df():
     # Flat expands payload.* into columns for filtering
     flat = pd.json_normalize(rows, sep=".")
     flat["time"] = pd.to_datetime(flat["ts"], unit="s")
-
-    # Sort both chronologically
-    raw = raw.sort_values("time")
-    flat = flat.sort_values("time")
-    return raw, flat
+    return raw, flat, total
+
+def _restore_session(ck):
+    """Rebuild session state from the run's stored stage outputs (no LLM calls)."""
+    from backend import agent_functions as F, supabase_client, pipeline
+    from backend.models import formula_from_json, scorecard_from_json
+    ss = st.session_state
+    ss["zip_path"] = ck.peek("specs_zip")
+    if ss["zip_path"] is not None:
+        ss["demo"] = Path(ss["zip_path"]) == config.DEMO_DIR / "sample_specs.zip"
+    ss["quotes_initial"] = ck.peek("quote_schemas")
+    ss["quotes_categorized"] = ck.peek("categorized")
+    if ss["quotes_categorized"]:
+        ss["categories"] = sorted({q.get("category","Uncategorized") for q in ss["quotes_categorized"]})
+        ss["supplier_rows"] = supabase_client.get_suppliers_by_category(ss["categories"])
+        ss["grouped"] = F.group_by_category(ss["quotes_categorized"], ss["supplier_rows"])
+    ss["emails"] = ck.peek("emails")
+    ss["send_results"] = ck.peek("send_results")
+    if ss["send_results"] is not None and ss["emails"]:
+        ss["reply_preview"] = _reply_preview({e["to_name"] for e in ss["emails"]})
+    ss["bids"] = pipeline.load_bids(ck)
+    ss["formula"] = ck.peek("formula", load=formula_from_json)
+    ss["scorecard"] = ck.peek("scorecard", load=scorecard_from_json)
 
 # ---------- UI ----------
 st.set_page_config("Vendor Negotiation Agent", layout="wide")
@@ -144,21 +168,26 @@ st.title("Vendor Negotiation Agent — Streamlit Demo")
 ss = st.session_state
 for k in [
     "run_id","zip_path","demo","specs","quotes_initial","quotes_categorized",
-    "categories","supplier_rows","grouped","emails","send_results","raw_replies",
-    "bids","enriched","formula","scorecard"
+    "categories","supplier_rows","grouped","emails","send_results","reply_preview",
+    "bids","formula","scorecard","ck","scorer"
 ]:
     ss.setdefault(k, None)
 
-# Start run
+# Start run. The run_id lives in the URL, so a browser refresh resumes from its checkpoints.
 if ss["run_id"] is None:
-    ss["run_id"] = event_log.new_run()
-st.caption(f"Run ID: `{ss['run_id']}`  •  Log: `{event_log.LOG_PATH}`")
+    config.ensure_dirs()
+    ss["run_id"] = event_log.new_run(st.query_params.get("run"))
+    st.query_params["run"] = ss["run_id"]
+    ss["ck"] = checkpoint.Checkpointer(ss["run_id"])
+    _restore_session(ss["ck"])
+ck = ss["ck"]
+st.caption(f"Run ID: `{ss['run_id']}`  •  Log: `{event_log.run_log_dir(ss['run_id'])}`")
 
 # ---------- Step 1: Upload or Demo ----------
 st.header("1) Upload Zip folder of SKU/Service details")
 col1, col2 = st.columns([2,1])
 with col1:
-    ss["demo"] = st.toggle("Use Demo Zip", value=True, help="If on, loads demo/sample_specs.zip")
+    ss["demo"] = st.toggle("Use Demo Zip", value=ss["demo"] is not False, help="If on, loads demo/sample_specs.zip")
 with col2:
     uploaded = st.file_uploader("Or upload your own .zip", type=["zip"], label_visibility="collapsed")
 
@@ -177,6 +206,8 @@ else:
                 names = sorted(z.namelist())
             st.write(f"Found **{len(names)}** files")
             st.write(names[:20] + (["…"] if len(names)>20 else []))
+    elif ss["zip_path"]:
+        st.success(f"Using {Path(ss['zip_path']).name} from this run")
     else:
         st.info("Upload a .zip or toggle Demo Zip to continue.")
 
@@ -186,9 +217,9 @@ st.divider()
 st.header("2) Ingest SKU/Service details")
 if st.button("Ingest & Generate Quote Schemas", use_container_width=True, type="primary", disabled=not ss["zip_path"]):
     event_log.log_event("ui", "ingest_clicked", zip=str(ss["zip_path"]))
-    ss["specs"] = F.parse_specs_zip(str(ss["zip_path"]))
-    ss["quotes_initial"] = agent.create_quote_schemas(ss["specs"])
-    st.success(f"Ingested {len(ss['specs'])} items and generated quote schemas.")
+    from backend import pipeline
+    ss["quotes_initial"] = pipeline.generate_schemas(ck, str(ss["zip_path"]))
+    st.success(f"Ingested {len(ss['quotes_initial'])} items and generated quote schemas.")
 
 if ss["quotes_initial"]:
     st.subheader("Generated quote schema — carousel per SKU")
@@ -200,7 +231,8 @@ st.divider()
 st.header("3) Find applicable suppliers from database")
 if st.button("Categorize SKUs & Lookup Suppliers", use_container_width=True, disabled=not ss.get("quotes_initial")):
     event_log.log_event("ui", "categorize_clicked")
-    ss["quotes_categorized"] = agent.categorize_items(ss["quotes_initial"])
+    from backend import pipeline, supabase_client, agent_functions as F
+    ss["quotes_categorized"] = pipeline.categorize(ck, ss["quotes_initial"])
     ss["categories"] = sorted({q.get("category","Uncategorized") for q in ss["quotes_categorized"]})
     ss["supplier_rows"] = supabase_client.get_suppliers_by_category(ss["categories"])
     ss["grouped"] = F.group_by_category(ss["quotes_categorized"], ss["supplier_rows"])
@@ -214,6 +246,11 @@ if ss.get("quotes_categorized") and ss.get("grouped"):
         ss["quotes_categorized"],
         lambda q,i,n: _supplier_table_for_sku(q, ss["grouped"])
     )
+    if st.button("Confirm categories as classifier examples", help="Reviewed categories train the local classifier"):
+        from backend import classifier
+        added = classifier.confirm_quotes(ss["quotes_categorized"])
+        event_log.log_event("ui", "categories_confirmed", added=added)
+        st.success(f"Added {added} confirmed example(s).")
 
 st.divider()
 
@@ -221,7 +258,8 @@ st.divider()
 st.header("4) Draft initial RFP email to applicable suppliers")
 if st.button("Draft Emails", use_container_width=True, disabled=not ss.get("grouped")):
     event_log.log_event("ui", "draft_emails_clicked")
-    ss["emails"] = agent.prepare_initial_emails(ss["grouped"])
+    from backend import pipeline
+    ss["emails"] = pipeline.compose_emails(ck, ss["grouped"], ss["supplier_rows"])
     st.success(f"Drafted {len(ss['emails'])} emails.")
 
 if ss.get("emails"):
@@ -234,18 +272,19 @@ st.divider()
 st.header("5) Send Initial RFP Email")
 if st.button("Send Emails", use_container_width=True, disabled=not ss.get("emails")):
     event_log.log_event("ui", "send_emails_clicked")
-    ss["send_results"] = email_client.send_batch(ss["emails"])
-    ss["raw_replies"] = email_client.collect_replies()
+    from backend import pipeline
+    ss["send_results"] = pipeline.send_emails(ck, ss["emails"])
+    ss["reply_preview"] = _reply_preview({e["to_name"] for e in ss["emails"]})
     st.success("Emails dispatched (demo: saved to results/outbox). Loaded simulated replies.")
 
-if ss.get("emails") and ss.get("raw_replies") is not None:
+if ss.get("emails") and ss.get("reply_preview") is not None:
     st.subheader("Supplier email chain (per supplier)")
     # group outbox emails by supplier name (to_name) for display
     emails_by_supp = {}
     for e in ss["emails"]:
         emails_by_supp.setdefault(e["to_name"], []).append(e)
     for supplier_name in sorted(emails_by_supp.keys()):
-        replies_for_supplier = ss["raw_replies"].get(supplier_name, {})
+        replies_for_supplier = ss["reply_preview"].get(supplier_name, [])
         _email_chain_card(supplier_name, emails_by_supp[supplier_name], replies_for_supplier)
 
 st.divider()
@@ -254,34 +293,66 @@ st.divider()
 st.header("6) Generate weighted scoring formula & final ranking")
 if st.button("Score Bids & Rank Vendors", use_container_width=True, disabled=not ss.get("quotes_categorized")):
     event_log.log_event("ui", "score_clicked")
-    # Enrich schemas with supplier replies (demo)
-    bids = F.build_bid_payloads(ss.get("raw_replies") or {})
-    ss["enriched"] = agent.enrich_with_supplier_bids(ss["quotes_categorized"], [b.__dict__ for b in bids])
-    ss["formula"] = evaluator.derive_formula(ss["enriched"])
-    ss["scorecard"] = evaluator.score_bids(ss["enriched"], ss["formula"])
+    from backend import pipeline, reply_sources
+    # Stream the replies not packed yet in this run into the columnar bid store
+    replies = reply_sources.open_source(use_cursor=True, scope=ss["run_id"])
+    ss["bids"] = pipeline.build_bids(ck, ss["quotes_categorized"], replies)
+    ss["formula"] = pipeline.derive_formula(ck, ss["quotes_categorized"], ss["bids"])
+    ss["scorecard"] = pipeline.score(ck, ss["bids"], ss["formula"])
+    ss["scorer"] = None
     st.success("Computed scores and rankings.")
 
 if ss.get("scorecard"):
-    _score_card(ss["scorecard"])
+    with st.expander("Apply late supplier replies", expanded=False):
+        late = st.text_area("Replies JSON ({supplier: {sku_id: {components, raw_reply}}})", value="", height=120)
+        if st.button("Update ranking", disabled=not late.strip() or ss.get("bids") is None):
+            try:
+                replies = json.loads(late)
+            except ValueError as e:
+                st.error(f"Invalid JSON: {e}")
+            else:
+                from backend import agent, agent_functions as F, incremental
+                if ss.get("scorer") is None:
+                    ss["scorer"] = incremental.IncrementalScorer.from_store(ss["bids"], ss["formula"])
+                diff = ss["scorer"].apply([asdict(b) for b in F.iter_bid_payloads(agent.extract_reply_components(replies))])
+                ss["scorecard"] = ss["scorer"].scorecard()
+                ss["bids"] = ss["scorer"].store  # late bids were added to it, so the bids table follows
+                event_log.log_event("ui", "late_replies_applied", changed_skus=len(diff))
+                st.success(f"Ranking changed for {len(diff)} SKU(s).")
+                if diff:
+                    st.json(diff)
+    _score_card(ss["scorecard"], ss.get("bids"))
 
 st.divider()
 
 # ---------- Log viewer ----------
 with st.expander("View Agent Log (JSONL)", expanded=False):
-    raw_df, flat_df = _load_log_df()
-    if raw_df.empty:
+    event_log.flush()
+    runs = [r["run_id"] for r in log_store.list_runs(limit=50)]
+    if ss["run_id"] not in runs:
+        runs.insert(0, ss["run_id"])
+    sel_run = st.selectbox("Run", runs, index=runs.index(ss["run_id"]))
+    summary = log_store.run_summary(sel_run)
+    if not summary["events"]:
         st.info("No log entries yet.")
     else:
         st.caption("Tip: toggle between a simple view (with raw payload) and a flattened view (payload.* columns).")
         view_mode = st.radio("View", ["Simple", "Flattened"], horizontal=True)
-
-        base_df = raw_df if view_mode == "Simple" else flat_df
-        steps = sorted(base_df["step"].dropna().unique().tolist())
-        sel_steps = st.multiselect("Filter steps", steps, default=[])
-
-        view = base_df if not sel_steps else base_df[base_df["step"].isin(sel_steps)]
-
-        if view_mode == "Simple":
+        c1, c2, c3 = st.columns([3, 2, 1])
+        with c1:
+            sel_steps = st.multiselect("Filter steps", sorted(summary["steps"].keys()), default=[])
+        with c2:
+            sel_levels = st.multiselect("Filter levels", sorted(summary["levels"].keys()), default=[])
+        with c3:
+            page = st.number_input("Page", min_value=1, value=1, step=1) - 1
+        page_size = 500
+        raw_df, flat_df, total = _load_log_page(sel_run, sel_steps or None, sel_levels or None, page, page_size)
+        st.caption(f"{total} matching events  •  page {page + 1}/{max(1, -(-total // page_size))}")
+
+        view = raw_df if view_mode == "Simple" else flat_df
+        if view.empty:
+            st.info("No events match the filters.")
+        elif view_mode == "Simple":
             # Show raw payload as a compact JSON string column
             v = view.copy()
             v["payload_str"] = v.get("payload", {}).apply(lambda x: json.dumps(x, ensure_ascii=False) if isinstance(x, dict) else str(x))
@@ -296,3 +367,11 @@ with st.expander("View Agent Log (JSONL)", expanded=False):
             extras = [c for c in view.columns if c.startswith("payload.")][:8]
             cols = cols + extras
             st.dataframe(view[cols], width="stretch", height=380)
+
+        if llm_metrics.STEP in summary["steps"]:
+            st.subheader("LLM calls per stage")
+            report = _llm_report(sel_run, summary["steps"][llm_metrics.STEP])
+            rows = [{"stage": name, **{k: v for k, v in b.items() if k not in ("parse", "latency_ms")},
+                     "p50_ms": b["latency_ms"]["p50"], "p95_ms": b["latency_ms"]["p95"]}
+                    for name, b in sorted(report["stages"].items()) + [("TOTAL", report["total"])]]
+            st.dataframe(pd.DataFrame(rows), width="stretch")
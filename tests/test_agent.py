@@ -0,0 +1,108 @@
+import json
+import threading
+
+from backend import agent, config, llm
+
+
+def _fake_llm(monkeypatch, answer):
+    """Replace generate_json; answer(system_prompt, user) -> response dict. Returns the recorded calls."""
+    calls = []
+    lock = threading.Lock()
+
+    def generate_json(system_prompt, user_prompt, images=None):
+        user = json.loads(user_prompt)
+        with lock:
+            calls.append((system_prompt, user))
+        return answer(system_prompt, user)
+
+    monkeypatch.setattr(llm, "generate_json", generate_json)
+    return calls
+
+
+def _grouped():
+    skus = [{"sku_id": "SKU-001", "title": "6204 bearing"}, {"sku_id": "SKU-002", "title": "6205 bearing"}]
+    suppliers = [{"id": f"sup-{i}", "name": f"Supplier {i}", "email": f"s{i}@example.com"} for i in range(4)]
+    return {"Bearings": {"quotes": skus, "suppliers": suppliers},
+            "Fasteners": {"quotes": [{"sku_id": "SKU-003", "title": "M8 bolt"}], "suppliers": suppliers[:2]}}
+
+
+def test_template_mode_makes_one_call_per_category_and_renders_each_supplier(monkeypatch):
+    monkeypatch.setattr(config, "EMAIL_COMPOSE_MODE", "template")
+    monkeypatch.setattr(config, "EMAIL_PERSONALIZE_SUPPLIERS", {"sup-2"})
+    tmpl_sys = config.get_prompt("INITIAL_EMAIL_TEMPLATE_SYS")
+
+    def answer(system_prompt, user):
+        if system_prompt == tmpl_sys:
+            return {"subject": f"RFQ: {user['category']}", "body": "Dear {supplier_name}, {price} please."}
+        return {"subject": f"Personal RFQ for {user['supplier_name']}", "body": "Hi."}
+
+    calls = _fake_llm(monkeypatch, answer)
+    emails = agent.prepare_initial_emails(_grouped())
+
+    assert sorted(u.get("category") for s, u in calls if s == tmpl_sys) == ["Bearings", "Fasteners"]
+    assert [u["supplier_name"] for s, u in calls if s != tmpl_sys] == ["Supplier 2"]
+    assert [(e["meta"]["category"], e["to_email"]) for e in emails] == \
+        [("Bearings", f"s{i}@example.com") for i in range(4)] + [("Fasteners", f"s{i}@example.com") for i in range(2)]
+    first = emails[0]
+    assert first["subject"] == "RFQ: Bearings"
+    assert first["body"] == "Dear Supplier 0, {price} please."  # stray braces survive rendering
+    assert first["meta"]["sku_ids"] == ["SKU-001", "SKU-002"]
+    assert emails[2]["subject"] == "Personal RFQ for Supplier 2"
+
+
+def test_per_supplier_mode_composes_every_email_with_the_llm(monkeypatch):
+    monkeypatch.setattr(config, "EMAIL_COMPOSE_MODE", "per_supplier")
+    calls = _fake_llm(monkeypatch, lambda s, u: {"subject": f"RFQ for {u['supplier_name']}"})
+    emails = agent.prepare_initial_emails(_grouped())
+    assert len(calls) == len(emails) == 6
+    assert emails[1]["subject"] == "RFQ for Supplier 1"
+    assert emails[1]["body"].startswith("Hello Supplier 1")
+
+
+def _replies():
+    return [
+        {"supplier": "Acme", "sku_id": "SKU-001", "components": {"price": 10}, "raw_reply": ""},
+        {"supplier": "Globex", "sku_id": "SKU-001", "components": {}, "raw_reply": "USD 12 per unit, 95% OTIF."},
+        {"supplier": "Initech", "sku_id": "SKU-001", "components": {}, "raw_reply": "We can do 11.50, net 45."},
+        {"supplier": "Globex", "sku_id": "SKU-001", "components": {}, "raw_reply": "USD 12 per unit, 95% OTIF."},
+    ]
+
+
+def test_free_text_replies_are_extracted_in_batches_and_cached(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(config, "LLM_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(config, "REPLY_EXTRACT_BATCH_SIZE", 10)
+    batch_sys = config.get_prompt("REPLY_EXTRACT_BATCH_SYS")
+    prices = {"Globex": 12, "Initech": 11.5}
+
+    def answer(system_prompt, user):
+        assert system_prompt == batch_sys
+        # "OTIF" is not a number: dropped by the cleanup
+        return {"items": [{"id": it["id"], "components": {"price": prices[it["supplier"]], "OTIF": "95%"}}
+                          for it in user["items"]]}
+
+    calls = _fake_llm(monkeypatch, answer)
+    out = list(agent.extract_reply_components(_replies()))
+    assert len(calls) == 1 and len(calls[0][1]["items"]) == 2  # the repeated body is asked once
+    assert [r["supplier"] for r in out] == ["Acme", "Globex", "Initech", "Globex"]
+    assert [r["components"] for r in out] == [{"price": 10}, {"price": 12}, {"price": 11.5}, {"price": 12}]
+
+    again = list(agent.extract_reply_components(_replies()))
+    assert len(calls) == 1  # served from the cache
+    assert [r["components"] for r in again] == [r["components"] for r in out]
+
+
+def test_items_missing_from_a_batch_answer_fall_back_to_single_requests(monkeypatch):
+    monkeypatch.setattr(config, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "REPLY_EXTRACT_BATCH_SIZE", 10)
+    batch_sys = config.get_prompt("REPLY_EXTRACT_BATCH_SYS")
+
+    def answer(system_prompt, user):
+        if system_prompt == batch_sys:
+            return {"items": [{"id": "0", "components": {"price": 12}}]}
+        return {"components": {"price": [11, 12]}}
+
+    calls = _fake_llm(monkeypatch, answer)
+    out = list(agent.extract_reply_components(_replies()[:3]))
+    assert [u.get("supplier") for s, u in calls if s != batch_sys] == ["Initech"]
+    assert out[2]["components"] == {"price": [11, 12]}
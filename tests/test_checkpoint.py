@@ -0,0 +1,28 @@
+from backend import checkpoint
+from backend.bid_store import BidStore
+from backend.models import Score, Scorecard, ScoringFormula, scorecard_from_json
+
+
+def test_stage_outputs_round_trip_as_json(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint.config, "CHECKPOINT_DIR", tmp_path)
+    ck = checkpoint.Checkpointer("run-a", enabled=True)
+    card = Scorecard("s1", [Score("SKU-001", "Acme", "Acme", 0.5, {"price": 1.0})], ScoringFormula(weights={"price": 1.0}))
+    assert ck.stage("scorecard", [1], lambda: card, load=scorecard_from_json) is card
+    assert (tmp_path / "run-a" / "scorecard.json").exists()
+
+    calls = []
+    again = ck.stage("scorecard", [1], lambda: calls.append(1), load=scorecard_from_json)
+    assert again == card and not calls
+
+    bids = BidStore.from_bids([{"sku_id": "SKU-001", "supplier_name": "Acme", "components": {"price": [1, 3]}}])
+    ck.stage("bids", [1], lambda: bids, dump=BidStore.to_dict, load=BidStore.from_dict)
+    restored = ck.peek("bids", load=BidStore.from_dict)
+    assert restored.rows_for("SKU-001") == bids.rows_for("SKU-001")
+
+
+def test_unreadable_checkpoint_is_recomputed(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint.config, "CHECKPOINT_DIR", tmp_path)
+    (tmp_path / "run-a").mkdir()
+    (tmp_path / "run-a" / "formula.json").write_bytes(b"\x80\x04not json")
+    ck = checkpoint.Checkpointer("run-a", enabled=True)
+    assert ck.stage("formula", [], lambda: {"weights": {}}) == {"weights": {}}
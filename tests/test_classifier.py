@@ -0,0 +1,36 @@
+import pytest
+
+from backend import classifier, config
+
+
+@pytest.fixture
+def fresh(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "CLASSIFIER_EXAMPLES", tmp_path / "examples.jsonl")
+    monkeypatch.setattr(config, "CATEGORY_RULES_FILE", "")
+    monkeypatch.setattr(classifier, "_RULES", None)
+    monkeypatch.setattr(classifier, "_INDEX", None)
+
+
+@pytest.mark.parametrize("title", ["bearing_spec", "ball_bearing_000001", "deep-groove-bearing"])
+def test_rules_match_file_stem_titles(fresh, monkeypatch, title):
+    monkeypatch.setattr(config, "CLASSIFIER_DEMO_RULES", True)
+    assert classifier.match_rules(title)["category"] == "Ball Bearings"
+
+
+def test_demo_rules_are_off_by_default(fresh, monkeypatch):
+    monkeypatch.setattr(config, "CLASSIFIER_DEMO_RULES", False)
+    assert classifier.classify({"title": "managed services contract"}) is None
+
+
+def test_unreviewed_llm_answers_are_not_learned(fresh, monkeypatch):
+    monkeypatch.setattr(config, "CLASSIFIER_AUTO_LEARN", False)
+    quotes = [{"title": "hex bolt m8", "category": "Fasteners", "confidence": 0.99}]
+    assert classifier.learn(quotes) == 0
+    assert classifier.confirm_quotes(quotes) == 1
+    assert classifier.classify({"title": "hex bolt m8"})["category"] == "Fasteners"
+
+
+def test_examples_change_the_state_digest(fresh):
+    before = classifier.state_digest()
+    classifier.confirm_quotes([{"title": "hex bolt m8", "category": "Fasteners"}])
+    assert classifier.state_digest() != before
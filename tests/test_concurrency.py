@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from backend import concurrency
+
+
+def test_map_bounded_keeps_input_order_and_caps_in_flight_calls():
+    lock = threading.Lock()
+    state = {"now": 0, "peak": 0}
+
+    def work(i):
+        with lock:
+            state["now"] += 1
+            state["peak"] = max(state["peak"], state["now"])
+        time.sleep(0.02 * (5 - i % 5))  # early items finish last
+        with lock:
+            state["now"] -= 1
+        return i * i
+
+    assert concurrency.map_bounded(work, range(12), max_workers=3) == [i * i for i in range(12)]
+    assert state["peak"] == 3
+
+
+def test_imap_bounded_pulls_items_lazily():
+    pulled = []
+
+    def items():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+
+    it = concurrency.imap_bounded(lambda i: i, items(), max_workers=2)
+    assert [next(it) for _ in range(3)] == [0, 1, 2]
+    assert len(pulled) <= 5
+    it.close()
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_first_error_propagates_and_pending_work_is_cancelled(workers):
+    started = []
+
+    def work(i):
+        started.append(i)
+        if i == 2:
+            raise ValueError("bad item")
+        time.sleep(0.01)
+        return i
+
+    with pytest.raises(ValueError, match="bad item"):
+        concurrency.map_bounded(work, range(50), max_workers=workers)
+    assert len(started) < 50
+
+
+def test_rate_limiter_blocks_once_the_window_is_full(monkeypatch):
+    clock = {"t": 1000.0}
+    sleeps = []
+
+    def sleep(s):
+        sleeps.append(s)
+        clock["t"] += s
+
+    monkeypatch.setattr(time, "monotonic", lambda: clock["t"])
+    monkeypatch.setattr(time, "sleep", sleep)
+    limiter = concurrency.RateLimiter(per_minute=2)
+    limiter.acquire()
+    clock["t"] += 10
+    limiter.acquire()
+    assert sleeps == []
+    limiter.acquire()  # waits until the first stamp leaves the window
+    assert sleeps == [pytest.approx(50.0)]
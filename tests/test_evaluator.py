@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from backend import evaluator
+from backend.bid_store import BidStore
+from backend.models import ScoringFormula
+
+FORMULA = ScoringFormula(
+    weights={"price": 0.5, "OTIF": 0.2, "payment_timeline": 0.2, "specification": 0.1},
+    directions={"price": "lower", "OTIF": "higher", "payment_timeline": "higher", "specification": "higher"},
+    min_values={"OTIF": 90.0},
+    max_values={"price": 150.0},
+)
+
+
+def _quotes(seed=7, skus=6, suppliers=5):
+    rnd = random.Random(seed)
+    quotes = []
+    for s in range(skus):
+        comps = {}
+        for comp in ("price", "OTIF", "payment_timeline", "specification", "warranty"):
+            bids = []
+            for k in range(suppliers):
+                if rnd.random() < 0.2:
+                    continue  # no bid on this component
+                value = None if rnd.random() < 0.1 else round(rnd.uniform(50, 200), 2)
+                if comp == "specification":
+                    value = 1  # flat span
+                bids.append({"supplier": f"sup-{k}", "value": value})
+            comps[comp] = {"supplier_bids": bids}
+        quotes.append({"sku_id": f"SKU-{s:03d}", "components": comps})
+    return quotes
+
+
+def _scalar_scores(quotes, formula):
+    """The per-bid loop score_bids used before it was vectorized."""
+    rows = []
+    for q in quotes:
+        comp_map = q.get("components", {})
+        suppliers = {b["supplier"] for obj in comp_map.values() for b in obj.get("supplier_bids", [])}
+        for supplier in suppliers:
+            vals = {}
+            for comp, obj in comp_map.items():
+                val = next((b.get("value") for b in obj.get("supplier_bids", []) if b["supplier"] == supplier), None)
+                if isinstance(val, (int, float)):
+                    vals[comp] = float(val)
+            rows.append((q["sku_id"], supplier, vals))
+    all_vals = {}
+    for _, _, vals in rows:
+        for k, v in vals.items():
+            all_vals.setdefault(k, []).append(v)
+    mins = {k: min(v) for k, v in all_vals.items()}
+    maxs = {k: max(v) for k, v in all_vals.items()}
+    out = {}
+    for sku, supplier, vals in rows:
+        comp_scores, total = {}, 0.0
+        for comp, weight in formula.weights.items():
+            if comp not in vals:
+                continue
+            raw = vals[comp]
+            lo = formula.min_values.get(comp, mins[comp])
+            hi = formula.max_values.get(comp, maxs[comp])
+            if hi == lo:
+                norm = 1.0
+            else:
+                t = (raw - lo) / (hi - lo)
+                if formula.directions.get(comp, "higher") == "lower":
+                    t = 1.0 - t
+                norm = max(0.0, min(1.0, t))
+            comp_scores[comp] = round(norm, 4)
+            total += weight * norm
+        out[(sku, supplier)] = (round(total, 4), comp_scores)
+    return out
+
+
+@pytest.mark.parametrize("packed", ["quotes", "bid_store"])
+def test_vectorized_scores_match_the_scalar_path(packed):
+    quotes = _quotes()
+    bids = quotes if packed == "quotes" else BidStore.from_quotes(quotes)
+    card = evaluator.score_bids(bids, FORMULA)
+    got = {(s.sku_id, s.supplier_id): (s.total_score, s.component_scores) for s in card.scores}
+    expected = _scalar_scores(quotes, FORMULA)
+    assert got.keys() == expected.keys()
+    for key, (total, comps) in expected.items():
+        assert got[key][0] == pytest.approx(total, abs=1e-4)
+        assert got[key][1] == pytest.approx(comps, abs=1e-4)
+
+
+def test_pack_bids_rows_follow_first_seen_order_and_first_bid_wins():
+    quotes = [{"sku_id": "SKU-001", "components": {
+        "price": {"supplier_bids": [{"supplier": "b", "value": 5}, {"supplier": "a", "value": 7}, {"supplier": "b", "value": 9}]},
+        "OTIF": {"supplier_bids": [{"supplier": "c", "value": "n/a"}]},
+    }}]
+    keys, comps, values, present = evaluator._pack_bids(quotes)
+    assert keys == [("SKU-001", "b"), ("SKU-001", "a"), ("SKU-001", "c")]
+    assert comps == ["price"]
+    assert values[:, 0].tolist()[:2] == [5.0, 7.0]
+    assert present[:, 0].tolist() == [True, True, False]
+
+
+def test_empty_input_scores_nothing():
+    assert evaluator.score_bids([], FORMULA).scores == []
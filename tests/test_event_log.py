@@ -0,0 +1,16 @@
+from backend import event_log as log
+from backend import log_store
+
+
+def test_console_echo_is_batched_with_the_flush_and_level_gated(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(log_store, "LOG_DIR", tmp_path)
+    monkeypatch.setattr(log, "STDOUT", True)
+    monkeypatch.setattr(log, "STDOUT_LEVEL", "INFO")
+    log.flush()
+    capsys.readouterr()
+    log.log_event("stage", "started")
+    log.log_event("stage", "detail", level="DEBUG")
+    log.log_event("stage", "done")
+    log.flush()
+    out = capsys.readouterr().out.splitlines()
+    assert [line.split("] ", 1)[1] for line in out] == ["stage: started", "stage: done"]
@@ -0,0 +1,23 @@
+from PIL import Image
+
+from backend import config, image_prep
+
+
+def _image(path, seed):
+    Image.effect_noise((64, 64), 40 + seed).convert("RGB").save(path, "PNG")
+    return str(path)
+
+
+def test_disk_cache_stays_within_budget_and_keeps_recent_entries(monkeypatch, tmp_path):
+    cache = tmp_path / "cache"
+    monkeypatch.setattr(config, "IMAGE_CACHE_DIR", cache)
+    monkeypatch.setattr(image_prep, "_DISK", image_prep.DiskLRU("*.jpg"))
+    monkeypatch.setattr(image_prep, "_MEM", image_prep.OrderedDict())
+    one = len(image_prep.encode_jpeg(_image(tmp_path / "probe.png", 0)))
+    monkeypatch.setattr(config, "IMAGE_CACHE_MAX_BYTES", one * 3)
+    for i in range(1, 8):
+        image_prep.encode_jpeg(_image(tmp_path / f"{i}.png", i))
+    files = list(cache.glob("*.jpg"))
+    assert sum(p.stat().st_size for p in files) <= config.IMAGE_CACHE_MAX_BYTES
+    last = image_prep._disk_path(image_prep._cache_key(image_prep.file_digest(tmp_path / "7.png")))
+    assert last.exists()
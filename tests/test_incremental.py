@@ -0,0 +1,29 @@
+from backend import evaluator
+from backend.bid_store import BidStore
+from backend.incremental import IncrementalScorer
+from backend.models import ScoringFormula
+
+FORMULA = ScoringFormula(weights={"price": 0.7, "OTIF": 0.3}, directions={"price": "lower", "OTIF": "higher"})
+
+
+def _bid(sku, supplier, **components):
+    return {"sku_id": sku, "supplier_name": supplier, "components": components, "raw_reply": f"{supplier} on {sku}"}
+
+
+def _scores(scorecard):
+    return sorted((s.sku_id, s.supplier_name, s.total_score) for s in scorecard.scores)
+
+
+def test_late_bids_update_the_store_and_match_a_full_rescore():
+    store = BidStore.from_bids([_bid("SKU-001", "Acme", price=10.0, OTIF=95.0),
+                                _bid("SKU-001", "Globex", price=12.0, OTIF=99.0),
+                                _bid("SKU-002", "Acme", price=5.0)], sku_ids=["SKU-001", "SKU-002"])
+    scorer = IncrementalScorer.from_store(store, FORMULA)
+    scorer.apply([_bid("SKU-001", "Globex", price=8.0),   # replaces Globex's price
+                  _bid("SKU-002", "Initech", price=4.0, OTIF=90.0),
+                  _bid("SKU-002", "Hooli")])               # empty reply: no row anywhere
+    assert scorer.store is store
+    rows = {r["supplier"]: r for r in store.rows_for("SKU-001")}
+    assert rows["Globex"]["price"] == 8.0 and rows["Globex"]["OTIF"] == 99.0
+    assert [r["supplier"] for r in store.rows_for("SKU-002")] == ["Acme", "Initech"]
+    assert _scores(scorer.scorecard()) == _scores(evaluator.score_bids(store, FORMULA))
@@ -0,0 +1,123 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from backend import concurrency, config, llm
+from backend.concurrency import CircuitBreaker
+from backend.llm_mock import MockBackend, MockProviderError
+
+SYS = config.get_prompt("CATEGORIZE_SKU_SERVICE_SYS")
+USER = '{"sku_id": "SKU-001", "title": "6204 ball bearing"}'
+
+
+class ScriptedBackend(MockBackend):
+    """MockBackend whose first calls follow a script: an exception to raise or a raw text to return."""
+    def __init__(self, *script):
+        super().__init__(latency_ms=0, error_rate=0, bad_json_rate=0)
+        self.script = list(script)
+        self.systems = []
+
+    def generate(self, system_prompt, user_prompt, images=None):
+        self.systems.append(system_prompt)
+        step = self.script.pop(0) if self.script else None
+        if isinstance(step, Exception):
+            raise step
+        if isinstance(step, str):
+            return step, None, 0
+        return super().generate(system_prompt, user_prompt, images)
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    monkeypatch.setattr(config, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "LLM_MAX_RETRIES", 4)
+    monkeypatch.setattr(config, "LLM_BACKOFF_BASE_S", 0.001)
+    monkeypatch.setattr(config, "LLM_BREAKER_THRESHOLD", 2)
+    monkeypatch.setattr(config, "LLM_BREAKER_COOLDOWN_S", 0.05)
+    monkeypatch.setattr(concurrency, "_LLM_BREAKER", None)
+    sleeps = []
+    real_sleep = time.sleep
+    monkeypatch.setattr(time, "sleep", lambda s: (sleeps.append(s), real_sleep(min(s, 0.01))))
+
+    def install(backend):
+        monkeypatch.setattr(llm, "_BACKEND", backend)
+        return backend
+    return SimpleNamespace(install=install, sleeps=sleeps)
+
+
+def test_429_waits_for_retry_after_then_succeeds(gateway):
+    backend = gateway.install(ScriptedBackend(MockProviderError(429, "slow down", retry_after=0.25)))
+    assert llm.generate_json(SYS, USER)["category"]
+    assert len(backend.systems) == 2
+    assert gateway.sleeps == [0.25]
+    assert not concurrency.llm_breaker().is_open
+
+
+def test_non_transient_errors_raise_without_retry(gateway):
+    backend = gateway.install(ScriptedBackend(MockProviderError(400, "bad request")))
+    with pytest.raises(MockProviderError):
+        llm.generate_json(SYS, USER)
+    assert len(backend.systems) == 1
+
+
+def test_repeated_503s_open_the_breaker_and_a_probe_closes_it(gateway):
+    backend = gateway.install(ScriptedBackend(MockProviderError(503, "unavailable"), MockProviderError(503, "unavailable")))
+    t0 = time.monotonic()
+    assert llm.generate_json(SYS, USER)["category"]
+    breaker = concurrency.llm_breaker()
+    assert breaker.opened == 1 and not breaker.is_open
+    assert time.monotonic() - t0 >= config.LLM_BREAKER_COOLDOWN_S  # the probe waited out the cooldown
+    assert len(backend.systems) == 3
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=1, cooldown_s=0.05)
+    assert breaker.failure() and breaker.is_open
+    assert breaker.before_call() >= 0.04  # waited out the cooldown; this caller is the probe
+    waited = []
+    other = threading.Thread(target=lambda: waited.append(breaker.before_call()))
+    other.start()
+    time.sleep(0.1)
+    assert not waited  # held back while the probe is in flight
+    breaker.success()
+    other.join(1)
+    assert waited and not breaker.is_open
+
+
+def test_unparseable_answer_is_reasked_with_the_strict_suffix(gateway):
+    backend = gateway.install(ScriptedBackend("Sure! Here is the JSON: {\"category\": "))
+    assert llm.generate_json(SYS, USER)["category"]
+    assert backend.systems == [SYS, SYS + llm.STRICT_JSON_SUFFIX]
+
+
+def _gemini(monkeypatch, error):
+    calls = []
+
+    def generate_content(model, contents, config):
+        calls.append(dict(config))
+        if "cached_content" in config:
+            raise error
+        return SimpleNamespace(text='{"ok": true}', usage_metadata=None)
+
+    client = SimpleNamespace(models=SimpleNamespace(generate_content=generate_content),
+                             caches=SimpleNamespace(create=lambda model, config: SimpleNamespace(name="caches/sys")))
+    monkeypatch.setattr(llm, "_CLIENT", client)
+    monkeypatch.setattr(llm, "_CONTEXT_CACHES", {})
+    monkeypatch.setattr(config, "LLM_CONTEXT_CACHE_MIN_TOKENS", 1)
+    return calls
+
+
+def test_transient_error_with_a_context_cache_is_not_retried_inline(monkeypatch):
+    calls = _gemini(monkeypatch, MockProviderError(503, "unavailable"))
+    with pytest.raises(MockProviderError):
+        llm.GeminiBackend().generate(SYS, USER)
+    assert len(calls) == 1 and llm._CONTEXT_CACHES  # left to generate_json's backoff; cache kept
+
+
+def test_expired_context_cache_falls_back_to_the_inline_prompt(monkeypatch):
+    calls = _gemini(monkeypatch, MockProviderError(404, "CachedContent not found (expired)"))
+    text, _, retries = llm.GeminiBackend().generate(SYS, USER)
+    assert text == '{"ok": true}' and retries == 1
+    assert "cached_content" not in calls[-1] and not llm._CONTEXT_CACHES
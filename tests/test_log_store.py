@@ -0,0 +1,22 @@
+import json
+
+from backend import log_store
+
+
+def _write(run_id, n):
+    # one flush batch, one (step, level) group spanning ts 0..n-1
+    recs = [("step", "INFO", float(i), json.dumps({"step": "step", "level": "INFO", "ts": float(i), "i": i}))
+            for i in range(n)]
+    log_store.append_batch(run_id, recs)
+
+
+def test_time_range_is_applied_before_paging(monkeypatch, tmp_path):
+    monkeypatch.setattr(log_store, "LOG_DIR", tmp_path)
+    monkeypatch.setattr(log_store, "_INDEX_CACHE", {})
+    _write("r1", 100)
+    page, total = log_store.query("r1", t0=40, t1=59, offset=0, limit=10)
+    assert total == 20
+    assert [r["i"] for r in page] == list(range(40, 50))
+    page, _ = log_store.query("r1", t0=40, t1=59, offset=10, limit=10)
+    assert [r["i"] for r in page] == list(range(50, 60))
+
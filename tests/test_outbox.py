@@ -0,0 +1,84 @@
+import threading
+import time
+
+from backend import config, email_client, outbox
+
+
+def _email(titles=("6204 bearing", "6205 bearing")):
+    skus = [{"sku_id": f"SKU-00{i + 1}", "title": t} for i, t in enumerate(titles)]
+    meta = {"category": "Bearings", "supplier_id": "sup-1", "sku_ids": [s["sku_id"] for s in skus],
+            "items_digest": outbox.items_digest(skus)}
+    return {"to_email": "sales@acme.example", "to_name": "Acme", "subject": "RFQ", "body": "Please quote.", "meta": meta}
+
+
+def _demo_outbox(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "RESULTS_DIR", tmp_path)
+    monkeypatch.setattr(config, "OUTBOX_DB", tmp_path / "outbox.db")
+    monkeypatch.setattr(config, "DEMO_MODE", True)
+
+
+def test_restarted_run_skips_what_was_sent(monkeypatch, tmp_path):
+    _demo_outbox(monkeypatch, tmp_path)
+    email_client.send_batch([_email()])
+    again = email_client.send_batch([dict(_email(), subject="RFQ (reworded)")])
+    assert [r["status"] for r in again] == ["already_sent"]
+    assert outbox.counts() == {outbox.SENT: 1}
+
+
+def test_same_positional_skus_for_other_items_still_send(monkeypatch, tmp_path):
+    _demo_outbox(monkeypatch, tmp_path)
+    first = email_client.send_batch([_email()])
+    second = email_client.send_batch([_email(("M8 washer", "M10 washer"))])
+    assert [r["mode"] for r in first + second] == ["demo_outbox", "demo_outbox"]
+    assert outbox.counts() == {outbox.SENT: 2}
+
+
+def test_failed_messages_are_retried_only_on_request(monkeypatch, tmp_path):
+    _demo_outbox(monkeypatch, tmp_path)
+    monkeypatch.setattr(config, "EMAIL_MAX_RETRIES", 0)
+    rejected = _email(("bad address",))
+    throttled = _email()
+    transport = email_client.OfflineTransport({"sales@acme.example": [400, 429]})
+    email_client.send_batch([rejected], transport=transport)
+    email_client.send_batch([throttled], transport=transport)
+    assert outbox.counts() == {outbox.FAILED: 2}
+
+    assert email_client.drain(transport=email_client.OfflineTransport()) == []
+    retried = email_client.drain(transport=email_client.OfflineTransport(), retry_failed=True)
+    assert [r["key"] for r in retried] == [outbox.idempotency_key(throttled)]  # the 400 is permanent
+    assert outbox.counts() == {outbox.FAILED: 1, outbox.SENT: 1}
+
+
+def test_in_flight_rows_are_reclaimed_only_after_their_lease_lapses(monkeypatch, tmp_path):
+    _demo_outbox(monkeypatch, tmp_path)
+    monkeypatch.setattr(config, "OUTBOX_LEASE_S", 60)
+    keys = outbox.enqueue([_email()])
+    assert len(outbox.claim(keys, owner="a")) == 1
+    assert outbox.claim(keys, owner="b") == []  # a is still sending it
+    assert outbox.renew("a") == 1
+    monkeypatch.setattr(time, "time", lambda real=time.time: real() + 120)
+    assert len(outbox.claim(keys, owner="b")) == 1  # a crashed: its lease lapsed
+    assert outbox.renew("a") == 0
+
+
+def test_drain_closes_the_transport_and_its_connections(monkeypatch, tmp_path):
+    _demo_outbox(monkeypatch, tmp_path)
+    closed = []
+
+    class Recording(email_client.OfflineTransport):
+        def close(self):
+            closed.append(len(self.sent))
+
+    email_client.send_batch([_email("run-a")], transport=Recording())
+    assert closed == [1]
+
+    sg = email_client.SendGridTransport("key")
+    conns = [sg._conn()]
+    t = threading.Thread(target=lambda: conns.append(sg._conn()))
+    t.start()
+    t.join()
+    closes = []
+    for c in conns:
+        monkeypatch.setattr(c, "close", lambda c=c: closes.append(c))
+    sg.close()
+    assert sorted(map(id, closes)) == sorted(map(id, conns)) and len(conns) == 2
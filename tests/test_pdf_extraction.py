@@ -0,0 +1,36 @@
+import signal
+import sys
+import time
+import types
+
+import pytest
+
+from backend import agent_functions as F
+
+
+class _SlowReader:
+    def __init__(self, *args, **kwargs):
+        time.sleep(5)
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGALRM"), reason="timeout is enforced with SIGALRM")
+def test_slow_pdf_times_out(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pypdf", types.SimpleNamespace(PdfReader=_SlowReader))
+    t0 = time.time()
+    result = F._pdf_job("slow.pdf", b"%PDF-1.4", [], 0.5)
+    assert result["timed_out"] is True
+    assert result["text"] == ""
+    assert time.time() - t0 < 3
+
+    with F.log.span("test") as sp:
+        item = F._pdf_item("SKU-001", "slow.pdf", result, sp)
+    assert item.metadata["note"] == "PDF extraction timed out"
+
+
+def test_unreadable_pdf_is_not_a_timeout(monkeypatch):
+    def broken(*args, **kwargs):
+        raise ValueError("not a PDF")
+    monkeypatch.setitem(sys.modules, "pypdf", types.SimpleNamespace(PdfReader=broken))
+    result = F._pdf_job("broken.pdf", b"nope", [], 0.5)
+    assert result["timed_out"] is False
+    assert result["text"] == ""
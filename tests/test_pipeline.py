@@ -0,0 +1,53 @@
+import json
+
+from backend import checkpoint, pipeline
+from backend.reply_sources import Cursor, DirectorySource
+
+QUOTES = [{"sku_id": "SKU-001"}, {"sku_id": "SKU-002"}]
+
+
+def _reply(inbox, name, supplier, sku, price):
+    (inbox / name).write_text(json.dumps({"supplier": supplier, "sku_id": sku, "components": {"price": price}}),
+                              encoding="utf-8")
+
+
+def _source(tmp_path):
+    return DirectorySource(tmp_path / "inbox", cursor=Cursor("directory:run-a", tmp_path / "cursor.db"))
+
+
+def test_bids_extend_from_the_cursor_and_key_on_its_position(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint.config, "CHECKPOINT_DIR", tmp_path / "ck")
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    _reply(inbox, "a1.json", "Acme", "SKU-001", 10)
+    _reply(inbox, "a2.json", "Acme", "SKU-002", 20)
+    ck = checkpoint.Checkpointer("run-a", enabled=True)
+    bids = pipeline.build_bids(ck, QUOTES, _source(tmp_path))
+    first = ck.keys["bids"]
+    assert len(bids) == 2
+    assert list(_source(tmp_path)) == []  # acked once the bids were stored
+
+    # Nothing new: same key, so downstream stages hit their checkpoints
+    ck = checkpoint.Checkpointer("run-a", enabled=True)
+    assert len(pipeline.build_bids(ck, QUOTES, _source(tmp_path))) == 2
+    assert ck.keys["bids"] == first
+
+    # A late reply is packed on top of the stored bids; the earlier files are not re-read
+    (inbox / "a1.json").unlink()
+    _reply(inbox, "g1.json", "Globex", "SKU-001", 9)
+    ck = checkpoint.Checkpointer("run-a", enabled=True)
+    bids = pipeline.build_bids(ck, QUOTES, _source(tmp_path))
+    assert ck.keys["bids"] != first
+    assert sorted(r["supplier"] for r in bids.rows_for("SKU-001")) == ["Acme", "Globex"]
+    assert pipeline.load_bids(ck).rows_for("SKU-001") == bids.rows_for("SKU-001")
+
+
+def test_changed_inputs_repack_every_reply(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint.config, "CHECKPOINT_DIR", tmp_path / "ck")
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    _reply(inbox, "a1.json", "Acme", "SKU-001", 10)
+    pipeline.build_bids(checkpoint.Checkpointer("run-a", enabled=True), QUOTES[:1], _source(tmp_path))
+    _reply(inbox, "a2.json", "Acme", "SKU-002", 20)
+    bids = pipeline.build_bids(checkpoint.Checkpointer("run-a", enabled=True), QUOTES, _source(tmp_path))
+    assert bids.rows_for("SKU-001") and bids.rows_for("SKU-002")
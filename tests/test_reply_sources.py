@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from backend.reply_sources import Cursor, DirectorySource
+
+
+def _drop(path, n):
+    for i in range(n):
+        (path / f"r{i}.json").write_text(json.dumps({"supplier": "Acme", "sku_id": f"SKU-{i:03d}",
+                                                     "components": {"price": i}}), encoding="utf-8")
+
+
+def _source(tmp_path):
+    return DirectorySource(tmp_path / "inbox", cursor=Cursor("directory", tmp_path / "cursor.db"))
+
+
+def test_failed_consumer_leaves_replies_unacked(tmp_path):
+    (tmp_path / "inbox").mkdir()
+    _drop(tmp_path / "inbox", 5)
+    with pytest.raises(RuntimeError):
+        for i, _ in enumerate(_source(tmp_path)):
+            if i == 3:
+                raise RuntimeError("extraction failed")
+    assert len(list(_source(tmp_path))) == 5
+
+
+def test_abandoned_iteration_leaves_replies_unacked(tmp_path):
+    (tmp_path / "inbox").mkdir()
+    _drop(tmp_path / "inbox", 5)
+    it = iter(_source(tmp_path))
+    next(it), next(it)
+    it.close()
+    assert len(list(_source(tmp_path))) == 5
+
+
+def test_acked_replies_are_skipped(tmp_path):
+    (tmp_path / "inbox").mkdir()
+    _drop(tmp_path / "inbox", 5)
+    src = _source(tmp_path)
+    assert len(list(src)) == 5
+    assert list(src) == []  # delivered, awaiting the ack: not handed out twice
+    assert len(list(_source(tmp_path))) == 5  # nothing persisted before commit()
+    src.commit()
+    assert list(_source(tmp_path)) == []
+    _drop(tmp_path / "inbox", 6)
+    assert [r["sku_id"] for r in _source(tmp_path)] == ["SKU-005"]
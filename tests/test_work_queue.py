@@ -0,0 +1,67 @@
+import time
+
+from backend import config
+from backend.work_queue import CLAIMED, DONE, FAILED, QUEUED, WorkQueue, worker_name
+
+
+def _queue(tmp_path, shards=("s1",)):
+    q = WorkQueue(tmp_path / "queue.db")
+    q.open_run("r1")
+    q.put("r1", "specs", [(s, {"shard": s}) for s in shards])
+    return q
+
+
+def _later(monkeypatch, seconds):
+    monkeypatch.setattr(time, "time", lambda real=time.time: real() + seconds)
+
+
+def test_lapsed_lease_is_taken_over_and_the_old_worker_loses_it(tmp_path, monkeypatch):
+    q = _queue(tmp_path)
+    mine = q.claim("r1", worker_name(), lease_s=60)
+    assert mine["payload"] == {"shard": "s1"} and mine["worker"] == worker_name()
+    assert q.claim("r1", "node-b:1", lease_s=60) is None  # leased
+    assert q.extend(mine, lease_s=60)
+
+    _later(monkeypatch, 120)  # this worker stopped heartbeating
+    theirs = q.claim("r1", "node-b:1", lease_s=60)
+    assert theirs["shard"] == "s1" and theirs["attempts"] == 2
+    assert not q.extend(mine)
+    q.complete(mine, {"late": True})  # ignored: no longer its task
+    q.complete(theirs, {"ok": True})
+    assert q.counts("r1") == {DONE: 1}
+    assert list(q.results("r1", "specs")) == [("s1", {"ok": True})]
+
+
+def test_failures_requeue_until_attempts_run_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WORK_MAX_ATTEMPTS", 2)
+    q = _queue(tmp_path)
+    q.fail(q.claim("r1", "w1"), "boom")
+    assert q.counts("r1") == {QUEUED: 1}
+    q.fail(q.claim("r1", "w1"), "boom again")
+    assert q.counts("r1") == {FAILED: 1}
+    assert q.errors("r1", "specs") == [{"shard": "s1", "attempts": 2, "error": "boom again"}]
+    assert q.claim("r1", "w1") is None
+
+    q.put("r1", "specs", [("s1", {"shard": "s1"})])  # resumed run: failed shards get fresh attempts
+    assert q.claim("r1", "w1")["attempts"] == 1
+
+
+def test_expired_lease_without_attempts_left_is_marked_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WORK_MAX_ATTEMPTS", 1)
+    q = _queue(tmp_path)
+    q.claim("r1", "w1", lease_s=1)
+    _later(monkeypatch, 5)
+    assert q.claim("r1", "w2") is None
+    assert q.errors("r1", "specs")[0]["error"] == "lease expired"
+
+
+def test_put_keeps_finished_shards_and_results_page_in_shard_order(tmp_path):
+    q = _queue(tmp_path, shards=[f"s{i:02d}" for i in range(5)])
+    while (task := q.claim("r1", "w1")) is not None:
+        q.complete(task, task["shard"].upper())
+    assert q.put("r1", "specs", [(f"s{i:02d}", {}) for i in range(6)]) == 1
+    assert q.counts("r1") == {DONE: 5, QUEUED: 1}
+    assert [r for _, r in q.results("r1", "specs", page=2)] == [f"S{i:02d}" for i in range(5)]
+    assert q.claim("r1", "w1")["state"] == CLAIMED
+    q.close_run("r1")
+    assert q.run_state("r1") == "closed"